@@ -1,7 +1,18 @@
+import argparse
+import logging
 import matplotlib.pyplot as plt
-import pandas as pd
 import numpy as np
 from scipy import stats
+import sys
+import yaml
+
+import pi_compress
+import pi_dataset
+import pi_pipeline
+import pi_regression
+import pi_stats
+
+DEFAULT_CONFIG_YML = "final_code_config.yml"
 
 def read_file(file_path, values):
     """
@@ -21,7 +32,7 @@ def read_file(file_path, values):
     
     """
 
-    f1 = pd.read_csv(file_path) # Use pandas to read the file
+    f1 = pi_compress.read_scan(file_path) # Use pandas to read the file
     data = []
     for v in values:
         if v in f1: # Only append data that can be found in the spreadsheet
@@ -50,25 +61,13 @@ def remove_outliers(change_data, to_change, min_val, max_val):
           elements in the list are the modified iterables from to_change
     """
 
-    # Compute the series detailing which elements are outliers
-    change_data = pd.Series(change_data)
-    outliers = change_data.between(min_val, max_val)
-    change_data = change_data[outliers].tolist()
-    
-    to_return = []
-    to_return.append(change_data)
-
-    # Remove the same elements in each iterable in to_change
-    # to ensure that elements in the iterables in to_change 
-    # and change_data still correspond
-    for i in to_change:
-        i = pd.Series(i)
-        i = i[outliers].tolist()
-        to_return.append(i)
-        
-    return to_return
-
-def graph_avg(x, y, pl, opacity, lbf, title=None, x_title=None, y_title=None, label=None, xlim=None, ylim=None):
+    # Keep change_data and each iterable in to_change as aligned columns
+    # so the same elements are removed from all of them with one mask
+    data = pi_dataset.AlignedColumns({i: c for i, c in enumerate([change_data] + list(to_change))})
+    data, report = data.add_range(0, min_val, max_val).apply()
+    return [data[i].tolist() for i in range(len(to_change) + 1)]
+
+def graph_avg(x, y, pl, opacity, lbf, title=None, x_title=None, y_title=None, label=None, xlim=None, ylim=None, fit=None):
     """
     Creates and displays a matplotlib scatter plot of y vs. x and also
     draws in error bars for the data x collected at each discrete 
@@ -88,22 +87,17 @@ def graph_avg(x, y, pl, opacity, lbf, title=None, x_title=None, y_title=None, la
     label: string (optional) label for the plotted error bars
     x_lim: tuples, minimum and maximum x-values to be displayed
     y_lim: tuples, minimum and maximum x-values to be displayed    
+    fit: dict (optional) precomputed line of best fit, see best_fit
     """
 
     pl.scatter(x, y, marker="o", alpha=opacity) # Create the scatter plot
 
-    # Create a dictionary mapping each y-value to its corresponding x-values
-    d1 = {}
-    d1.clear
-    for x1, y1 in zip(x, y):
-        if x1 not in d1:
-            d1[x1] = []
-        d1[x1].append(y1)
-
-    # Calculate the mean and standard deviation, graph the error bars
-    x_values = list(d1.keys())
-    RSSI_mean = np.array([np.mean(v) for k,v in sorted(d1.items())])
-    RSSI_std = np.array([np.std(v) for k,v in sorted(d1.items())])
+    # Calculate the mean and standard deviation at each x-value, all arrays
+    # are in ascending x-value order, graph the error bars
+    grouped = pi_stats.group_stats(x, y)
+    x_values = grouped['keys']
+    RSSI_mean = grouped['mean']
+    RSSI_std = grouped['std']
     pl.errorbar(x_values, RSSI_mean, yerr=RSSI_std, label=label)
     
     pl.set_title(title)
@@ -120,12 +114,11 @@ def graph_avg(x, y, pl, opacity, lbf, title=None, x_title=None, y_title=None, la
     
     # Graph a line of best fit
     if lbf:
-        x = np.array(x_values)
-        best_fit(x, RSSI_mean, pl)
+        best_fit(x_values, RSSI_mean, pl, fit)
     pl.grid(True)
     pl.legend()
 
-def graph(x, y, pl, opacity, lbf, title=None, x_title=None, y_title=None, xlim=None, ylim=None):
+def graph(x, y, pl, opacity, lbf, title=None, x_title=None, y_title=None, xlim=None, ylim=None, fit=None):
     """
     Creates and displays a matplotlib scatter plot of y vs. x
 
@@ -143,6 +136,7 @@ def graph(x, y, pl, opacity, lbf, title=None, x_title=None, y_title=None, xlim=N
     label: string (optional) label for the plotted error bars
     x_lim: tuples, minimum and maximum x-values to be displayed
     y_lim: tuples, minimum and maximum x-values to be displayed    
+    fit: dict (optional) precomputed line of best fit, see best_fit
     """
 
     pl.scatter(x, y, marker="o", alpha=opacity) # Create the scatter plot
@@ -162,9 +156,9 @@ def graph(x, y, pl, opacity, lbf, title=None, x_title=None, y_title=None, xlim=N
     
     # Graph a line of best fit
     if lbf:
-        best_fit(x, y, pl)
+        best_fit(x, y, pl, fit)
 
-def best_fit(x, y, pl):
+def best_fit(x, y, pl, fit=None):
     """
     Computes and displays the line of best fit and the r^2 value
     for a scatter plot of y vs. x
@@ -176,142 +170,112 @@ def best_fit(x, y, pl):
     x: iterable, x-coordinates of plotted values
     y: iterable, y-coordinates of plotted values
     pl: reference to the already-initialized plot to be used
+    fit: dict (optional) precomputed fit with 'slope', 'intercept' and
+         'rvalue' keys, computed from x and y if not given
     """
-    m, b, r, p, err = stats.linregress(x, y)
+    if fit is None:
+        m, b, r, p, err = stats.linregress(x, y)
+    else:
+        m, b, r = fit['slope'], fit['intercept'], fit['rvalue']
     equation = f"y = {round(m,4)}x + {round(b,4)}\nR^2: {round(r**2,8)}"
     pl.plot(x, m*np.array(x)+b, '-r', label=equation)
     pl.legend()
 
+def plot_analysis(result, plots):
+    """
+    Draws each configured plot of one pipeline analysis in its own figure
 
-###########################################
-### Code to plot RSSI vs. each variable ###
-###########################################
-
-
-### WIND SPEED ###
-# Read wind speed data
-w_RSSI_1, w_RSSI_2, w_wind = read_file("Desktop/Aggregate.csv",["RSSI-Pi1", "RSSI-Pi2", "Wind Speed"])
-
-# Plot wind speed data scatter plot
-fig_w1, ax_w1 = plt.subplots()
-fig_w2, ax_w2 = plt.subplots()
-
-graph_avg(w_wind, w_RSSI_1, ax_w1, 1, False, "Pi 1 RSSI Value vs. Wind Speed", "Wind Speed (km/h)", "RSSI Value", "average RSSI", None, None)
-graph_avg(w_wind, w_RSSI_2, ax_w2, 1, False, "Pi 2 RSSI Value vs. Wind Speed", "Wind Speed (km/h)", "RSSI Value", "average RSSI", None, None)
-
-# Plot wind speed data with a line of best fit
-fig_w1_b, ax_w1_b = plt.subplots()
-fig_w2_b, ax_w2_b = plt.subplots()
-
-graph_avg(w_wind, w_RSSI_1, ax_w1_b, 1, True, "Pi 1 RSSI Value vs. Wind Speed with Best Fit", "Wind Speed (km/h)", "RSSI Value", "average RSSI", None, None)
-graph_avg(w_wind, w_RSSI_2, ax_w2_b, 1, True, "Pi 2 RSSI Value vs. Wind Speed with Best Fit", "Wind Speed (km/h)", "RSSI Value", "average RSSI", None, None)
-### WIND SPEED ###
-
-
-### BAROMETRIC PRESSURE ###
-# Read pressure data
-p_r1_1 = read_file("Desktop/Lee_Audrey_CollectedData/Pressure/pres_pi1_1.csv", ["RSSI"])[0]
-p_r2_1 = read_file("Desktop/Lee_Audrey_CollectedData/Pressure/pres_pi1_2.csv", ["RSSI"])[0]
-p_r3_1 = read_file("Desktop/Lee_Audrey_CollectedData/Pressure/pres_pi1_3.csv", ["RSSI"])[0]
-p_r4_1 = read_file("Desktop/Lee_Audrey_CollectedData/Pressure/pres_pi1_4.csv", ["RSSI"])[0]
-p_r5_1 = read_file("Desktop/Lee_Audrey_CollectedData/Pressure/pres_pi1_5.csv", ["RSSI"])[0]
-
-p1_2, p_r1_2 = read_file("Desktop/Lee_Audrey_CollectedData/Pressure/pres_pi2_1.csv", ["PRESSURE","RSSI"])
-p2_2, p_r2_2 = read_file("Desktop/Lee_Audrey_CollectedData/Pressure/pres_pi2_2.csv", ["PRESSURE","RSSI"])
-p3_2, p_r3_2 = read_file("Desktop/Lee_Audrey_CollectedData/Pressure/pres_pi2_3.csv", ["PRESSURE","RSSI"])
-p4_2, p_r4_2 = read_file("Desktop/Lee_Audrey_CollectedData/Pressure/pres_pi2_4.csv", ["PRESSURE","RSSI"])
-p5_2, p_r5_2 = read_file("Desktop/Lee_Audrey_CollectedData/Pressure/pres_pi2_5.csv", ["PRESSURE","RSSI"])
-
-p = p1_2 + p2_2 + p3_2 + p4_2 + p5_2
-p_r_1 = p_r1_1 + p_r2_1 + p_r3_1 + p_r4_1 + p_r5_1
-p_r_2 = p_r1_2 + p_r2_2 + p_r3_2 + p_r4_2 + p_r5_2
-
-# Plot pressure data scatter plot
-fig_p1, ax_p1 = plt.subplots()
-fig_p2, ax_p2 = plt.subplots()
-
-graph(p, p_r_1, ax_p1, 0.25, False, "Pi 1 RSSI Value vs. Barometric Pressure", "Barometric Pressure (Pascals/Pa)", "RSSI Value", (63000, 102000), (-50, -20))
-graph(p, p_r_2, ax_p2, 0.25, False, "Pi 2 RSSI Value vs. Barometric Pressure", "Barometric Pressure (Pascals/Pa)", "RSSI Value", (63000, 102000), (-50, -20))
-
-# Remove outliers from the pressure data
-p, p_r_1, p_r_2 = remove_outliers(p, [p_r_1, p_r_2], 63205, 101000)
-p_r_1, p, p_r_2 = remove_outliers(p_r_1, [p, p_r_2], -50, -35)
-p_r_2, p, p_r_1 = remove_outliers(p_r_2, [p, p_r_1], -50, -35)
-
-# Plot pressure data with a line of best fit
-fig_p1_b, ax_p1_b = plt.subplots()
-fig_p2_b, ax_p2_b = plt.subplots()
-
-graph(p, p_r_1, ax_p1_b, 0.25, True, "Pi 1 RSSI Value vs. Barometric Pressure with Best Fit", "Barometric Pressure (Pascals/Pa)", "RSSI Value", (63000, 102000), (-50, -20))
-graph(p, p_r_2, ax_p2_b, 0.25, True, "Pi 2 RSSI Value vs. Barometric Pressure with Best Fit", "Barometric Pressure (Pascals/Pa)", "RSSI Value", (63000, 102000), (-50, -20))
-### BAROMETRIC PRESSURE ###
-
-
-### RELATIVE HUMIDITY ###
-# Read humidity data
-h_r1_1 = read_file("Desktop/Lee_Audrey_CollectedData/Humidity/hum_pi1_1.csv", ["RSSI"])[0]
-h_r2_1 = read_file("Desktop/Lee_Audrey_CollectedData/Humidity/hum_pi1_2.csv", ["RSSI"])[0]
-h_r3_1 = read_file("Desktop/Lee_Audrey_CollectedData/Humidity/hum_pi1_3.csv", ["RSSI"])[0]
-
-h1_2, h_r1_2 = read_file("Desktop/Lee_Audrey_CollectedData/Humidity/hum_pi2_1.csv", ["HUMIDITY","RSSI"])
-h2_2, h_r2_2 = read_file("Desktop/Lee_Audrey_CollectedData/Humidity/hum_pi2_2.csv", ["HUMIDITY","RSSI"])
-h3_2, h_r3_2 = read_file("Desktop/Lee_Audrey_CollectedData/Humidity/hum_pi2_3.csv", ["HUMIDITY","RSSI"])
-
-h = h1_2 + h2_2 + h3_2
-h_r_1 = h_r1_1 + h_r2_1 + h_r3_1
-h_r_2 = h_r1_2 + h_r2_2 + h_r3_2
-
-# Plot humidity data scatter plot
-fig_h1, ax_h1 = plt.subplots()
-fig_h2, ax_h2 = plt.subplots()
-
-graph(h, h_r_1, ax_h1, 0.25, False, "Pi 1 RSSI Value vs. Relative Humidity", "Relative Humidity (%)", "RSSI Value", None, None)
-graph(h, h_r_2, ax_h2, 0.25, False, "Pi 2 RSSI Value vs. Relative Humidity", "Relative Humidity (%)", "RSSI Value", None, None)
-
-# Remove outliers from the humidity data
-h, h_r_1, h_r_2 = remove_outliers(h, [h_r_1, h_r_2], 30, 85)
-h_r_1, h, h_r_2 = remove_outliers(h_r_1, [h, h_r_2], -40, -15)
-h_r_2, h, h_r_1 = remove_outliers(h_r_2, [h, h_r_1], -40, -15)
-
-# Plot humidity data with a line of best fit
-fig_h1_b, ax_h1_b = plt.subplots()
-fig_h2_b, ax_h2_b = plt.subplots()
+    Parameters
+    ----------
+    result: dict, analysis result from pi_pipeline.Pipeline.run with 'raw'
+            and 'clean' datasets and 'fits'
+    plots: list of dicts, each with 'kind' ('average' or 'scatter'), 'x' and
+           'y' dataset columns, and optionally 'data' ('raw' or 'clean'),
+           'opacity', 'fit' (name of a configured fit), 'title', 'x_title',
+           'y_title', 'label', 'xlim' and 'ylim'
+    """
 
-graph(h, h_r_1, ax_h1_b, 0.25, True, "Pi 1 RSSI Value vs. Relative Humidity with Best Fit", "Relative Humidity (%)", "RSSI Value", None, None)
-graph(h, h_r_2, ax_h2_b, 0.25, True, "Pi 2 RSSI Value vs. Relative Humidity with Best Fit", "Relative Humidity (%)", "RSSI Value", None, None)
-### RELATIVE HUMIDITY ###
+    for spec in plots:
+        fig, ax = plt.subplots()
+        data = result[spec.get('data', 'clean')]
+        fit = result['fits'][spec['fit']] if spec.get('fit') else None
+        if spec['kind'] == 'average':
+            graph_avg(data[spec['x']], data[spec['y']], ax, spec.get('opacity', 1), fit is not None,
+                      spec.get('title'), spec.get('x_title'), spec.get('y_title'), spec.get('label'),
+                      spec.get('xlim'), spec.get('ylim'), fit=fit)
+        else:
+            graph(data[spec['x']], data[spec['y']], ax, spec.get('opacity', 1), fit is not None,
+                  spec.get('title'), spec.get('x_title'), spec.get('y_title'),
+                  spec.get('xlim'), spec.get('ylim'), fit=fit)
+
+def parse_args(args):
+    """
+    Input argument parser
 
+    Parameters
+    ----------
+    args: list, input arguments as taken from sys.argv
 
-### AMBIENT TEMPERATURE ###
-# Read temperature data
-t_r1_1 = read_file("Desktop/Lee_Audrey_CollectedData/Temperature/temp_pi1_1.csv", ["RSSI"])[0]
-t_r2_1 = read_file("Desktop/Lee_Audrey_CollectedData/Temperature/temp_pi1_2.csv", ["RSSI"])[0]
-t_r3_1 = read_file("Desktop/Lee_Audrey_CollectedData/Temperature/temp_pi1_3.csv", ["RSSI"])[0]
+    Returns
+    -------
+    dict: parsed input arguments keyed by argument name
+    """
 
-t1_2, t_r1_2 = read_file("Desktop/Lee_Audrey_CollectedData/Temperature/temp_pi2_1.csv", ["TEMP","RSSI"])
-t2_2, t_r2_2 = read_file("Desktop/Lee_Audrey_CollectedData/Temperature/temp_pi2_2.csv", ["TEMP","RSSI"])
-t3_2, t_r3_2 = read_file("Desktop/Lee_Audrey_CollectedData/Temperature/temp_pi2_3.csv", ["TEMP","RSSI"])
+    parser = argparse.ArgumentParser(
+        description=("Plot RSSI against environmental variables as described "
+                     "by an analysis pipeline configuration. Command line "
+                     "arguments override their corresponding configuration "
+                     "value."))
+    parser.add_argument('--config_yml', default=DEFAULT_CONFIG_YML,
+            help="Analysis pipeline configuration YAML.")
+    parser.add_argument('--analyses', nargs='+',
+            help="Names of analyses to run, defaults to all.")
+    parser.add_argument('--cache_dir', help="Stage result cache directory.")
+    parser.add_argument('--workers', type=int,
+            help="Number of analyses run in parallel.")
+    parser.add_argument('--no_show', action='store_true',
+            help="Compute and report fits without displaying plots.")
+    return vars(parser.parse_args(args))
+
+def main(args):
+    """
+    Runs the configured analysis pipeline, reports fits and regression
+    tables, and shows plots
 
-t = t1_2 + t2_2 + t3_2
-t_r_1 = t_r1_1 + t_r2_1 + t_r3_1
-t_r_2 = t_r1_2 + t_r2_2 + t_r3_2
+    Parameters
+    ----------
+    args: list, arguments as provided by sys.argv
 
-# Plot temperature data scatter plot
-fig_t1, ax_t1 = plt.subplots()
-fig_t2, ax_t2 = plt.subplots()
-
-graph(t, t_r_1, ax_t1, 0.25, False, "Pi 1 RSSI Value vs. Ambient Temperature", "Ambient Temperature (°C)", "RSSI Value", None, None)
-graph(t, t_r_2, ax_t2, 0.25, False, "Pi 2 RSSI Value vs. Ambient Temperature", "Ambient Temperature (°C)", "RSSI Value", None, None)
+    Returns
+    -------
+    dict: analysis results keyed by analysis name
+    """
 
-# Remove outliers from the temperature data
-t, t_r_1, t_r_2 = remove_outliers(t, [t_r_1, t_r_2], -10, 40)
-t_r_1, t, t_r_2 = remove_outliers(t_r_1, [t, t_r_2], -70, -10)
-t_r_2, t, t_r_1 = remove_outliers(t_r_2, [t, t_r_1], -70, -10)
-
-# Plot humidity data with a line of best fit
-fig_t1_b, ax_t1_b = plt.subplots()
-fig_t2_b, ax_t2_b = plt.subplots()
-
-graph(t, t_r_1, ax_t1_b, 0.25, True, "Pi 1 RSSI Value vs. Ambient Temperature", "Ambient Temperature (°C)", "RSSI Value", None, None)
-graph(t, t_r_2, ax_t2_b, 0.25, True, "Pi 2 RSSI Value vs. Ambient Temperature", "Ambient Temperature (°C)", "RSSI Value", None, None)
-### AMBIENT TEMPERATURE ###
\ No newline at end of file
+    parsed_args = parse_args(args)
+    with open(parsed_args['config_yml'], 'r') as f:
+        config = yaml.load(f, Loader=yaml.SafeLoader)
+    for key in ['cache_dir', 'workers']:
+        if parsed_args[key] is not None:
+            config[key] = parsed_args[key]
+    logging.basicConfig(level=logging.INFO,
+            format='%(asctime)s   %(levelname)-8s   %(message)s')
+    logger = logging.getLogger('final_code')
+
+    pipeline = pi_pipeline.Pipeline(logger, **config)
+    results = pipeline.run(parsed_args['analyses'])
+
+    for name, result in results.items():
+        for fit_name, fit in result['fits'].items():
+            print(f"{name} {fit_name}: y = {round(fit['slope'],4)}x + "
+                  f"{round(fit['intercept'],4)}, R^2: {round(fit['rvalue']**2,8)}")
+        for regression_name, regression in result['regressions'].items():
+            print(f"{name} {regression_name}:")
+            print(pi_regression.table(regression).to_string())
+        if not parsed_args['no_show']:
+            plot_analysis(result, pipeline.analyses[name].get('plots', []))
+    if not parsed_args['no_show']:
+        plt.show()
+    return results
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
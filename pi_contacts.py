@@ -0,0 +1,488 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Streaming contact episode detection from beacon advertisements.
+
+Each beacon runs its own state machine fed one advertisement at a time. A
+contact starts once RSSI stays at or above the enter threshold for the enter
+dwell time and ends once RSSI stays below the lower exit threshold for the
+exit dwell time or the beacon is not heard for the absence timeout. The gap
+between the thresholds (hysteresis) keeps RSSI noise near a single threshold
+from splitting one contact into many.
+
+Every advertisement costs constant work: the state update touches only its
+beacon, and episode RSSI statistics are kept as counts of the (integer) RSSI
+values so the median needs no stored samples.
+"""
+
+import argparse
+from collections import Counter
+from math import log10
+import pandas as pd
+import pi_compress
+import sys
+
+# Default configuration
+DEFAULT_CONFIG = {
+    'group_by': ['ADDRESS'],
+    'enter_rssi': -60,
+    'exit_rssi': -70,
+    'enter_dwell': 2.0,
+    'exit_dwell': 5.0,
+    'absence_timeout': 10.0,
+    'measured_power': None,
+    'path_loss_exponent': 2.0
+    }
+
+# Universal settings
+EPISODE_COLUMNS = ['START', 'END', 'DURATION', 'PEAK RSSI', 'MEDIAN RSSI',
+        'COUNT']
+
+# Beacon states
+IDLE, PENDING, ACTIVE, LEAVING = range(4)
+
+def distance_to_rssi(distance, measured_power, path_loss_exponent):
+    """RSSI expected at a distance by the log-distance path loss model.
+
+    Args:
+        distance (float): Distance (m).
+        measured_power (float): RSSI at 1 m (dBm).
+        path_loss_exponent (float): Path loss exponent, 2 in free space.
+
+    Returns:
+        RSSI (dBm).
+    """
+    return measured_power-10*path_loss_exponent*log10(distance)
+
+class BeaconState(object):
+    """Contact state of one beacon."""
+
+    __slots__ = ['state', 'start', 'last_seen', 'last_above', 'below_since',
+            'peak', 'counts']
+
+    def __init__(self):
+        """Instance initialization."""
+        self.state = IDLE
+        self.start = None
+        self.last_seen = None
+        self.last_above = None
+        self.below_since = None
+        self.peak = None
+        self.counts = None
+
+class ContactDetector(object):
+    """Instantiates a streaming contact episode detector.
+
+    Attributes:
+        group_by (list): Advertisement fields identifying a beacon.
+        enter_rssi (float): RSSI (dBm) at or above which a contact begins.
+        exit_rssi (float): RSSI (dBm) below which a contact ends. Must not
+            exceed enter_rssi.
+        enter_dwell (float): Time (s) RSSI must stay at or above enter_rssi
+            before a contact is confirmed.
+        exit_dwell (float): Time (s) RSSI must stay below exit_rssi before a
+            contact ends.
+        absence_timeout (float): Time (s) without advertisements after which
+            a contact ends.
+        measured_power (float): RSSI (dBm) at 1 m. When set, enter_rssi and
+            exit_rssi are given as distances (m) instead and converted with
+            the log-distance path loss model.
+        path_loss_exponent (float): Path loss exponent of the distance model.
+    """
+
+    def __init__(self, **kwargs):
+        """Instance initialization.
+
+        Args:
+            **kwargs: Keyword arguments corresponding to instance attributes.
+                Any unassociated keyword arguments are ignored.
+
+        Raises:
+            ValueError: Contact exit threshold must not exceed enter threshold.
+        """
+        for key, value in DEFAULT_CONFIG.items():
+            if key in kwargs and kwargs[key] is not None:
+                setattr(self, key, kwargs[key])
+            else:
+                setattr(self, key, value)
+        if self.measured_power is not None:
+            # Nearer is stronger, so distance thresholds swap order
+            self.__enter_level = distance_to_rssi(self.enter_rssi,
+                    self.measured_power, self.path_loss_exponent)
+            self.__exit_level = distance_to_rssi(self.exit_rssi,
+                    self.measured_power, self.path_loss_exponent)
+        else:
+            self.__enter_level = self.enter_rssi
+            self.__exit_level = self.exit_rssi
+        if self.__exit_level > self.__enter_level:
+            raise ValueError("Contact exit threshold must not exceed enter "
+                    "threshold.")
+        self.__beacons = {}
+
+    @property
+    def group_by(self):
+        """Beacon identifier fields getter."""
+        return self.__group_by
+
+    @group_by.setter
+    def group_by(self, value):
+        """Beacon identifier fields setter.
+
+        Raises:
+            TypeError: Contact group by must be a non-empty list.
+        """
+        if not isinstance(value, list) or not value:
+            raise TypeError("Contact group by must be a non-empty list.")
+        self.__group_by = value
+
+    @property
+    def enter_rssi(self):
+        """Enter threshold getter."""
+        return self.__enter_rssi
+
+    @enter_rssi.setter
+    def enter_rssi(self, value):
+        """Enter threshold setter.
+
+        Raises:
+            TypeError: Contact enter threshold must be a float or integer.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Contact enter threshold must be a float or "
+                    "integer.")
+        self.__enter_rssi = value
+
+    @property
+    def exit_rssi(self):
+        """Exit threshold getter."""
+        return self.__exit_rssi
+
+    @exit_rssi.setter
+    def exit_rssi(self, value):
+        """Exit threshold setter.
+
+        Raises:
+            TypeError: Contact exit threshold must be a float or integer.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Contact exit threshold must be a float or "
+                    "integer.")
+        self.__exit_rssi = value
+
+    @property
+    def enter_dwell(self):
+        """Enter dwell time getter."""
+        return self.__enter_dwell
+
+    @enter_dwell.setter
+    def enter_dwell(self, value):
+        """Enter dwell time setter.
+
+        Raises:
+            TypeError: Contact enter dwell must be a float or integer.
+            ValueError: Contact enter dwell must be non-negative.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Contact enter dwell must be a float or integer.")
+        elif value < 0:
+            raise ValueError("Contact enter dwell must be non-negative.")
+        self.__enter_dwell = value
+
+    @property
+    def exit_dwell(self):
+        """Exit dwell time getter."""
+        return self.__exit_dwell
+
+    @exit_dwell.setter
+    def exit_dwell(self, value):
+        """Exit dwell time setter.
+
+        Raises:
+            TypeError: Contact exit dwell must be a float or integer.
+            ValueError: Contact exit dwell must be non-negative.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Contact exit dwell must be a float or integer.")
+        elif value < 0:
+            raise ValueError("Contact exit dwell must be non-negative.")
+        self.__exit_dwell = value
+
+    @property
+    def absence_timeout(self):
+        """Absence timeout getter."""
+        return self.__absence_timeout
+
+    @absence_timeout.setter
+    def absence_timeout(self, value):
+        """Absence timeout setter.
+
+        Raises:
+            TypeError: Contact absence timeout must be a float or integer.
+            ValueError: Contact absence timeout must be strictly positive.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Contact absence timeout must be a float or "
+                    "integer.")
+        elif value <= 0:
+            raise ValueError("Contact absence timeout must be strictly "
+                    "positive.")
+        self.__absence_timeout = value
+
+    @property
+    def measured_power(self):
+        """RSSI at 1 m getter."""
+        return self.__measured_power
+
+    @measured_power.setter
+    def measured_power(self, value):
+        """RSSI at 1 m setter.
+
+        Raises:
+            TypeError: Contact measured power must be a float, integer, or
+                NoneType.
+        """
+        if value is not None and not isinstance(value, (float, int)):
+            raise TypeError("Contact measured power must be a float, "
+                    "integer, or NoneType.")
+        self.__measured_power = value
+
+    @property
+    def path_loss_exponent(self):
+        """Path loss exponent getter."""
+        return self.__path_loss_exponent
+
+    @path_loss_exponent.setter
+    def path_loss_exponent(self, value):
+        """Path loss exponent setter.
+
+        Raises:
+            TypeError: Contact path loss exponent must be a float or integer.
+            ValueError: Contact path loss exponent must be strictly positive.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Contact path loss exponent must be a float or "
+                    "integer.")
+        elif value <= 0:
+            raise ValueError("Contact path loss exponent must be strictly "
+                    "positive.")
+        self.__path_loss_exponent = value
+
+    @property
+    def active(self):
+        """Number of beacons currently in contact."""
+        return sum(1 for beacon in self.__beacons.values()
+                if beacon.state in (ACTIVE, LEAVING))
+
+    def update(self, key, timestamp, rssi):
+        """Feed one advertisement.
+
+        Args:
+            key (tuple): Beacon identifier values in group_by order.
+            timestamp (datetime.datetime): Advertisement time.
+            rssi (int): Advertisement RSSI (dBm).
+
+        Returns:
+            Ended contact episode dictionary (see episode) or None.
+        """
+        beacon = self.__beacons.get(key)
+        if beacon is None:
+            beacon = self.__beacons[key] = BeaconState()
+        episode = None
+        # A long silence ends any contact before this advertisement counts
+        if beacon.state != IDLE and (timestamp-beacon.last_seen
+                ).total_seconds() > self.absence_timeout:
+            episode = self.close(key, beacon)
+        beacon.last_seen = timestamp
+        if rssi >= self.__exit_level and beacon.state in (ACTIVE, LEAVING):
+            beacon.state = ACTIVE
+            beacon.last_above = timestamp
+            beacon.below_since = None
+        if beacon.state == IDLE:
+            if rssi >= self.__enter_level:
+                beacon.state = PENDING
+                beacon.start = beacon.last_above = timestamp
+                beacon.peak = rssi
+                beacon.counts = Counter()
+            else:
+                # Idle beacons hold no state and are only tracked again once
+                # heard above the enter threshold
+                del self.__beacons[key]
+                return episode
+        elif beacon.state == PENDING:
+            if rssi < self.__enter_level:
+                # Contact not held for the enter dwell, discard it
+                del self.__beacons[key]
+                return episode
+            beacon.last_above = timestamp
+        elif beacon.state == ACTIVE and rssi < self.__exit_level:
+            beacon.state = LEAVING
+            beacon.below_since = timestamp
+        elif beacon.state == LEAVING and (timestamp-beacon.below_since
+                ).total_seconds() >= self.exit_dwell:
+            del self.__beacons[key]
+            return self.close(key, beacon) or episode
+        beacon.counts[rssi] += 1
+        if rssi > beacon.peak:
+            beacon.peak = rssi
+        if beacon.state == PENDING and (timestamp-beacon.start
+                ).total_seconds() >= self.enter_dwell:
+            beacon.state = ACTIVE
+        return episode
+
+    def expire(self, now):
+        """End contacts of beacons not heard for the absence timeout.
+
+        Called periodically (e.g., once per scan) so that beacons that go
+        silent still end their contacts. Only beacons in or entering contact
+        are tracked, so work is proportional to their number rather than to
+        every beacon ever heard.
+
+        Args:
+            now (datetime.datetime): Current time.
+
+        Returns:
+            List of ended contact episode dictionaries.
+        """
+        episodes = []
+        for key, beacon in list(self.__beacons.items()):
+            if (now-beacon.last_seen).total_seconds() > self.absence_timeout:
+                del self.__beacons[key]
+                episode = self.close(key, beacon)
+                if episode is not None:
+                    episodes.append(episode)
+        return episodes
+
+    def flush(self):
+        """End all open contacts, e.g., when scanning stops.
+
+        Returns:
+            List of ended contact episode dictionaries.
+        """
+        episodes = [self.close(key, beacon)
+                for key, beacon in self.__beacons.items()]
+        self.__beacons.clear()
+        return [episode for episode in episodes if episode is not None]
+
+    def close(self, key, beacon):
+        """Return beacon to idle, emitting its episode if it was confirmed.
+
+        Args:
+            key (tuple): Beacon identifier values.
+            beacon (BeaconState): Beacon state.
+
+        Returns:
+            Contact episode dictionary or None if no contact was confirmed.
+        """
+        confirmed = beacon.state in (ACTIVE, LEAVING)
+        beacon.state = IDLE
+        if not confirmed:
+            return None
+        return self.episode(key, beacon.start, beacon.last_above, beacon.peak,
+                beacon.counts)
+
+    def episode(self, key, start, end, peak, counts):
+        """Contact episode dictionary.
+
+        Returns:
+            Dictionary of group_by fields, START, END (last advertisement at
+            or above the exit threshold), DURATION (s), PEAK RSSI, MEDIAN
+            RSSI, and COUNT (advertisements during the contact).
+        """
+        total = sum(counts.values())
+        # Median from value counts, averaging the middle pair when even
+        cumulative = 0
+        lower = upper = None
+        for value in sorted(counts):
+            cumulative += counts[value]
+            if lower is None and cumulative >= (total+1)//2:
+                lower = value
+            if cumulative >= total//2+1:
+                upper = value
+                break
+        return {**dict(zip(self.group_by, key)), 'START': start, 'END': end,
+                'DURATION': (end-start).total_seconds(), 'PEAK RSSI': peak,
+                'MEDIAN RSSI': (lower+upper)/2, 'COUNT': total}
+
+    def process(self, advertisements):
+        """Feed advertisements in time order.
+
+        Args:
+            advertisements (pandas.DataFrame): Advertisements with group_by,
+                TIMESTAMP, and RSSI columns.
+
+        Returns:
+            List of ended contact episode dictionaries.
+        """
+        episodes = []
+        columns = self.group_by+['TIMESTAMP', 'RSSI']
+        for row in advertisements[columns].itertuples(index=False, name=None):
+            episode = self.update(row[:-2], row[-2], row[-1])
+            if episode is not None:
+                episodes.append(episode)
+        return episodes
+
+    def empty_episodes(self):
+        """Empty DataFrame with contact episode columns."""
+        return pd.DataFrame(columns=self.group_by+EPISODE_COLUMNS)
+
+def parse_args(args):
+    """Input argument parser.
+
+    Args:
+        args (list): Input arguments as taken from command line execution via
+            sys.argv[1:].
+
+    Returns:
+        parsed_args (dict): Parsed input arguments keyed by argument name.
+    """
+    parser = argparse.ArgumentParser(
+            description="Detect contact episodes in recorded scan files.")
+    parser.add_argument('scan_files', nargs='+', help="Scan CSV files.")
+    parser.add_argument('--output', help="Contact episode CSV file, printed "
+            "if not given.")
+    parser.add_argument('--group_by', nargs='+',
+            help="Fields identifying a beacon.")
+    parser.add_argument('--enter_rssi', type=float,
+            help="RSSI (dBm) at or above which a contact begins, or distance "
+                 "(m) with measured_power.")
+    parser.add_argument('--exit_rssi', type=float,
+            help="RSSI (dBm) below which a contact ends, or distance (m) with "
+                 "measured_power.")
+    parser.add_argument('--enter_dwell', type=float,
+            help="Time (s) above enter_rssi to confirm a contact.")
+    parser.add_argument('--exit_dwell', type=float,
+            help="Time (s) below exit_rssi to end a contact.")
+    parser.add_argument('--absence_timeout', type=float,
+            help="Time (s) without advertisements to end a contact.")
+    parser.add_argument('--measured_power', type=float,
+            help="RSSI (dBm) at 1 m, makes thresholds distances.")
+    parser.add_argument('--path_loss_exponent', type=float,
+            help="Path loss exponent of the distance conversion.")
+    return vars(parser.parse_args(args))
+
+def main(args):
+    """Contact episode detection over recorded scan files.
+
+    Args:
+        args (list): Arguments as provided by sys.argv.
+
+    Returns:
+        Contact episodes in a pandas.DataFrame.
+    """
+    parsed_args = parse_args(args)
+    detector = ContactDetector(**parsed_args)
+    episodes = []
+    for scan_file in parsed_args['scan_files']:
+        advertisements = pi_compress.read_scan(scan_file,
+                parse_dates=['TIMESTAMP'])
+        episodes += detector.process(advertisements)
+    episodes += detector.flush()
+    episodes = pd.DataFrame(episodes, columns=detector.empty_episodes().columns)
+    if parsed_args['output']:
+        episodes.to_csv(parsed_args['output'], index=False)
+    else:
+        print(episodes.to_string())
+    return episodes
+
+if __name__ == "__main__":
+    """Script execution."""
+    main(sys.argv[1:])
@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Aligned column datasets for piPACT analyses.
+
+A dataset is a collection of equal length numpy columns where each row is
+one observation, e.g., an RSSI reading from each Pi together with the
+environmental measurement taken at the same time. Row filters are collected
+as rules and combined into a single boolean mask that is applied to every
+column at once. Datasets recorded by different sources are aligned by
+joining each row to the nearest-in-time row of another dataset.
+"""
+
+import numpy as np
+import pi_timeseries
+
+def nearest_indices(left, right, tolerance):
+    """Index of nearest right value for each left value within tolerance.
+
+    Both value sets are sorted (skipped when already in order, as scan
+    timestamps usually are) and all left values are located with a single
+    binary search, i.e., O(n log n + m log m) for n left and m right values.
+    Searching in sorted order keeps memory access sequential, which matters
+    far more than the extra sort for large inputs.
+
+    Args:
+        left (numpy.ndarray): int64 values to match, e.g., timestamps (ns).
+        right (numpy.ndarray): int64 values to match against.
+        tolerance (int): Largest allowable absolute difference.
+
+    Returns:
+        numpy.ndarray of indices into right, -1 where no right value is
+        within tolerance. Ties go to the earlier right value.
+    """
+    left = np.asarray(left, dtype=np.int64)
+    right = np.asarray(right, dtype=np.int64)
+    if not right.size:
+        return np.full(left.size, -1, dtype=np.int64)
+    right_order = sorted_order(right)
+    sorted_right = right if right_order is None else right[right_order]
+    left_order = sorted_order(left)
+    sorted_left = left if left_order is None else left[left_order]
+    after = np.searchsorted(sorted_right, sorted_left)
+    before = np.clip(after-1, 0, right.size-1)
+    after = np.clip(after, 0, right.size-1)
+    before_distance = np.abs(sorted_left-sorted_right[before])
+    after_distance = np.abs(sorted_right[after]-sorted_left)
+    nearest = np.where(after_distance < before_distance, after, before)
+    if right_order is not None:
+        nearest = right_order[nearest]
+    nearest[np.minimum(before_distance, after_distance) > tolerance] = -1
+    if left_order is None:
+        return nearest
+    indices = np.empty_like(nearest)
+    indices[left_order] = nearest
+    return indices
+
+def sorted_order(values):
+    """Sorting permutation of values, None when already sorted."""
+    if values.size < 2 or np.all(values[1:] >= values[:-1]):
+        return None
+    return np.argsort(values)
+
+class AlignedColumns(object):
+    """Instantiates a dataset of aligned, equal length columns.
+
+    Attributes:
+        columns (dict): Column name to numpy.ndarray.
+        rules (list): Range rules applied by apply, each a dictionary with
+            'column', 'min', and 'max' keys.
+    """
+
+    def __init__(self, columns):
+        """Instance initialization.
+
+        Args:
+            columns (dict): Column name to array_like. Columns that are
+                already numpy arrays are used without copying.
+        """
+        self.columns = columns
+        self.__rules = []
+
+    def __len__(self):
+        """Number of rows."""
+        return len(next(iter(self.__columns.values()), ()))
+
+    def __getitem__(self, name):
+        """Column by name."""
+        return self.__columns[name]
+
+    def __contains__(self, name):
+        """Whether column exists."""
+        return name in self.__columns
+
+    def keys(self):
+        """Column names."""
+        return self.__columns.keys()
+
+    @property
+    def columns(self):
+        """Dataset columns getter."""
+        return self.__columns
+
+    @columns.setter
+    def columns(self, value):
+        """Dataset columns setter.
+
+        Raises:
+            TypeError: Dataset columns must be a dictionary.
+            ValueError: Dataset columns must have equal lengths.
+        """
+        if not isinstance(value, dict):
+            raise TypeError("Dataset columns must be a dictionary.")
+        columns = {name: np.asarray(values) for name, values in value.items()}
+        lengths = {name: len(values) for name, values in columns.items()}
+        if len(set(lengths.values())) > 1:
+            raise ValueError("Dataset columns must have equal lengths "
+                    f"{lengths}.")
+        self.__columns = columns
+
+    @property
+    def rules(self):
+        """Dataset range rules getter."""
+        return self.__rules
+
+    def add_range(self, column, min_val, max_val):
+        """Add rule keeping only rows where column is in [min_val, max_val].
+
+        Args:
+            column (str): Column name.
+            min_val (int, float): Inclusive lower bound.
+            max_val (int, float): Inclusive upper bound.
+
+        Returns:
+            This dataset so rules can be chained.
+
+        Raises:
+            KeyError: Rule column must be a dataset column.
+        """
+        if column not in self.__columns:
+            raise KeyError(f"Rule column {column} must be one of dataset "
+                    f"columns {list(self.__columns)}.")
+        self.__rules.append({'column': column, 'min': min_val,
+                'max': max_val})
+        return self
+
+    def mask(self):
+        """Combine all rules into one boolean row mask.
+
+        Returns:
+            Tuple of the combined mask (True for rows kept) and the number of
+            rows each rule rejects on its own, in rule order.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        passed = np.empty(len(self), dtype=bool)
+        upper = np.empty(len(self), dtype=bool)
+        rejected = []
+        for rule in self.__rules:
+            values = self.__columns[rule['column']]
+            # Reuse scratch buffers rather than allocating per comparison
+            np.greater_equal(values, rule['min'], out=passed)
+            np.less_equal(values, rule['max'], out=upper)
+            passed &= upper
+            rejected.append(len(self)-int(np.count_nonzero(passed)))
+            keep &= passed
+        return keep, rejected
+
+    def join_nearest(self, other, on, tolerance):
+        """Join each row to the nearest row of another dataset.
+
+        Rows without a row of other within tolerance are dropped.
+
+        Args:
+            other (AlignedColumns): Dataset to join, e.g., environmental
+                sensor readings.
+            on (str): Timestamp column present in both datasets. Columns of
+                int64 nanoseconds are used as is, anything else is parsed
+                with pi_timeseries.parse_timestamps.
+            tolerance (float): Largest allowable time difference (s).
+
+        Returns:
+            New AlignedColumns with matched rows of this dataset and the
+            corresponding rows of other's columns (except on).
+
+        Raises:
+            KeyError: Joined datasets must not share column names other than
+                on.
+        """
+        shared = (set(self.keys()) & set(other.keys()))-{on}
+        if shared:
+            raise KeyError("Joined datasets must not share column names "
+                    f"{sorted(shared)}.")
+        left, right = [data[on] if data[on].dtype == np.int64
+                else pi_timeseries.parse_timestamps(data[on])
+                for data in (self, other)]
+        indices = nearest_indices(left, right,
+                int(round(tolerance*pi_timeseries.NS_PER_S)))
+        rows = np.flatnonzero(indices >= 0)
+        matched = indices[rows]
+        columns = {name: values.take(rows)
+                for name, values in self.__columns.items()}
+        columns.update({name: values.take(matched)
+            for name, values in other.columns.items() if name != on})
+        return AlignedColumns(columns)
+
+    def apply(self):
+        """Remove rows rejected by any rule from every column.
+
+        Returns:
+            Tuple of a new AlignedColumns without the rejected rows and a
+            report listing each rule with the number of rows it rejects
+            under 'removed'. Columns are shared rather than copied when no
+            row is rejected.
+        """
+        keep, rejected = self.mask()
+        report = [{**rule, 'removed': removed}
+                for rule, removed in zip(self.__rules, rejected)]
+        if keep.all():
+            return AlignedColumns(dict(self.__columns)), report
+        rows = np.flatnonzero(keep)
+        return AlignedColumns({name: values.take(rows)
+            for name, values in self.__columns.items()}), report
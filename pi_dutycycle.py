@@ -0,0 +1,362 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Adaptive scan duty cycle of the beacon scanner.
+
+Scanning continuously with a fixed window spends the same power whether no
+beacon is around or many are moving about. The controller picks the next
+scan window and the idle gap before it from what recent scans received:
+
+* Window: a scan reports each beacon heard at most once, so a window only
+  needs to be long enough to hear every beacon around. While the beacons of
+  the previous scan are reliably heard again the window shrinks step by
+  step, when they are missed it grows. With no beacon around the longest
+  window is used so that new, slowly advertising beacons are caught.
+* Idle gap: short while beacons appear, disappear, or change RSSI quickly
+  (detection latency matters), long while the surroundings are static or
+  empty (power matters).
+
+Observations are smoothed with exponentially weighted moving averages so
+that one unusual scan does not swing the schedule.
+"""
+
+import numpy as np
+
+# Default configuration
+DEFAULT_CONFIG = {
+    'group_by': ['ADDRESS'],
+    'min_window': 0.2,
+    'max_window': 2.0,
+    'min_idle': 0.0,
+    'max_idle': 5.0,
+    'target_retention': 0.9,
+    'window_step': 1.25,
+    'churn_scale': 0.5,
+    'rssi_scale': 5.0,
+    'smoothing': 0.3
+    }
+
+class DutyCycleController(object):
+    """Instantiates an adaptive scan window and idle gap controller.
+
+    Attributes:
+        group_by (list): Advertisement fields identifying a beacon.
+        min_window (float): Shortest scan window (s).
+        max_window (float): Longest scan window (s), also used while no
+            beacon is heard.
+        min_idle (float): Shortest idle gap (s) between scans, used at full
+            activity.
+        max_idle (float): Longest idle gap (s) between scans, used while
+            nothing changes.
+        target_retention (float): Fraction of the beacons of one scan that
+            must be heard again in the next one for the window to shrink,
+            in (0, 1].
+        window_step (float): Factor by which the window shrinks or grows
+            per scan. Must exceed 1.
+        churn_scale (float): Beacons appearing or disappearing per second
+            that count as full activity.
+        rssi_scale (float): Mean RSSI change (dB/s) of beacons heard in
+            consecutive scans that counts as full activity.
+        smoothing (float): Weight of the newest observation in the moving
+            averages, in (0, 1].
+    """
+
+    def __init__(self, **kwargs):
+        """Instance initialization.
+
+        Args:
+            **kwargs: Keyword arguments corresponding to instance attributes.
+                Any unassociated keyword arguments are ignored.
+
+        Raises:
+            ValueError: Duty cycle minimum window must not exceed maximum.
+            ValueError: Duty cycle minimum idle gap must not exceed maximum.
+        """
+        for key, value in DEFAULT_CONFIG.items():
+            if key in kwargs and kwargs[key] is not None:
+                setattr(self, key, kwargs[key])
+            else:
+                setattr(self, key, value)
+        if self.min_window > self.max_window:
+            raise ValueError("Duty cycle minimum window must not exceed "
+                    "maximum.")
+        if self.min_idle > self.max_idle:
+            raise ValueError("Duty cycle minimum idle gap must not exceed "
+                    "maximum.")
+        self.__retention = None
+        self.__churn = 0.0
+        self.__rssi_rate = 0.0
+        self.__previous = None
+        self.__window = self.max_window
+        self.__idle = self.max_idle
+
+    @property
+    def group_by(self):
+        """Beacon identifier fields getter."""
+        return self.__group_by
+
+    @group_by.setter
+    def group_by(self, value):
+        """Beacon identifier fields setter.
+
+        Raises:
+            TypeError: Duty cycle group by must be a non-empty list.
+        """
+        if not isinstance(value, list) or not value:
+            raise TypeError("Duty cycle group by must be a non-empty list.")
+        self.__group_by = value
+
+    @property
+    def min_window(self):
+        """Minimum scan window getter."""
+        return self.__min_window
+
+    @min_window.setter
+    def min_window(self, value):
+        """Minimum scan window setter.
+
+        Raises:
+            TypeError: Duty cycle minimum window must be a float or integer.
+            ValueError: Duty cycle minimum window must be strictly positive.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Duty cycle minimum window must be a float or "
+                    "integer.")
+        elif value <= 0:
+            raise ValueError("Duty cycle minimum window must be strictly "
+                    "positive.")
+        self.__min_window = value
+
+    @property
+    def max_window(self):
+        """Maximum scan window getter."""
+        return self.__max_window
+
+    @max_window.setter
+    def max_window(self, value):
+        """Maximum scan window setter.
+
+        Raises:
+            TypeError: Duty cycle maximum window must be a float or integer.
+            ValueError: Duty cycle maximum window must be strictly positive.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Duty cycle maximum window must be a float or "
+                    "integer.")
+        elif value <= 0:
+            raise ValueError("Duty cycle maximum window must be strictly "
+                    "positive.")
+        self.__max_window = value
+
+    @property
+    def min_idle(self):
+        """Minimum idle gap getter."""
+        return self.__min_idle
+
+    @min_idle.setter
+    def min_idle(self, value):
+        """Minimum idle gap setter.
+
+        Raises:
+            TypeError: Duty cycle minimum idle gap must be a float or
+                integer.
+            ValueError: Duty cycle minimum idle gap must be non-negative.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Duty cycle minimum idle gap must be a float or "
+                    "integer.")
+        elif value < 0:
+            raise ValueError("Duty cycle minimum idle gap must be "
+                    "non-negative.")
+        self.__min_idle = value
+
+    @property
+    def max_idle(self):
+        """Maximum idle gap getter."""
+        return self.__max_idle
+
+    @max_idle.setter
+    def max_idle(self, value):
+        """Maximum idle gap setter.
+
+        Raises:
+            TypeError: Duty cycle maximum idle gap must be a float or
+                integer.
+            ValueError: Duty cycle maximum idle gap must be non-negative.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Duty cycle maximum idle gap must be a float or "
+                    "integer.")
+        elif value < 0:
+            raise ValueError("Duty cycle maximum idle gap must be "
+                    "non-negative.")
+        self.__max_idle = value
+
+    @property
+    def target_retention(self):
+        """Target retention getter."""
+        return self.__target_retention
+
+    @target_retention.setter
+    def target_retention(self, value):
+        """Target retention setter.
+
+        Raises:
+            TypeError: Duty cycle target retention must be a float or integer.
+            ValueError: Duty cycle target retention must be in (0, 1].
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Duty cycle target retention must be a float or "
+                    "integer.")
+        elif not 0 < value <= 1:
+            raise ValueError("Duty cycle target retention must be in (0, 1].")
+        self.__target_retention = value
+
+    @property
+    def window_step(self):
+        """Window step factor getter."""
+        return self.__window_step
+
+    @window_step.setter
+    def window_step(self, value):
+        """Window step factor setter.
+
+        Raises:
+            TypeError: Duty cycle window step must be a float or integer.
+            ValueError: Duty cycle window step must exceed 1.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Duty cycle window step must be a float or "
+                    "integer.")
+        elif value <= 1:
+            raise ValueError("Duty cycle window step must exceed 1.")
+        self.__window_step = value
+
+    @property
+    def churn_scale(self):
+        """Full activity beacon churn getter."""
+        return self.__churn_scale
+
+    @churn_scale.setter
+    def churn_scale(self, value):
+        """Full activity beacon churn setter.
+
+        Raises:
+            TypeError: Duty cycle churn scale must be a float or integer.
+            ValueError: Duty cycle churn scale must be strictly positive.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Duty cycle churn scale must be a float or "
+                    "integer.")
+        elif value <= 0:
+            raise ValueError("Duty cycle churn scale must be strictly "
+                    "positive.")
+        self.__churn_scale = value
+
+    @property
+    def rssi_scale(self):
+        """Full activity RSSI change getter."""
+        return self.__rssi_scale
+
+    @rssi_scale.setter
+    def rssi_scale(self, value):
+        """Full activity RSSI change setter.
+
+        Raises:
+            TypeError: Duty cycle RSSI scale must be a float or integer.
+            ValueError: Duty cycle RSSI scale must be strictly positive.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Duty cycle RSSI scale must be a float or "
+                    "integer.")
+        elif value <= 0:
+            raise ValueError("Duty cycle RSSI scale must be strictly "
+                    "positive.")
+        self.__rssi_scale = value
+
+    @property
+    def smoothing(self):
+        """Moving average weight getter."""
+        return self.__smoothing
+
+    @smoothing.setter
+    def smoothing(self, value):
+        """Moving average weight setter.
+
+        Raises:
+            TypeError: Duty cycle smoothing must be a float or integer.
+            ValueError: Duty cycle smoothing must be in (0, 1].
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Duty cycle smoothing must be a float or "
+                    "integer.")
+        elif not 0 < value <= 1:
+            raise ValueError("Duty cycle smoothing must be in (0, 1].")
+        self.__smoothing = value
+
+    @property
+    def window(self):
+        """Next scan window (s) getter."""
+        return self.__window
+
+    @property
+    def idle(self):
+        """Next idle gap (s) getter."""
+        return self.__idle
+
+    @property
+    def activity(self):
+        """Smoothed activity in [0, 1] getter."""
+        return float(min(1.0, max(self.__churn/self.churn_scale,
+            self.__rssi_rate/self.rssi_scale)))
+
+    @property
+    def retention(self):
+        """Smoothed fraction of beacons heard again getter."""
+        return self.__retention
+
+    def update(self, advertisements, window, elapsed):
+        """Update the schedule with the advertisements of one scan.
+
+        Args:
+            advertisements (pandas.DataFrame): Advertisements received in the
+                scan, with group_by and RSSI columns.
+            window (float): Scan window (s) in which they were received,
+                normally the window returned by the previous update.
+            elapsed (float): Time (s) since the start of the previous scan.
+
+        Returns:
+            Tuple of the next scan window (s) and the idle gap (s) before it.
+        """
+        weight = self.smoothing
+        if len(advertisements):
+            current = advertisements.groupby(self.group_by)['RSSI'].mean() \
+                    .to_dict()
+        else:
+            current = {}
+        if self.__previous is not None and elapsed > 0:
+            churn = len(current.keys() ^ self.__previous.keys())/elapsed
+            common = current.keys() & self.__previous.keys()
+            rssi_rate = sum(abs(current[key]-self.__previous[key])
+                    for key in common)/len(common)/elapsed if common else 0.0
+            self.__churn += weight*(churn-self.__churn)
+            self.__rssi_rate += weight*(rssi_rate-self.__rssi_rate)
+            if self.__previous:
+                retention = len(common)/len(self.__previous)
+                self.__retention = retention if self.__retention is None \
+                        else self.__retention+weight*(retention
+                                -self.__retention)
+        self.__previous = current
+        # Windows follow how reliably beacons are heard, idle gaps follow
+        # activity
+        if not current:
+            window = self.max_window
+        elif self.__retention is not None:
+            if self.__retention >= self.target_retention:
+                window /= self.window_step
+            else:
+                window *= self.window_step
+        self.__window = float(np.clip(window, self.min_window,
+            self.max_window))
+        self.__idle = float(self.max_idle
+                -self.activity*(self.max_idle-self.min_idle))
+        return self.__window, self.__idle
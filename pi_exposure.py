@@ -0,0 +1,435 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Indexed store of advertisements and contact episodes for exposure queries.
+
+Scan files and contact episode files of the scanner are appended to one
+SQLite database. Advertisements are indexed by beacon (address, or UUID,
+major, and minor) and time, and episodes by beacon and start time, so that
+queries such as which nodes were near a beacon over some hours of weeks of
+data read only the matching index ranges instead of every scan file.
+
+Files are ingested incrementally: the byte offset reached in each file is
+recorded, and ingesting again only reads the complete lines appended since,
+so a scan file can be ingested repeatedly while the scanner is still writing
+it.
+"""
+
+import argparse
+import io
+import logging
+import pandas as pd
+from pathlib import Path
+import pi_compress
+import pi_timeseries
+import sqlite3
+import sys
+
+# Scan file and database columns of advertisements and episodes
+ADVERTISEMENT_COLUMNS = {
+    'SCAN': 'scan',
+    'ADDRESS': 'address',
+    'TIMESTAMP': 'timestamp',
+    'UUID': 'uuid',
+    'MAJOR': 'major',
+    'MINOR': 'minor',
+    'TX POWER': 'tx_power',
+    'RSSI': 'rssi'
+    }
+EPISODE_COLUMNS = {
+    'ADDRESS': 'address',
+    'UUID': 'uuid',
+    'MAJOR': 'major',
+    'MINOR': 'minor',
+    'START': 'start_time',
+    'END': 'end_time',
+    'DURATION': 'duration',
+    'PEAK RSSI': 'peak_rssi',
+    'MEDIAN RSSI': 'median_rssi',
+    'COUNT': 'count'
+    }
+CACHE_KB = 65536 # SQLite page cache size
+BEACON_KEYS = ['node', 'address', 'uuid', 'major', 'minor']
+TIME_COLUMNS = ['timestamp', 'start_time', 'end_time', 'first_contact',
+        'last_contact']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    node TEXT,
+    header TEXT NOT NULL,
+    byte_offset INTEGER NOT NULL,
+    last_line BLOB NOT NULL,
+    row_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS advertisements (
+    source INTEGER NOT NULL,
+    node TEXT,
+    scan INTEGER,
+    address TEXT,
+    timestamp INTEGER NOT NULL,
+    uuid TEXT,
+    major INTEGER,
+    minor INTEGER,
+    tx_power INTEGER,
+    rssi REAL
+);
+CREATE INDEX IF NOT EXISTS advertisements_address
+    ON advertisements (address, timestamp);
+CREATE INDEX IF NOT EXISTS advertisements_beacon
+    ON advertisements (uuid, major, minor, timestamp);
+CREATE INDEX IF NOT EXISTS advertisements_time
+    ON advertisements (timestamp);
+CREATE INDEX IF NOT EXISTS advertisements_source
+    ON advertisements (source);
+CREATE TABLE IF NOT EXISTS episodes (
+    source INTEGER NOT NULL,
+    node TEXT,
+    address TEXT,
+    uuid TEXT,
+    major INTEGER,
+    minor INTEGER,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    duration REAL,
+    peak_rssi REAL,
+    median_rssi REAL,
+    count INTEGER
+);
+CREATE INDEX IF NOT EXISTS episodes_address
+    ON episodes (address, start_time);
+CREATE INDEX IF NOT EXISTS episodes_beacon
+    ON episodes (uuid, major, minor, start_time);
+CREATE INDEX IF NOT EXISTS episodes_time ON episodes (start_time);
+CREATE INDEX IF NOT EXISTS episodes_duration ON episodes (duration);
+CREATE INDEX IF NOT EXISTS episodes_source ON episodes (source);
+"""
+
+class ExposureStore(object):
+    """Instantiates an indexed advertisement and contact episode store.
+
+    Attributes:
+        db_file (pathlib.Path): SQLite database file.
+    """
+
+    def __init__(self, db_file, logger=None):
+        """Instance initialization.
+
+        Args:
+            db_file (str, pathlib.Path): SQLite database file, created if it
+                does not exist.
+            logger (logging.Logger): Configured logger. Defaults to the
+                module logger.
+        """
+        self.__logger = logger or logging.getLogger(__name__)
+        self.__db_file = Path(db_file)
+        self.__connection = sqlite3.connect(str(self.__db_file))
+        # Write ahead logging lets queries run while scans are appended, and
+        # a larger page cache keeps the indexes being updated in memory
+        self.__connection.execute("PRAGMA journal_mode = WAL")
+        self.__connection.execute("PRAGMA synchronous = NORMAL")
+        self.__connection.execute(f"PRAGMA cache_size = -{CACHE_KB}")
+        self.__connection.executescript(SCHEMA)
+
+    @property
+    def db_file(self):
+        """Database file getter."""
+        return self.__db_file
+
+    def close(self):
+        """Close the database connection."""
+        self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def ingest(self, scan_dir, node=None):
+        """Append new rows of every scan and contact file in a directory.
+
+        Args:
+            scan_dir (str, pathlib.Path): Directory of scan and contact
+                episode CSV files, plain or block compressed, e.g.,
+                pact_scans.
+            node (str): Name of the scanner node that recorded the files.
+
+        Returns:
+            Number of rows appended.
+        """
+        return sum(self.ingest_file(file_path, node)
+                for file_path in sorted([*Path(scan_dir).glob("*.csv"),
+                    *Path(scan_dir).glob("*.csv"+pi_compress.SUFFIX)]))
+
+    def ingest_file(self, file_path, node=None):
+        """Append rows added to a scan or contact file since its last ingest.
+
+        Only complete lines are read, so a partially written last line (or
+        compressed block) is left for the next ingest. Files whose header or
+        last ingested line (block trailer if compressed) changed were
+        rewritten and replace their previously ingested rows.
+
+        Args:
+            file_path (str, pathlib.Path): Scan or contact episode CSV file,
+                plain or block compressed, told apart by their header.
+            node (str): Name of the scanner node that recorded the file.
+
+        Returns:
+            Number of rows appended.
+        """
+        path = str(Path(file_path).resolve())
+        compressed = pi_compress.is_compressed(path)
+        with open(path, 'rb') as f:
+            header = pi_compress.read_header(f, compressed)
+            if not header:
+                return 0
+            source = self.__connection.execute("SELECT id, header, "
+                    "byte_offset, last_line, row_count FROM sources WHERE "
+                    "path = ?", (path,)).fetchone()
+            if source is not None:
+                f.seek(max(0, source[2]-len(source[3])))
+                if (source[1] != header.decode()
+                        or f.read(len(source[3])) != source[3]):
+                    self.__logger.info(f"Replacing rewritten source {path}.")
+                    self.remove_source(source[0])
+                    source = None
+            offset = 0 if source is None else source[2]
+            data, end = pi_compress.read_complete(f, offset, compressed)
+            if compressed:
+                f.seek(max(0, end-pi_compress.GZIP_TRAILER))
+                trailer = f.read(pi_compress.GZIP_TRAILER)
+        if offset == 0:
+            data = data[len(header):]
+        if not data:
+            return 0
+        last_line = trailer if compressed \
+                else data[data.rfind(b'\n', 0, -1)+1:]
+        names = pd.read_csv(io.BytesIO(header)).columns.tolist()
+        kind = 'episodes' if 'START' in names else 'advertisements'
+        frame = pd.read_csv(io.BytesIO(data), header=None, names=names)
+        with self.__connection:
+            if source is None:
+                source_id = self.__connection.execute("INSERT INTO sources "
+                        "(path, kind, node, header, byte_offset, last_line, "
+                        "row_count) VALUES (?, ?, ?, ?, ?, ?, 0)", (path,
+                            kind, node, header.decode(), offset,
+                            b'')).lastrowid
+                rows = 0
+            else:
+                source_id, rows = source[0], source[4]
+            self.insert(kind, frame, source_id, node)
+            self.__connection.execute("UPDATE sources SET byte_offset = ?, "
+                    "last_line = ?, row_count = ? WHERE id = ?",
+                    (end, last_line, rows+len(frame),
+                        source_id))
+        self.__logger.debug(f"Ingested {len(frame)} {kind} from {path}.")
+        return len(frame)
+
+    def insert(self, kind, frame, source_id, node):
+        """Insert advertisement or episode rows of one source."""
+        columns = ADVERTISEMENT_COLUMNS if kind == 'advertisements' \
+                else EPISODE_COLUMNS
+        names = ['source', 'node']
+        values = [[source_id]*len(frame), [node]*len(frame)]
+        for column, name in columns.items():
+            if column not in frame:
+                continue
+            series = frame[column]
+            if name in TIME_COLUMNS:
+                series = pd.Series(pi_timeseries.parse_timestamps(series))
+            names.append(name)
+            # Python values, sqlite3 does not bind numpy scalars
+            values.append(series.astype(object).where(series.notna(),
+                None).tolist())
+        self.__connection.executemany(f"INSERT INTO {kind} "
+                f"({', '.join(names)}) VALUES "
+                f"({', '.join('?'*len(names))})", zip(*values))
+
+    def remove_source(self, source_id):
+        """Delete a source and all rows ingested from it."""
+        with self.__connection:
+            for table in ['advertisements', 'episodes']:
+                self.__connection.execute(f"DELETE FROM {table} WHERE "
+                        "source = ?", (source_id,))
+            self.__connection.execute("DELETE FROM sources WHERE id = ?",
+                    (source_id,))
+
+    @staticmethod
+    def beacon_filter(beacon):
+        """SQL conditions and parameters selecting beacons.
+
+        Raises:
+            KeyError: Beacon selectors must be node, address, uuid, major, or
+                minor.
+        """
+        unknown = set(beacon)-set(BEACON_KEYS)
+        if unknown:
+            raise KeyError(f"Beacon selectors {sorted(unknown)} must be one "
+                    f"of {BEACON_KEYS}.")
+        conditions, parameters = [], []
+        for key, value in beacon.items():
+            if value is None:
+                continue
+            values = list(value) if isinstance(value, (list, tuple)) \
+                    else [value]
+            conditions.append(f"{key} IN ({', '.join('?'*len(values))})")
+            parameters += values
+        return conditions, parameters
+
+    @staticmethod
+    def time_bound(timestamp):
+        """Query time as int64 nanoseconds since the epoch."""
+        return int(pi_timeseries.parse_timestamps([timestamp])[0])
+
+    def query(self, sql, parameters, columns):
+        """Run a query into a DataFrame with scan file column names."""
+        frame = pd.read_sql_query(sql, self.__connection, params=parameters)
+        for name in TIME_COLUMNS:
+            if name in frame:
+                frame[name] = pd.to_datetime(frame[name].astype('Int64'))
+        names = {name: column for column, name in columns.items()}
+        return frame.rename(columns=lambda name: names.get(name,
+            name.upper().replace('_', ' ')))
+
+    def advertisements(self, start, end, **beacon):
+        """Advertisements received within a time window.
+
+        Args:
+            start (str, datetime.datetime): Window start (inclusive).
+            end (str, datetime.datetime): Window end (inclusive).
+            **beacon: Beacon selectors (node, address, uuid, major, or minor)
+                to a value or list of values.
+
+        Returns:
+            pandas.DataFrame of matching advertisements in time order.
+        """
+        conditions, parameters = self.beacon_filter(beacon)
+        conditions.insert(0, "timestamp BETWEEN ? AND ?")
+        parameters = [self.time_bound(start), self.time_bound(end)] \
+                + parameters
+        return self.query("SELECT node, scan, address, timestamp, uuid, "
+                "major, minor, tx_power, rssi FROM advertisements WHERE "
+                f"{' AND '.join(conditions)} ORDER BY timestamp", parameters,
+                ADVERTISEMENT_COLUMNS)
+
+    def overlap(self, start, end, beacon):
+        """SQL conditions and parameters of episodes overlapping a window.
+
+        An episode overlaps the window if it starts before the window ends
+        and ends after it starts. No episode is longer than the longest
+        stored one (read from the duration index), so the start is also
+        bounded below, which lets the start index answer the query as a
+        range scan.
+        """
+        conditions, parameters = self.beacon_filter(beacon)
+        start, end = self.time_bound(start), self.time_bound(end)
+        longest = self.__connection.execute("SELECT MAX(duration) FROM "
+                "episodes").fetchone()[0] or 0
+        longest = int(longest*pi_timeseries.NS_PER_S)+1
+        conditions[:0] = ["start_time BETWEEN ? AND ?", "end_time >= ?"]
+        return conditions, [start-longest, end, start]+parameters, start, end
+
+    def episodes(self, start, end, **beacon):
+        """Contact episodes overlapping a time window.
+
+        Args:
+            start (str, datetime.datetime): Window start.
+            end (str, datetime.datetime): Window end.
+            **beacon: Beacon selectors, see advertisements.
+
+        Returns:
+            pandas.DataFrame of overlapping episodes in start order.
+        """
+        conditions, parameters, _, _ = self.overlap(start, end, beacon)
+        return self.query("SELECT node, address, uuid, major, minor, "
+                "start_time, end_time, duration, peak_rssi, median_rssi, "
+                f"count FROM episodes WHERE {' AND '.join(conditions)} "
+                "ORDER BY start_time", parameters, EPISODE_COLUMNS)
+
+    def exposure(self, start, end, **beacon):
+        """Contact exposure of each node and beacon within a time window.
+
+        Args:
+            start (str, datetime.datetime): Window start.
+            end (str, datetime.datetime): Window end.
+            **beacon: Beacon selectors, see advertisements.
+
+        Returns:
+            pandas.DataFrame with one row per node and beacon, their number
+            of EPISODES, total CONTACT TIME (s) clipped to the window, FIRST
+            CONTACT start, LAST CONTACT end, and PEAK RSSI, longest contact
+            time first.
+        """
+        conditions, parameters, start, end = self.overlap(start, end, beacon)
+        return self.query("SELECT node, address, uuid, major, minor, "
+                "COUNT(*) AS episodes, SUM(MIN(end_time, ?)"
+                "-MAX(start_time, ?))/1e9 AS contact_time, MIN(start_time) "
+                "AS first_contact, MAX(end_time) AS last_contact, "
+                "MAX(peak_rssi) AS peak_rssi FROM episodes WHERE "
+                f"{' AND '.join(conditions)} GROUP BY node, address, uuid, "
+                "major, minor ORDER BY contact_time DESC",
+                [end, start]+parameters, EPISODE_COLUMNS)
+
+def parse_args(args):
+    """Input argument parser.
+
+    Args:
+        args (list): Input arguments as taken from command line execution via
+            sys.argv[1:].
+
+    Returns:
+        parsed_args (dict): Parsed input arguments keyed by argument name.
+    """
+    parser = argparse.ArgumentParser(
+            description="Indexed advertisement and contact episode store.")
+    mode_group = parser.add_mutually_exclusive_group(required=True)
+    mode_group.add_argument('-i', '--ingest', metavar='SCAN_DIR',
+            help="Append new rows of scan and contact files in SCAN_DIR.")
+    mode_group.add_argument('-a', '--advertisements', action='store_true',
+            help="List advertisements within the time window.")
+    mode_group.add_argument('-e', '--episodes', action='store_true',
+            help="List contact episodes overlapping the time window.")
+    mode_group.add_argument('-x', '--exposure', action='store_true',
+            help="Summarize contact exposure within the time window.")
+    parser.add_argument('--db_file', required=True, help="SQLite database.")
+    parser.add_argument('--node', help="Scanner node name of ingested files "
+            "or node to query.")
+    parser.add_argument('--start', default="1970-01-01",
+            help="Query window start timestamp.")
+    parser.add_argument('--end', default="2262-01-01",
+            help="Query window end timestamp.")
+    parser.add_argument('--address', help="Beacon address to query.")
+    parser.add_argument('--uuid', help="Beacon UUID to query.")
+    parser.add_argument('--major', type=int, help="Beacon major to query.")
+    parser.add_argument('--minor', type=int, help="Beacon minor to query.")
+    return vars(parser.parse_args(args))
+
+def main(args):
+    """Ingestion into or query of an exposure store.
+
+    Args:
+        args (list): Arguments as provided by sys.argv.
+    """
+    parsed_args = parse_args(args)
+    logging.basicConfig(level=logging.INFO,
+            format='%(asctime)s   %(levelname)-8s   %(message)s')
+    with ExposureStore(parsed_args['db_file']) as store:
+        if parsed_args['ingest']:
+            rows = store.ingest(parsed_args['ingest'], parsed_args['node'])
+            print(f"Appended {rows} rows.")
+            return
+        beacon = {key: parsed_args[key] for key in BEACON_KEYS}
+        if parsed_args['advertisements']:
+            method = store.advertisements
+        elif parsed_args['episodes']:
+            method = store.episodes
+        else:
+            method = store.exposure
+        print(method(parsed_args['start'], parsed_args['end'],
+            **beacon).to_string())
+
+if __name__ == "__main__":
+    """Script execution."""
+    main(sys.argv[1:])
@@ -0,0 +1,396 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Allow and deny lists of beacon identifiers loaded from files.
+
+A list file holds one identifier per line, e.g., a beacon address, UUID, or
+major value. Blank lines and text after '#' are ignored, and addresses and
+UUIDs match regardless of case. A list is held in a hashed set, so testing
+an advertisement takes constant time however long the list is. Very large
+deny lists can be held in a Bloom filter instead, which takes a fixed number
+of bits per entry but drops a small fraction (the false positive rate) of
+advertisements that are not listed.
+
+List files are checked for changes at most once per reload interval and
+reloaded while the scanner is running. A list file that cannot be read keeps
+the previously loaded list.
+
+Running this module benchmarks the memory and lookup time of the set and
+the Bloom filter, and checks the measured false positive rate of Bloom
+filters of small to moderate capacities against the configured rate.
+"""
+
+import argparse
+import hashlib
+import logging
+import math
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import sys
+import time
+
+# Universal settings
+STRING_KEYS = ['ADDRESS', 'UUID'] # Matched regardless of case
+INTEGER_KEYS = ['MAJOR', 'MINOR', 'TX POWER']
+RELOAD_INTERVAL = 1.0 # (s) Between checks of a list file for changes
+CHECK_CAPACITIES = [1, 3, 10, 30, 100, 300, 1000] # Bloom filter rate check
+
+def read_entries(list_file, key):
+    """Identifiers listed in a list file.
+
+    Args:
+        list_file (str, pathlib.Path): List file.
+        key (str): Filtered field, one of STRING_KEYS or INTEGER_KEYS.
+
+    Returns:
+        List of normalized identifiers.
+
+    Raises:
+        ValueError: Identifiers of integer fields must be integers.
+    """
+    entries = []
+    with open(list_file, 'r') as f:
+        for line in f:
+            entry = line.split('#', 1)[0].strip()
+            if not entry:
+                continue
+            if key in INTEGER_KEYS:
+                try:
+                    entries.append(int(entry))
+                except ValueError:
+                    raise ValueError(f"{key} list entries must be integers, "
+                            f"got {entry} in {list_file}.") from None
+            else:
+                entries.append(entry.upper())
+    return entries
+
+def normalize(values, key):
+    """Field values of advertisements normalized for lookup.
+
+    Args:
+        values (pandas.Series): Field values.
+        key (str): Filtered field.
+    """
+    if key in STRING_KEYS:
+        return values.astype(str).str.upper()
+    return values
+
+class BloomFilter(object):
+    """Instantiates a Bloom filter of strings and integers.
+
+    Attributes:
+        size (int): Number of bits, a power of two.
+        hashes (int): Number of bit positions per entry.
+    """
+
+    def __init__(self, capacity, error_rate):
+        """Instance initialization.
+
+        Args:
+            capacity (int): Number of entries for which the false positive
+                rate holds.
+            error_rate (float): False positive rate, in (0, 1).
+        """
+        capacity = max(1, capacity)
+        bits = math.ceil(-capacity*math.log(error_rate)/math.log(2)**2)
+        self.hashes = max(1, round(bits/capacity*math.log(2)))
+        # A lookup whose first position and step match those of an entry is
+        # a false positive however many hashes are used, with a chance of
+        # about capacity/(size**2/2). Small filters get enough bits to keep
+        # that below a quarter of the rate. Extra bits only lower the false
+        # positive rate, so the size is also rounded up to a power of two
+        # and positions are taken by masking.
+        bits = max(bits, math.ceil(math.sqrt(8*capacity/error_rate)))
+        self.size = 1 << (bits-1).bit_length()
+        self.__bits = np.zeros((self.size+7)//8, dtype=np.uint8)
+
+    @property
+    def nbytes(self):
+        """Memory (bytes) of the bit array."""
+        return self.__bits.nbytes
+
+    def positions(self, entry):
+        """Bit positions of an entry, by enhanced double hashing one digest.
+
+        The step grows by the round number, so that entries whose first
+        positions coincide do not share every later position as with plain
+        double hashing, which raises the false positive rate of small
+        filters.
+        """
+        digest = hashlib.blake2b(str(entry).encode(), digest_size=16).digest()
+        position = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        mask = self.size-1
+        positions = []
+        for i in range(self.hashes):
+            positions.append(position & mask)
+            position += step
+            step += i
+        return positions
+
+    def add(self, entry):
+        """Add an entry."""
+        for position in self.positions(entry):
+            self.__bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, entry):
+        return all(self.__bits[position >> 3] & (1 << (position & 7))
+                for position in self.positions(entry))
+
+class FilterList(object):
+    """Instantiates an allow or deny list reloaded when its file changes.
+
+    Attributes:
+        list_file (pathlib.Path): List file.
+        key (str): Filtered field.
+        error_rate (float): Bloom filter false positive rate, or None to
+            hold the list in a set.
+        entries (int): Number of loaded entries.
+    """
+
+    def __init__(self, list_file, key, error_rate=None, logger=None):
+        """Instance initialization.
+
+        Args:
+            list_file (str, pathlib.Path): List file.
+            key (str): Filtered field, one of STRING_KEYS or INTEGER_KEYS.
+            error_rate (float): Bloom filter false positive rate.
+            logger (logging.Logger): Configured logger. Defaults to the
+                module logger.
+
+        Raises:
+            KeyError: Filtered field must be a beacon identifier.
+            TypeError: Bloom filter false positive rate must be a float.
+            ValueError: Bloom filter false positive rate must be in (0, 1).
+        """
+        if key not in STRING_KEYS+INTEGER_KEYS:
+            raise KeyError("List filter field must be one of beacon "
+                    f"identifiers {STRING_KEYS+INTEGER_KEYS}.")
+        if error_rate is not None:
+            if not isinstance(error_rate, float):
+                raise TypeError("Bloom filter false positive rate must be a "
+                        "float.")
+            elif not 0 < error_rate < 1:
+                raise ValueError("Bloom filter false positive rate must be "
+                        "in (0, 1).")
+        self.__logger = logger or logging.getLogger(__name__)
+        self.list_file = Path(list_file)
+        self.key = key
+        self.error_rate = error_rate
+        self.entries = 0
+        self.__members = None
+        self.__stat = None
+        self.__checked = None
+        self.__error = None
+        self.reload()
+
+    def reload(self):
+        """Load the list file if it changed since it was last loaded."""
+        self.__checked = time.monotonic()
+        try:
+            stat = self.list_file.stat()
+            if (stat.st_mtime_ns, stat.st_size) == self.__stat:
+                return
+            entries = read_entries(self.list_file, self.key)
+        except (OSError, ValueError) as error:
+            if self.__members is None:
+                raise
+            # Warn once per failure rather than at every check
+            if str(error) != self.__error:
+                self.__error = str(error)
+                self.__logger.warning(f"Keeping previous {self.key} list, "
+                        f"reloading {self.list_file} failed: {error}")
+            return
+        if self.error_rate is None:
+            # The index keeps its hash table between lookups
+            members = pd.Index(entries).unique()
+            size = f"{members.memory_usage(deep=True)/1024:.1f} KiB set"
+        else:
+            members = BloomFilter(len(entries), self.error_rate)
+            for entry in entries:
+                members.add(entry)
+            size = f"{members.nbytes/1024:.1f} KiB Bloom filter"
+        self.__members = members
+        self.__stat = (stat.st_mtime_ns, stat.st_size)
+        self.__error = None
+        self.entries = len(entries)
+        self.__logger.info(f"Loaded {self.entries} {self.key} entries from "
+                f"{self.list_file} into a {size}.")
+
+    def contains(self, values):
+        """Whether each value is listed.
+
+        Args:
+            values (pandas.Series): Field values of advertisements.
+
+        Returns:
+            numpy.ndarray of bool, one per value.
+        """
+        if time.monotonic()-self.__checked >= RELOAD_INTERVAL:
+            self.reload()
+        values = normalize(values, self.key)
+        if self.error_rate is None:
+            return self.__members.get_indexer(values) >= 0
+        return np.fromiter((value in self.__members for value in values),
+                dtype=bool, count=len(values))
+
+class IdFilter(object):
+    """Instantiates an allow and/or deny list filter of one field.
+
+    Attributes:
+        key (str): Filtered field.
+        allow (FilterList): Listed values are kept, all others dropped, or
+            None.
+        deny (FilterList): Listed values are dropped, or None.
+    """
+
+    def __init__(self, key, allow=None, deny=None, bloom=None, logger=None):
+        """Instance initialization.
+
+        Args:
+            key (str): Filtered field.
+            allow (str, pathlib.Path): Allow list file.
+            deny (str, pathlib.Path): Deny list file.
+            bloom (float): False positive rate of a Bloom filter holding the
+                deny list, or None to hold it in a set. Allow lists are
+                always held in a set, since false positives would keep
+                unlisted devices.
+            logger (logging.Logger): Configured logger.
+
+        Raises:
+            ValueError: At least one of allow or deny list files must be
+                specified.
+        """
+        if allow is None and deny is None:
+            raise ValueError(f"{key} list filter must specify an allow or "
+                    "deny list file.")
+        self.key = key
+        self.allow = FilterList(allow, key, logger=logger) \
+                if allow is not None else None
+        self.deny = FilterList(deny, key, bloom, logger) \
+                if deny is not None else None
+
+    def keep(self, values):
+        """Whether each value passes the filter.
+
+        Args:
+            values (pandas.Series): Field values of advertisements.
+
+        Returns:
+            numpy.ndarray of bool, one per value.
+        """
+        keep = np.ones(len(values), dtype=bool)
+        if self.allow is not None:
+            keep &= self.allow.contains(values)
+        if self.deny is not None:
+            keep &= ~self.deny.contains(values)
+        return keep
+
+def benchmark(entries=100000, lookups=100000, error_rate=0.001):
+    """Memory and lookup time of list filters held in a set and a Bloom
+    filter.
+
+    Args:
+        entries (int): Number of listed addresses.
+        lookups (int): Number of looked up addresses, half of them listed.
+        error_rate (float): Bloom filter false positive rate.
+
+    Returns:
+        pandas.DataFrame with one row per representation: memory (bytes),
+        lookup time per address (us), and false positive rate measured on
+        the unlisted half of the lookups.
+    """
+    rng = np.random.default_rng(0)
+    addresses = [':'.join(f"{byte:02X}" for byte in row) for row in
+            rng.integers(0, 256, size=(entries+lookups//2, 6))]
+    listed = addresses[:entries]
+    values = pd.Series(listed[:lookups-lookups//2]+addresses[entries:])
+    unlisted = np.arange(len(values)) >= lookups-lookups//2
+    results = []
+    for name, members in [('set', pd.Index(listed).unique()),
+            ('bloom', BloomFilter(entries, error_rate))]:
+        if name == 'bloom':
+            for address in listed:
+                members.add(address)
+            memory = members.nbytes
+        else:
+            memory = members.memory_usage(deep=True)
+        start = time.perf_counter()
+        if name == 'bloom':
+            found = np.fromiter((value in members for value in values),
+                    dtype=bool, count=len(values))
+        else:
+            found = members.get_indexer(values) >= 0
+        elapsed = time.perf_counter()-start
+        results.append({'REPRESENTATION': name, 'BYTES': memory,
+            'LOOKUP (us)': 1e6*elapsed/len(values),
+            'FALSE POSITIVES': found[unlisted].mean()})
+    return pd.DataFrame(results)
+
+def check_error_rate(error_rate=0.001, lookups=100000,
+        capacities=CHECK_CAPACITIES):
+    """Measured false positive rate of Bloom filters filled to capacity.
+
+    Args:
+        error_rate (float): Configured false positive rate.
+        lookups (int): Number of looked up unlisted addresses per filter.
+        capacities (list): Filter capacities, small ones are where hashed
+            positions are most likely to coincide.
+
+    Returns:
+        pandas.DataFrame with one row per capacity: bits, hashes, measured
+        FALSE POSITIVES, and whether the measured rate is WITHIN the
+        configured rate, allowing three standard errors of measurement.
+    """
+    rng = np.random.default_rng(1)
+    tolerance = 3*math.sqrt(error_rate*(1-error_rate)/lookups)
+    results = []
+    for capacity in capacities:
+        addresses = [':'.join(f"{byte:02X}" for byte in row) for row in
+                rng.integers(0, 256, size=(capacity+lookups, 6))]
+        members = BloomFilter(capacity, error_rate)
+        for address in addresses[:capacity]:
+            members.add(address)
+        rate = np.mean([address in members
+            for address in addresses[capacity:]])
+        results.append({'CAPACITY': capacity, 'BITS': members.size,
+            'HASHES': members.hashes, 'FALSE POSITIVES': rate,
+            'WITHIN': rate <= error_rate+tolerance})
+    return pd.DataFrame(results)
+
+def parse_args(args):
+    """Input argument parser.
+
+    Args:
+        args (list): Input arguments as taken from command line execution via
+            sys.argv[1:].
+
+    Returns:
+        parsed_args (dict): Parsed input arguments keyed by argument name.
+    """
+    parser = argparse.ArgumentParser(
+            description="Benchmark allow and deny list representations.")
+    parser.add_argument('--entries', type=int, default=100000,
+            help="Number of listed addresses.")
+    parser.add_argument('--lookups', type=int, default=100000,
+            help="Number of looked up addresses.")
+    parser.add_argument('--error_rate', type=float, default=0.001,
+            help="Bloom filter false positive rate.")
+    return vars(parser.parse_args(args))
+
+def main(args):
+    """Allow and deny list benchmark.
+
+    Args:
+        args (list): Arguments as provided by sys.argv.
+    """
+    parsed_args = parse_args(args)
+    print(benchmark(**parsed_args).to_string(index=False))
+    print(f"\nBloom filter false positive rate {parsed_args['error_rate']} "
+            "by capacity:")
+    print(check_error_rate(parsed_args['error_rate'],
+        parsed_args['lookups']).to_string(index=False))
+
+if __name__ == "__main__":
+    """Script execution."""
+    main(sys.argv[1:])
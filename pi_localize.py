@@ -0,0 +1,589 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Beacon localization from the advertisements of several scanners.
+
+Advertisements received by scanners at known positions are binned into
+fixed time windows, averaged per beacon and scanner, and converted to
+ranges with the log-distance path loss model calibrated by the RSSI at 1 m
+(measured power) and the path loss exponent. Every beacon/window position is
+then the weighted nonlinear least squares fit of those ranges.
+
+All beacon/window problems are solved together: a batch of Levenberg-
+Marquardt iterations works on arrays of shape (problems, scanners,
+dimensions), with missing scanners given zero weight, so that the cost per
+iteration is a handful of numpy operations regardless of the number of
+beacons. Range errors grow with range (a fixed RSSI error is a fixed
+relative range error), so each range is weighted by its number of
+advertisements over its squared range.
+
+Running this module localizes the beacons in scan files of several
+scanners, or benchmarks the solver on simulated advertisements.
+"""
+
+import argparse
+import glob
+import numpy as np
+import pandas as pd
+import pi_compress
+import pi_timeseries
+import sys
+import time
+import yaml
+
+# Default configuration
+DEFAULT_CONFIG = {
+    'positions': {},
+    'group_by': ['ADDRESS'],
+    'window': 2.0,
+    'measured_power': -59.0,
+    'path_loss_exponent': 2.0,
+    'min_scanners': None,
+    'max_iterations': 20,
+    'tolerance': 0.01
+    }
+
+# Universal settings
+AXES = ['X', 'Y', 'Z']
+INITIAL_DAMPING = 1e-3
+MAX_DAMPING = 1e10
+MIN_DISTANCE = 1e-9 # (m) Below which a scanner direction is undefined
+
+def rssi_to_distance(rssi, measured_power, path_loss_exponent):
+    """Distance at which the log-distance path loss model expects an RSSI.
+
+    Args:
+        rssi (array_like): RSSI (dBm).
+        measured_power (array_like): RSSI at 1 m (dBm).
+        path_loss_exponent (float): Path loss exponent, 2 in free space.
+
+    Returns:
+        Distance (m).
+    """
+    return np.power(10.0, (np.asarray(measured_power)-np.asarray(rssi))
+            /(10*path_loss_exponent))
+
+def solve(anchors, ranges, weights, initial=None, max_iterations=20,
+        tolerance=0.01):
+    """Batched weighted nonlinear least squares multilateration.
+
+    Minimizes sum(weights*(|x-anchors|-ranges)**2) for every problem with
+    Levenberg-Marquardt iterations applied to all unconverged problems at
+    once.
+
+    Args:
+        anchors (array_like): Scanner positions with shape (scanners,
+            dimensions), shared by all problems, or (problems, scanners,
+            dimensions).
+        ranges (array_like): Ranges (m) with shape (problems, scanners).
+        weights (array_like): Range weights with shape (problems, scanners),
+            zero for missing ranges.
+        initial (array_like): Initial positions with shape (problems,
+            dimensions). Defaults to the weighted centroid of the anchors.
+        max_iterations (int): Maximum number of iterations.
+        tolerance (float): Step length (m) below which a problem has
+            converged.
+
+    Returns:
+        Tuple of positions with shape (problems, dimensions), weighted RMS
+        range residuals (m), and converged flags.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    ranges = np.where(weights > 0, np.asarray(ranges, dtype=np.float64), 0.0)
+    problems, scanners = weights.shape
+    anchors = np.broadcast_to(np.asarray(anchors, dtype=np.float64),
+            (problems, scanners, np.shape(anchors)[-1]))
+    dimensions = anchors.shape[2]
+    total = weights.sum(axis=1)
+    if initial is None:
+        position = np.einsum('ps,psd->pd', weights, anchors)/total[:, None]
+    else:
+        position = np.array(initial, dtype=np.float64)
+
+    def cost(anchors, ranges, weights, position):
+        distance = np.linalg.norm(position[:, None, :]-anchors, axis=2)
+        return np.einsum('ps,ps->p', weights, np.square(distance-ranges))
+
+    current = cost(anchors, ranges, weights, position)
+    damping = np.full(problems, INITIAL_DAMPING)
+    converged = np.zeros(problems, dtype=bool)
+    active = np.flatnonzero(total > 0)
+    identity = np.eye(dimensions)
+    for _ in range(max_iterations):
+        if not len(active):
+            break
+        a, r, w = anchors[active], ranges[active], weights[active]
+        x = position[active]
+        difference = x[:, None, :]-a
+        distance = np.maximum(np.linalg.norm(difference, axis=2),
+                MIN_DISTANCE)
+        jacobian = difference/distance[:, :, None]
+        weighted = jacobian*w[:, :, None]
+        normal = np.einsum('psi,psj->pij', weighted, jacobian)
+        gradient = np.einsum('psi,ps->pi', weighted, distance-r)
+        # Marquardt scaling of the damping, with a floor for directions no
+        # scanner constrains
+        diagonal = np.einsum('pii->pi', normal)+MIN_DISTANCE
+        damped = normal+damping[active, None, None]*identity \
+                *diagonal[:, None, :]
+        step = -np.linalg.solve(damped, gradient[:, :, None])[:, :, 0]
+        candidate = x+step
+        trial = cost(a, r, w, candidate)
+        better = trial < current[active]
+        accepted = active[better]
+        position[accepted] = candidate[better]
+        current[accepted] = trial[better]
+        damping[active] = np.where(better, damping[active]/10,
+                damping[active]*10)
+        # Done once steps are short or no step reduces the cost any more
+        done = (better & (np.linalg.norm(step, axis=1) < tolerance)) \
+                | (damping[active] > MAX_DAMPING)
+        converged[active[done]] = True
+        active = active[~done]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        residual = np.sqrt(current/total)
+    return position, residual, converged
+
+class Localizer(object):
+    """Instantiates a multi-scanner beacon localizer.
+
+    Attributes:
+        positions (dict): Scanner positions (m) keyed by scanner name, each a
+            list of two (x, y) or three (x, y, z) coordinates.
+        group_by (list): Advertisement fields identifying a beacon.
+        window (float): Time window (s) within which a beacon is considered
+            stationary. Windows are aligned to the epoch so that the windows
+            of all scanners coincide.
+        measured_power (float, dict): RSSI (dBm) at 1 m, or a dictionary of
+            it keyed by scanner name for scanners calibrated individually.
+        path_loss_exponent (float): Path loss exponent of the range model.
+        min_scanners (int): Fewest scanners hearing a beacon in a window for
+            it to be localized. Defaults to one more than the dimensions.
+        max_iterations (int): Maximum solver iterations.
+        tolerance (float): Solver step length (m) at which a position has
+            converged.
+    """
+
+    def __init__(self, **kwargs):
+        """Instance initialization.
+
+        Args:
+            **kwargs: Keyword arguments corresponding to instance attributes.
+                Any unassociated keyword arguments are ignored.
+
+        Raises:
+            ValueError: Localizer measured power must be given for every
+                scanner.
+        """
+        for key, value in DEFAULT_CONFIG.items():
+            if key in kwargs and kwargs[key] is not None:
+                setattr(self, key, kwargs[key])
+            else:
+                setattr(self, key, value)
+        self.__scanners = list(self.positions)
+        self.__anchors = np.array([self.positions[scanner]
+            for scanner in self.__scanners], dtype=np.float64)
+        if isinstance(self.measured_power, dict):
+            missing = set(self.__scanners)-set(self.measured_power)
+            if missing:
+                raise ValueError("Localizer measured power must be given for "
+                        f"every scanner, missing {sorted(missing)}.")
+            self.__powers = np.array([self.measured_power[scanner]
+                for scanner in self.__scanners], dtype=np.float64)
+        else:
+            self.__powers = np.full(len(self.__scanners),
+                    float(self.measured_power))
+
+    @property
+    def positions(self):
+        """Scanner positions getter."""
+        return self.__positions
+
+    @positions.setter
+    def positions(self, value):
+        """Scanner positions setter.
+
+        Raises:
+            TypeError: Localizer positions must be a dictionary.
+            ValueError: Localizer positions must not be empty.
+            ValueError: Localizer positions must all have 2 or 3 coordinates.
+        """
+        if not isinstance(value, dict):
+            raise TypeError("Localizer positions must be a dictionary.")
+        elif not value:
+            raise ValueError("Localizer positions must not be empty.")
+        lengths = {len(position) for position in value.values()}
+        if len(lengths) != 1 or lengths.pop() not in (2, 3):
+            raise ValueError("Localizer positions must all have 2 or 3 "
+                    "coordinates.")
+        self.__positions = value
+
+    @property
+    def group_by(self):
+        """Beacon identifier fields getter."""
+        return self.__group_by
+
+    @group_by.setter
+    def group_by(self, value):
+        """Beacon identifier fields setter.
+
+        Raises:
+            TypeError: Localizer group by must be a non-empty list.
+        """
+        if not isinstance(value, list) or not value:
+            raise TypeError("Localizer group by must be a non-empty list.")
+        self.__group_by = value
+
+    @property
+    def window(self):
+        """Time window getter."""
+        return self.__window
+
+    @window.setter
+    def window(self, value):
+        """Time window setter.
+
+        Raises:
+            TypeError: Localizer window must be a float or integer.
+            ValueError: Localizer window must be strictly positive.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Localizer window must be a float or integer.")
+        elif value <= 0:
+            raise ValueError("Localizer window must be strictly positive.")
+        self.__window = value
+
+    @property
+    def measured_power(self):
+        """RSSI at 1 m getter."""
+        return self.__measured_power
+
+    @measured_power.setter
+    def measured_power(self, value):
+        """RSSI at 1 m setter.
+
+        Raises:
+            TypeError: Localizer measured power must be a float, integer, or
+                dictionary.
+        """
+        if not isinstance(value, (float, int, dict)):
+            raise TypeError("Localizer measured power must be a float, "
+                    "integer, or dictionary.")
+        self.__measured_power = value
+
+    @property
+    def path_loss_exponent(self):
+        """Path loss exponent getter."""
+        return self.__path_loss_exponent
+
+    @path_loss_exponent.setter
+    def path_loss_exponent(self, value):
+        """Path loss exponent setter.
+
+        Raises:
+            TypeError: Localizer path loss exponent must be a float or
+                integer.
+            ValueError: Localizer path loss exponent must be strictly
+                positive.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Localizer path loss exponent must be a float or "
+                    "integer.")
+        elif value <= 0:
+            raise ValueError("Localizer path loss exponent must be strictly "
+                    "positive.")
+        self.__path_loss_exponent = value
+
+    @property
+    def min_scanners(self):
+        """Fewest scanners per position getter."""
+        if self.__min_scanners is None:
+            return len(next(iter(self.positions.values())))+1
+        return self.__min_scanners
+
+    @min_scanners.setter
+    def min_scanners(self, value):
+        """Fewest scanners per position setter.
+
+        Raises:
+            TypeError: Localizer minimum scanners must be an integer or
+                NoneType.
+            ValueError: Localizer minimum scanners must be at least 2.
+        """
+        if value is not None:
+            if not isinstance(value, int):
+                raise TypeError("Localizer minimum scanners must be an "
+                        "integer or NoneType.")
+            elif value < 2:
+                raise ValueError("Localizer minimum scanners must be at "
+                        "least 2.")
+        self.__min_scanners = value
+
+    @property
+    def max_iterations(self):
+        """Maximum solver iterations getter."""
+        return self.__max_iterations
+
+    @max_iterations.setter
+    def max_iterations(self, value):
+        """Maximum solver iterations setter.
+
+        Raises:
+            TypeError: Localizer maximum iterations must be an integer.
+            ValueError: Localizer maximum iterations must be strictly
+                positive.
+        """
+        if not isinstance(value, int):
+            raise TypeError("Localizer maximum iterations must be an "
+                    "integer.")
+        elif value <= 0:
+            raise ValueError("Localizer maximum iterations must be strictly "
+                    "positive.")
+        self.__max_iterations = value
+
+    @property
+    def tolerance(self):
+        """Solver step tolerance getter."""
+        return self.__tolerance
+
+    @tolerance.setter
+    def tolerance(self, value):
+        """Solver step tolerance setter.
+
+        Raises:
+            TypeError: Localizer tolerance must be a float or integer.
+            ValueError: Localizer tolerance must be strictly positive.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Localizer tolerance must be a float or integer.")
+        elif value <= 0:
+            raise ValueError("Localizer tolerance must be strictly positive.")
+        self.__tolerance = value
+
+    @property
+    def dimensions(self):
+        """Number of position coordinates."""
+        return self.__anchors.shape[1]
+
+    def bin(self, advertisements):
+        """Average advertisements per time window, beacon, and scanner.
+
+        Args:
+            advertisements (pandas.DataFrame): Advertisements with group_by,
+                TIMESTAMP, RSSI, and SCANNER columns. Advertisements of
+                scanners without a position are ignored.
+
+        Returns:
+            pandas.DataFrame with WINDOW (int64 ns start of the window),
+            group_by, SCANNER (index into positions), RSSI (mean), and COUNT
+            columns.
+        """
+        scanner = pd.Categorical(advertisements['SCANNER'],
+                categories=self.__scanners).codes
+        window = int(round(self.window*1e9))
+        binned = advertisements[self.group_by].assign(
+                WINDOW=pi_timeseries.parse_timestamps(
+                    advertisements['TIMESTAMP'])//window*window,
+                SCANNER=scanner,
+                RSSI=advertisements['RSSI'].to_numpy(dtype=np.float64))
+        binned = binned[scanner >= 0]
+        return binned.groupby(['WINDOW']+self.group_by+['SCANNER'],
+                sort=False)['RSSI'].agg(RSSI='mean', COUNT='size') \
+                        .reset_index()
+
+    def localize(self, advertisements):
+        """Estimate beacon positions in every time window.
+
+        Args:
+            advertisements (pandas.DataFrame): Advertisements of all scanners
+                with group_by, TIMESTAMP, RSSI, and SCANNER (scanner name)
+                columns.
+
+        Returns:
+            pandas.DataFrame with WINDOW (start timestamp), group_by, one
+            column per coordinate (X, Y, and Z), SCANNERS (number of
+            scanners used), RESIDUAL (weighted RMS range residual (m)), and
+            CONVERGED columns, one row per beacon and window heard by at
+            least min_scanners scanners.
+        """
+        axes = AXES[:self.dimensions]
+        binned = self.bin(advertisements)
+        keys = ['WINDOW']+self.group_by
+        problem = binned.groupby(keys, sort=True).ngroup().to_numpy()
+        problems = problem.max()+1 if len(problem) else 0
+        scanner = binned['SCANNER'].to_numpy()
+        counts = np.bincount(problem, minlength=problems)
+        ranges = np.zeros((problems, len(self.__scanners)))
+        weights = np.zeros_like(ranges)
+        distance = rssi_to_distance(binned['RSSI'].to_numpy(),
+                self.__powers[scanner], self.path_loss_exponent)
+        ranges[problem, scanner] = distance
+        weights[problem, scanner] = binned['COUNT'].to_numpy() \
+                /np.square(distance)
+        solvable = counts >= self.min_scanners
+        position, residual, converged = solve(self.__anchors,
+                ranges[solvable], weights[solvable],
+                max_iterations=self.max_iterations, tolerance=self.tolerance)
+        # One row per problem in problem order
+        _, first = np.unique(problem, return_index=True)
+        result = binned.iloc[first[solvable]][keys].reset_index(drop=True)
+        result['WINDOW'] = pd.to_datetime(result['WINDOW'])
+        for i, axis in enumerate(axes):
+            result[axis] = position[:, i]
+        result['SCANNERS'] = counts[solvable]
+        result['RESIDUAL'] = residual
+        result['CONVERGED'] = converged
+        return result
+
+def simulate(beacons, positions, windows=1, window=2.0, area=50.0,
+        measured_power=-59.0, path_loss_exponent=2.0, rssi_noise=2.0,
+        advertisements=3, seed=0):
+    """Simulated advertisements of beacons at random positions.
+
+    Args:
+        beacons (int): Number of beacons.
+        positions (dict): Scanner positions keyed by scanner name.
+        windows (int): Number of time windows.
+        window (float): Time window (s).
+        area (float): Side (m) of the square (or cube) holding the beacons.
+        measured_power (float): RSSI (dBm) at 1 m.
+        path_loss_exponent (float): Path loss exponent.
+        rssi_noise (float): RSSI noise standard deviation (dB).
+        advertisements (int): Advertisements per beacon, scanner, and window.
+        seed (int): Random seed.
+
+    Returns:
+        Tuple of advertisements in a pandas.DataFrame with ADDRESS,
+        TIMESTAMP, RSSI, and SCANNER columns, and true beacon positions in a
+        pandas.DataFrame indexed by address.
+    """
+    rng = np.random.default_rng(seed)
+    names = list(positions)
+    anchors = np.array([positions[name] for name in names], dtype=np.float64)
+    truth = rng.uniform(0, area, (beacons, anchors.shape[1]))
+    addresses = np.array([':'.join(f"{value:012X}"[i:i+2]
+        for i in range(0, 12, 2)) for value in rng.choice(2**48, beacons,
+            replace=False).tolist()], dtype=object)
+    distance = np.maximum(np.linalg.norm(truth[:, None, :]-anchors, axis=2),
+            0.1)
+    beacon, scanner, repeat, index = np.meshgrid(np.arange(beacons),
+            np.arange(len(names)), np.arange(advertisements),
+            np.arange(windows), indexing='ij')
+    beacon, scanner, index = beacon.ravel(), scanner.ravel(), index.ravel()
+    rssi = measured_power-10*path_loss_exponent*np.log10(
+            distance[beacon, scanner])+rng.normal(0, rssi_noise, len(beacon))
+    start = pd.Timestamp('2020-01-01').value
+    timestamps = start+((index+rng.uniform(0, 1, len(beacon)))*window*1e9) \
+            .astype(np.int64)
+    frame = pd.DataFrame({'ADDRESS': addresses[beacon],
+        'TIMESTAMP': pd.to_datetime(timestamps),
+        'RSSI': np.round(rssi).astype(np.int64),
+        'SCANNER': np.array(names, dtype=object)[scanner]})
+    return frame, pd.DataFrame(truth, index=addresses,
+            columns=AXES[:anchors.shape[1]])
+
+def benchmark(beacons=2000, scanners=6, windows=1, area=50.0):
+    """Time the localization of simulated beacons.
+
+    Scanners are spread evenly around the edge of the area.
+
+    Returns:
+        Dictionary of advertisements, localized positions, seconds, positions
+        per second, and median position error (m).
+    """
+    angles = np.linspace(0, 2*np.pi, scanners, endpoint=False)
+    positions = {f"pi{i}": [area/2*(1+np.cos(angle)),
+        area/2*(1+np.sin(angle))] for i, angle in enumerate(angles)}
+    advertisements, truth = simulate(beacons, positions, windows, area=area)
+    localizer = Localizer(positions=positions)
+    start = time.perf_counter()
+    result = localizer.localize(advertisements)
+    elapsed = time.perf_counter()-start
+    error = np.linalg.norm(result[['X', 'Y']].to_numpy()
+            -truth.loc[result['ADDRESS'], ['X', 'Y']].to_numpy(), axis=1)
+    return {'advertisements': len(advertisements), 'positions': len(result),
+            'seconds': elapsed, 'positions per second': len(result)/elapsed,
+            'median error (m)': float(np.median(error))}
+
+def load_scanners(scanners):
+    """Advertisements of the scan files of every scanner.
+
+    Args:
+        scanners (dict): Scanner settings keyed by scanner name, each with a
+            'files' list of scan file glob patterns.
+
+    Returns:
+        Advertisements in a pandas.DataFrame with a SCANNER column.
+    """
+    frames = []
+    for name, scanner in scanners.items():
+        for pattern in scanner.get('files', []):
+            for scan_file in sorted(glob.glob(pattern)):
+                frames.append(pi_compress.read_scan(scan_file)
+                        .assign(SCANNER=name))
+    return pd.concat(frames, ignore_index=True)
+
+def parse_args(args):
+    """Input argument parser.
+
+    Args:
+        args (list): Input arguments as taken from command line execution via
+            sys.argv[1:].
+
+    Returns:
+        parsed_args (dict): Parsed input arguments keyed by argument name.
+    """
+    parser = argparse.ArgumentParser(
+            description="Localize beacons heard by several scanners.")
+    mode_group = parser.add_mutually_exclusive_group(required=True)
+    mode_group.add_argument('--config_yml', help="Localization YAML with "
+            "'scanners' (name: {position: [x, y], files: [patterns]}) and "
+            "localizer settings.")
+    mode_group.add_argument('--benchmark', action='store_true',
+            help="Benchmark on simulated advertisements.")
+    parser.add_argument('--output', help="Position CSV file, printed if not "
+            "given.")
+    parser.add_argument('--window', type=float,
+            help="Time window (s) of each position.")
+    parser.add_argument('--measured_power', type=float,
+            help="RSSI (dBm) at 1 m.")
+    parser.add_argument('--path_loss_exponent', type=float,
+            help="Path loss exponent of the range model.")
+    parser.add_argument('--beacons', type=int, default=2000,
+            help="Number of simulated beacons.")
+    parser.add_argument('--scanners', type=int, default=6,
+            help="Number of simulated scanners.")
+    return vars(parser.parse_args(args))
+
+def main(args):
+    """Beacon localization over recorded scan files of several scanners.
+
+    Args:
+        args (list): Arguments as provided by sys.argv.
+
+    Returns:
+        Beacon positions in a pandas.DataFrame, or benchmark results.
+    """
+    parsed_args = parse_args(args)
+    if parsed_args['benchmark']:
+        results = benchmark(parsed_args['beacons'], parsed_args['scanners'])
+        for key, value in results.items():
+            print(f"{key}: {value:.6g}")
+        return results
+    with open(parsed_args['config_yml'], 'r') as f:
+        config = yaml.load(f, Loader=yaml.SafeLoader)
+    scanners = config.pop('scanners')
+    config.update({key: value for key, value in parsed_args.items()
+        if key in DEFAULT_CONFIG and value is not None})
+    config['positions'] = {name: scanner['position']
+            for name, scanner in scanners.items()}
+    localizer = Localizer(**config)
+    positions = localizer.localize(load_scanners(scanners))
+    if parsed_args['output'] is None:
+        print(positions.to_string(index=False))
+    else:
+        positions.to_csv(parsed_args['output'], index=False)
+    return positions
+
+if __name__ == "__main__":
+    """Script execution."""
+    main(sys.argv[1:])
@@ -12,15 +12,29 @@ import argparse
 # added imports
 import os
 import re
-import threading
 ################
-from bluetooth.ble import BeaconService
 from datetime import datetime
 from itertools import zip_longest
 import logging
 import logging.config
+import logging.handlers
+import multiprocessing
+import multiprocessing.connection
 import pandas as pd
 from pathlib import Path
+import math
+import pi_compress
+import pi_contacts
+import pi_dutycycle
+import pi_exposure
+import pi_filters
+import pi_profile
+import pi_rawlog
+import pi_records
+import pi_sensors
+import queue
+import signal
+import socket
 import sys
 import time
 from uuid import uuid1
@@ -44,10 +58,18 @@ DEFAULT_CONFIG = {
         'curr_file_id': 0,
         'timeout': None,
         'revisit': 1,
-        'filters': {}
+        'filters': {},
+        'sensors': [],
+        'sensor_tolerance': 1.0,
+        'contacts': {},
+        'database': None,
+        'duty_cycle': {},
+        'raw_log': False,
+        'compression': {}
         },
     'logger': {
         'name': LOG_NAME,
+        'queue_size': 10000,
         'config': {
             'version': 1,
             'formatters': {
@@ -84,7 +106,11 @@ DEFAULT_CONFIG = {
 # Universal settings
 BLE_DEVICE = "hci0"
 CONTROL_INTERVAL = 1 # (s)
+STOP_TIMEOUT = 10 # (s) Allowed for a role process to stop once requested
+SCHEDULE_LOG_CHANGE = 0.2 # Relative duty cycle change that is logged
 MAX_TIMEOUT = 600 # (s)
+REPLAY_BATCH = 1000 # Scans processed together during replay
+PROFILE_PREFIX = "pi_pact_profile" # Default profile output file prefix
 ID_FILTERS = ['ADDRESS', 'UUID', 'MAJOR', 'MINOR', 'TX POWER']
 MEASUREMENT_FILTERS = ['TIMESTAMP', 'RSSI']
 
@@ -94,6 +120,16 @@ MINOR_LIMITS = [1, 65535]
 TX_POWER_LIMITS = [-40, 4]
 INTERVAL_LIMITS = [20, 10000] # (ms)
 ALLOWABLE_FILTERS = ID_FILTERS+MEASUREMENT_FILTERS
+LIST_FILTER_SETTINGS = ['allow', 'deny', 'bloom']
+
+def beacon_service():
+    """BLE beacon service of BLE_DEVICE.
+
+    PyBluez is only imported here, so that replaying a raw scan log needs
+    neither PyBluez nor a Bluetooth adapter.
+    """
+    from bluetooth.ble import BeaconService
+    return BeaconService(BLE_DEVICE)
 
 class Advertiser(object):
     """Instantiates a BLE beacon advertiser.
@@ -132,7 +168,7 @@ class Advertiser(object):
                         f"configuration {key}: {value}.")
                 setattr(self, key, value)
         # Create beacon
-        self.__service = BeaconService(BLE_DEVICE)
+        self.__service = beacon_service()
         self.__logger.info("Initialized beacon advertiser.")
 
     def __del__(self):
@@ -308,8 +344,9 @@ class Advertiser(object):
         # Start advertising
         self.__logger.info("Starting beacon advertiser with timeout "
                 f"{timeout}.")
-        self.__service.start_advertising(self.uuid, self.major, self.minor,
-                                         self.tx_power, self.interval)
+        with pi_profile.stage('start_advertising'):
+            self.__service.start_advertising(self.uuid, self.major,
+                    self.minor, self.tx_power, self.interval)
         # Stop advertising based on either timeout or control file
         start_time = time.monotonic()
         self.__control_file_handle = self.__control_file.open(mode='r+')
@@ -340,10 +377,35 @@ class Scanner(object):
         control_file (pathlib.Path): BLE beacon scanner control file path.
         timeout (float, int): BLE beacon scanner timeout (s). Must be strictly
             positive and less than 600.
-        revisit (int): BLE beacon scanner revisit interval (s). Must be
-            strictly positive.
+        revisit (float, int): BLE beacon scanner revisit interval (s), the
+            scan window. Must be strictly positive.
         filters (dict): Filters to apply to received beacons. Available
-            filters/keys are {'address', 'uuid', 'major', 'minor'}.
+            filters/keys are {'address', 'uuid', 'major', 'minor'}. ID
+            filters match a value, a list of values, or allow/deny list
+            files ({'allow', 'deny', 'bloom'}, see pi_filters.IdFilter).
+        sensors (list): Environmental sensors sampled while scanning. Each
+            is a dictionary with 'source' (see pi_sensors.create_source) and
+            optionally 'period' (s) and 'options' (source keyword
+            arguments).
+        sensor_tolerance (float, int): Largest time difference (s) between
+            an advertisement and the sensor reading attached to it. Must be
+            strictly positive.
+        contacts (dict): Contact detection settings, see
+            pi_contacts.ContactDetector. Contact episodes are detected while
+            scanning unless empty.
+        database (str, pathlib.Path): SQLite exposure store (see
+            pi_exposure) to which the scan and contact files are appended
+            after scanning, or None.
+        duty_cycle (dict): Adaptive duty cycle settings, see
+            pi_dutycycle.DutyCycleController. Scan windows and idle gaps
+            between scans adapt to the surroundings unless empty, starting
+            from a window of revisit.
+        raw_log (bool): Whether every scan is also appended unfiltered to a
+            raw scan log (see pi_rawlog) for later replay.
+        compression (dict): Block compression settings of the scan output,
+            keyword arguments of pi_compress.BlockWriter (level, block_size,
+            block_interval). Scan files are block compressed (.csv.gz)
+            unless empty.
     """
 
     def __init__(self, logger, **kwargs):
@@ -364,8 +426,9 @@ class Scanner(object):
                 self.__logger.debug("Using default beacon scanner "
                         f"configuration {key}: {value}.")
                 setattr(self, key, value)
-        # Create beacon
-        self.__service = BeaconService(BLE_DEVICE)
+        # Bluetooth service is created when scanning starts, replay needs none
+        self.__service = None
+        self.__whole_seconds = False
         self.__logger.info("Initialized beacon scanner.")
 
     def __del__(self):
@@ -449,13 +512,14 @@ class Scanner(object):
         """BLE beacon scanner revisit interval setter.
 
         Raises:
-            TypeError: Beacon scanner revisit interval must be an integer.
+            TypeError: Beacon scanner revisit interval must be a float or
+                integer.
             ValueError: Beacon scanner revisit interval must be strictly
                 positive.
          """
-        if not isinstance(value, int):
-            raise TypeError("Beacon scanner revisit interval must be an "
-                    "integer.")
+        if not isinstance(value, (float, int)):
+            raise TypeError("Beacon scanner revisit interval must be a float "
+                    "or integer.")
         elif value <= 0:
             raise ValueError("Beacon scanner revisit interval must strictly "
                     "positive.")
@@ -470,16 +534,267 @@ class Scanner(object):
     def filters(self, value):
         """BLE beacon scanner filters setter.
 
+        ID filters given as a dictionary of allow/deny list files are loaded
+        into list filters.
+
         Raises:
             TypeError: Beacon scanner filters must be a dictionary.
             KeyError: Beacon scanner filters must be one of allowable filters.
+            KeyError: Beacon scanner list filters must be specified by list
+                filter settings.
         """
         if not isinstance(value, dict):
             raise TypeError("Beacon scanner filters must be a dictionary.")
         elif not all([key in ALLOWABLE_FILTERS for key in value.keys()]):
             raise KeyError("Beacon scanner filters must be one of allowable "
                     f"filters {ALLOWABLE_FILTERS}.")
+        list_filters = {}
+        for key, spec in value.items():
+            if key in ID_FILTERS and isinstance(spec, dict):
+                if not all([setting in LIST_FILTER_SETTINGS
+                        for setting in spec]):
+                    raise KeyError("Beacon scanner list filters must be "
+                            f"specified by {LIST_FILTER_SETTINGS}.")
+                list_filters[key] = pi_filters.IdFilter(key,
+                        logger=self.__logger, **spec)
         self.__filters = value
+        self.__list_filters = list_filters
+
+    @property
+    def sensors(self):
+        """BLE beacon scanner environmental sensors getter."""
+        return self.__sensors
+
+    @sensors.setter
+    def sensors(self, value):
+        """BLE beacon scanner environmental sensors setter.
+
+        Raises:
+            TypeError: Beacon scanner sensors must be a list of dictionaries.
+            KeyError: Beacon scanner sensors must each specify a source.
+        """
+        if not isinstance(value, list) or not all(
+                [isinstance(sensor, dict) for sensor in value]):
+            raise TypeError("Beacon scanner sensors must be a list of "
+                    "dictionaries.")
+        elif not all(['source' in sensor for sensor in value]):
+            raise KeyError("Beacon scanner sensors must each specify a "
+                    "source.")
+        self.__sensors = value
+
+    @property
+    def sensor_tolerance(self):
+        """BLE beacon scanner sensor tolerance getter."""
+        return self.__sensor_tolerance
+
+    @sensor_tolerance.setter
+    def sensor_tolerance(self, value):
+        """BLE beacon scanner sensor tolerance setter.
+
+        Raises:
+            TypeError: Beacon scanner sensor tolerance must be a float or
+                integer.
+            ValueError: Beacon scanner sensor tolerance must be strictly
+                positive.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Beacon scanner sensor tolerance must be a float "
+                    "or integer.")
+        elif value <= 0:
+            raise ValueError("Beacon scanner sensor tolerance must be "
+                    "strictly positive.")
+        self.__sensor_tolerance = value
+
+    @property
+    def contacts(self):
+        """BLE beacon scanner contact detection settings getter."""
+        return self.__contacts
+
+    @contacts.setter
+    def contacts(self, value):
+        """BLE beacon scanner contact detection settings setter.
+
+        Raises:
+            TypeError: Beacon scanner contacts must be a dictionary.
+        """
+        if not isinstance(value, dict):
+            raise TypeError("Beacon scanner contacts must be a dictionary.")
+        self.__contacts = value
+
+    @property
+    def database(self):
+        """BLE beacon scanner exposure store getter."""
+        return self.__database
+
+    @database.setter
+    def database(self, value):
+        """BLE beacon scanner exposure store setter.
+
+        Raises:
+            TypeError: Beacon scanner database must be a string, Path, or
+                NoneType.
+        """
+        if value is not None:
+            if not isinstance(value, (str, Path)):
+                raise TypeError("Beacon scanner database must be a string, "
+                        "Path, or NoneType.")
+            value = Path(value)
+        self.__database = value
+
+    @property
+    def duty_cycle(self):
+        """BLE beacon scanner duty cycle settings getter."""
+        return self.__duty_cycle
+
+    @duty_cycle.setter
+    def duty_cycle(self, value):
+        """BLE beacon scanner duty cycle settings setter.
+
+        Raises:
+            TypeError: Beacon scanner duty cycle must be a dictionary.
+        """
+        if not isinstance(value, dict):
+            raise TypeError("Beacon scanner duty cycle must be a dictionary.")
+        self.__duty_cycle = value
+
+    @property
+    def raw_log(self):
+        """BLE beacon scanner raw scan log setting getter."""
+        return self.__raw_log
+
+    @raw_log.setter
+    def raw_log(self, value):
+        """BLE beacon scanner raw scan log setting setter.
+
+        Raises:
+            TypeError: Beacon scanner raw log must be a boolean.
+        """
+        if not isinstance(value, bool):
+            raise TypeError("Beacon scanner raw log must be a boolean.")
+        self.__raw_log = value
+
+    @property
+    def compression(self):
+        """BLE beacon scanner scan output compression getter."""
+        return self.__compression
+
+    @compression.setter
+    def compression(self, value):
+        """BLE beacon scanner scan output compression setter.
+
+        Raises:
+            TypeError: Beacon scanner compression must be a dictionary.
+        """
+        if not isinstance(value, dict):
+            raise TypeError("Beacon scanner compression must be a "
+                    "dictionary.")
+        self.__compression = value
+
+    def used_window(self, window):
+        """Scan window (s) actually scanned for a requested window.
+
+        Bluetooth services that only accept whole seconds, e.g., pybluez,
+        get the window rounded up, so sub-second windows are unattainable
+        with them.
+
+        Args:
+            window (float): Requested scan window (s).
+        """
+        if self.__whole_seconds:
+            return max(1, math.ceil(window))
+        return window
+
+    def scan_window(self, window):
+        """Scan for beacons during one window.
+
+        Args:
+            window (float): Scan window (s), see used_window.
+
+        Returns:
+            Dictionary of received advertisements keyed by beacon address.
+        """
+        if not self.__whole_seconds:
+            try:
+                return self.__service.scan(window)
+            except TypeError:
+                self.__logger.warning("Bluetooth service only scans whole "
+                        "seconds, rounding scan windows up.")
+                self.__whole_seconds = True
+        return self.__service.scan(self.used_window(window))
+
+    def stop_requested(self):
+        """Whether the control file requests the scanner to stop."""
+        self.__control_file_handle.seek(0)
+        if self.__control_file_handle.read() != "0":
+            self.__logger.debug("Beacon scanner control flag set to stop.")
+            return True
+        return False
+
+    def log_schedule(self, window, idle, logged):
+        """Log the duty cycle schedule when it changed noticeably.
+
+        Args:
+            window (float): Scan window (s) as actually scanned.
+            idle (float): Idle gap (s).
+            logged (tuple): Last logged window and idle gap, or None.
+
+        Returns:
+            Last logged window and idle gap.
+        """
+        self.__logger.debug(f"Duty cycle scan window {window:.2f} s, idle "
+                f"{idle:.2f} s.")
+        if logged is not None and all(
+                abs(new-old) <= SCHEDULE_LOG_CHANGE*max(old, new)
+                for new, old in zip((window, idle), logged)):
+            return logged
+        self.__logger.info(f"Duty cycle set to scan window {window:.2f} s "
+                f"and idle gap {idle:.2f} s.")
+        return window, idle
+
+    def start_sensors(self):
+        """Create and start a background sampler for each sensor.
+
+        Returns:
+            List of started pi_sensors.SensorSampler.
+        """
+        samplers = []
+        for sensor in self.sensors:
+            source = pi_sensors.create_source(sensor['source'],
+                    sensor.get('options'))
+            sampler = pi_sensors.SensorSampler(self.__logger, source,
+                    sensor.get('period', 1.0))
+            sampler.start()
+            samplers.append(sampler)
+        return samplers
+
+    def attach_sensors(self, advertisements, samplers):
+        """Attach nearest-in-time sensor readings to advertisements.
+
+        Args:
+            advertisements (pandas.DataFrame): Parsed advertisements.
+            samplers (list): Running pi_sensors.SensorSampler.
+
+        Returns:
+            Advertisements with one column per sensor value, NaN where no
+            reading is within sensor tolerance.
+        """
+        for sampler in samplers:
+            advertisements = advertisements.assign(**sampler.nearest(
+                advertisements['TIMESTAMP'], self.sensor_tolerance))
+        return advertisements
+
+    def write_episodes(self, episodes, detector, contact_file):
+        """Append contact episodes to the contact output file.
+
+        Args:
+            episodes (list): Contact episode dictionaries.
+            detector (pi_contacts.ContactDetector): Contact detector.
+            contact_file (pathlib.Path): Contact output file.
+        """
+        if episodes:
+            pd.DataFrame(episodes,
+                    columns=detector.empty_episodes().columns).to_csv(
+                            contact_file, mode='a', header=False, index=False)
 
     def filter_advertisements(self, advertisements):
         """Filter received beacon advertisements based on filters.
@@ -492,9 +807,14 @@ class Scanner(object):
             filters removed.
         """
         for key, value in self.filters.items():
+            # Filter based on allow/deny lists of fixed identifiers
+            if key in self.__list_filters:
+                advertisements = advertisements[
+                        self.__list_filters[key].keep(advertisements[key])]
             # Filter based on fixed identifiers
-            if key in ID_FILTERS:
-                advertisements = advertisements[advertisements[key].isin([value])]
+            elif key in ID_FILTERS:
+                values = value if isinstance(value, list) else [value]
+                advertisements = advertisements[advertisements[key].isin(values)]
             # Filter based on measurements
             else:
                 query_str = f"{value[0]} <= {key} and {key} <= {value[1]}"
@@ -534,6 +854,131 @@ class Scanner(object):
         return  pd.DataFrame(advertisements,columns=['ADDRESS', 'TIMESTAMP',
             'UUID', 'MAJOR', 'MINOR', 'TX POWER', 'RSSI'])
 
+    def open_outputs(self, samplers, prefix='scan'):
+        """Create the output files of one scanning session.
+
+        Output files are numbered after the scan files already in
+        pact_scans. With compression configured the advertisement output
+        is block compressed, the contacts file stays plain CSV.
+
+        Args:
+            samplers (list): Running pi_sensors.SensorSampler whose values
+                are attached to advertisements.
+            prefix (str): Advertisement output file name prefix.
+
+        Returns:
+            Dictionary of session state passed to output_scans and
+            close_outputs.
+        """
+        latestNum = self.curr_file_id
+        for file in os.listdir("pact_scans"):
+            if file.endswith((".csv", ".csv"+pi_compress.SUFFIX)):
+                currNum = int(re.findall('\d+',str(os.path.join("", file)))[0])
+                if(currNum >= latestNum):
+                    latestNum = currNum + 1;
+
+        session = {'number': latestNum, 'samplers': samplers, 'row_count': 0,
+                'scan_file': Path(f"pact_scans/{prefix}_{latestNum}.csv")}
+
+        # scan_file = Path(f"{scan_prefix}_{datetime.now():%Y%m%dT%H%M%S}.csv")
+        # Write header so output can be followed while scanning
+        header = self.attach_sensors(self.process_scans([], []), samplers)
+        if self.compression:
+            session['scan_file'] = session['scan_file'].with_name(
+                    session['scan_file'].name+pi_compress.SUFFIX)
+            session['writer'] = pi_compress.BlockWriter(session['scan_file'],
+                    **self.compression)
+            session['writer'].write(header.to_csv(index_label='SCAN'))
+            session['writer'].flush()
+        else:
+            header.to_csv(session['scan_file'], index_label='SCAN')
+        # Keep advertisements compactly until returned
+        session['advertisements'] = pi_records.AdvertisementRecords(
+                [column for column in header if column not in
+                    pi_records.COLUMNS])
+        # Detect contact episodes as advertisements arrive
+        if self.contacts:
+            session['detector'] = pi_contacts.ContactDetector(**self.contacts)
+            session['contact_file'] = Path(
+                    f"pact_scans/contacts_{latestNum}.csv")
+            session['detector'].empty_episodes().to_csv(
+                    session['contact_file'], index=False)
+            session['contact_count'] = 0
+        return session
+
+    def output_scans(self, session, scans, timestamps):
+        """Process, filter, and append received scans to the outputs.
+
+        Args:
+            session (dict): Session state as returned by open_outputs.
+            scans (list): Received beacon advertisement scans in temporal
+                order.
+            timestamps (list): Timestamps associated with each scan.
+
+        Returns:
+            Filtered advertisements of the scans in a pandas.DataFrame.
+        """
+        with pi_profile.stage('process_scans'):
+            advertisements = self.process_scans(scans, timestamps)
+        with pi_profile.stage('filter_advertisements'):
+            advertisements = self.filter_advertisements(advertisements)
+        with pi_profile.stage('attach_sensors'):
+            advertisements = self.attach_sensors(advertisements,
+                    session['samplers'])
+        advertisements.index += session['row_count']
+        with pi_profile.stage('to_csv'):
+            if self.compression:
+                session['writer'].write(advertisements.to_csv(header=False))
+            else:
+                advertisements.to_csv(session['scan_file'], mode='a',
+                        header=False)
+        session['row_count'] += len(advertisements)
+        with pi_profile.stage('records'):
+            session['advertisements'].extend(advertisements)
+        if self.contacts:
+            with pi_profile.stage('contacts'):
+                detector = session['detector']
+                episodes = detector.process(advertisements)
+                episodes += detector.expire(timestamps[-1])
+                self.write_episodes(episodes, detector,
+                        session['contact_file'])
+            session['contact_count'] += len(episodes)
+        return advertisements
+
+    def close_outputs(self, session, ingest=True):
+        """Complete the outputs of one scanning session.
+
+        Args:
+            session (dict): Session state as returned by open_outputs.
+            ingest (bool): Whether the outputs are appended to the exposure
+                store, if configured.
+
+        Returns:
+            All filtered advertisements of the session in a pandas.DataFrame.
+        """
+        if self.compression:
+            writer = session['writer']
+            writer.close()
+            self.__logger.info(f"Compressed {writer.bytes_in} bytes of scan "
+                    f"output to {writer.bytes_out} bytes.")
+        if self.contacts:
+            detector = session['detector']
+            episodes = detector.flush()
+            self.write_episodes(episodes, detector, session['contact_file'])
+            session['contact_count'] += len(episodes)
+            self.__logger.info(f"Detected {session['contact_count']} contact "
+                    "episodes.")
+        if ingest and self.database is not None:
+            with pi_exposure.ExposureStore(self.database,
+                    self.__logger) as store:
+                rows = store.ingest_file(session['scan_file'],
+                        socket.gethostname())
+                if self.contacts:
+                    rows += store.ingest_file(session['contact_file'],
+                            socket.gethostname())
+            self.__logger.info(f"Appended {rows} rows to {self.database}.")
+        return session['advertisements'].to_frame()
+
     def nameScanLogs(self):
         latestNum = self.curr_file_id
         for file in os.listdir("~/reference_code"):
@@ -544,6 +989,12 @@ class Scanner(object):
     def scan(self, scan_prefix='', timeout=0, revisit=1, curr_file_id=0):
         """Execute BLE beacon scan.
 
+        Advertisements received in each scan are filtered, joined with the
+        nearest-in-time reading of each configured sensor, and appended to
+        the scan output file immediately so the output can be followed while
+        the scanner is running. With contact detection configured, contact
+        episodes are appended to a contacts file as they end.
+
         Args:
             scan_prefix (str): Scan output file prefix. Final output file name
                 will be appended with first scan start timestamp. Defaults to
@@ -557,72 +1008,387 @@ class Scanner(object):
         Returns:
             Filtered advertisements organized in a pandas.DataFrame by address
             first, timestamp second, and then remainder of advertisement
-            payload, e.g., UUID, major, minor, etc.
+            payload, e.g., UUID, major, minor, etc. Addresses are normalized
+            to upper case, as held by pi_records.AdvertisementRecords.
         """
         # Parse inputs
         if scan_prefix == '':
             scan_prefix = self.scan_prefix
         if timeout == 0:
             timeout = self.timeout
+        if self.__service is None:
+            self.__service = beacon_service()
         # Update control file and scan output file
         with open(self.__control_file, 'w') as f:
             f.write("0")
-
-        latestNum = self.curr_file_id
-        for file in os.listdir("pact_scans"):
-            if file.endswith(".csv"):
-                currNum = int(re.findall('\d+',str(os.path.join("", file)))[0])
-                if(currNum >= latestNum):
-                    latestNum = currNum + 1;
-
-        scan_file = Path(f"pact_scans/scan_{latestNum}.csv")
-
-        # scan_file = Path(f"{scan_prefix}_{datetime.now():%Y%m%dT%H%M%S}.csv")
+        # Sample environmental sensors alongside the scans
+        samplers = self.start_sensors()
+        session = self.open_outputs(samplers)
+        # Keep every scan unfiltered for later replay
+        if self.raw_log:
+            raw_log = pi_rawlog.RawScanWriter(
+                    f"pact_scans/raw_{session['number']}.bin", self.__logger)
         # Start advertising
         self.__logger.info(f"Starting beacon scanner with timeout {timeout}.")
         self.__control_file_handle = self.__control_file.open(mode='r+')
         run = True
-        timestamps = []
-        scans = []
         scan_count = 0
+        # Adapt scan windows and idle gaps to the surroundings
+        window, idle = self.revisit, 0
+        scan_start, logged = None, None
+        if self.duty_cycle:
+            controller = pi_dutycycle.DutyCycleController(**self.duty_cycle)
         start_time = time.monotonic()
         while run:
             scan_count += 1
-            self.__logger.debug(f"Performing scan #{scan_count} at revisit "
-                    f"{self.revisit}.")
-            timestamps.append(datetime.now())
-            scans.append(self.__service.scan(self.revisit))
+            self.__logger.debug(f"Performing scan #{scan_count} with window "
+                    f"{self.used_window(window)}.")
+            timestamp = datetime.now()
+            previous_start, scan_start = scan_start, time.monotonic()
+            with pi_profile.stage('BeaconService.scan'):
+                scan = self.scan_window(window)
+            if self.raw_log:
+                with pi_profile.stage('raw_log'):
+                    raw_log.write(scan, timestamp)
+            # Process, filter, and append received scan to output
+            scan_advertisements = self.output_scans(session, [scan],
+                    [timestamp])
+            if self.duty_cycle:
+                elapsed = scan_start-previous_start \
+                        if previous_start is not None else 0
+                with pi_profile.stage('duty_cycle'):
+                    # Retention was measured on the window actually scanned
+                    window, idle = controller.update(scan_advertisements,
+                            self.used_window(window), elapsed)
+                logged = self.log_schedule(self.used_window(window), idle,
+                        logged)
             # Stop advertising based on either timeout or control file
             if timeout is not None:
                 if (time.monotonic()-start_time) > timeout:
                     self.__logger.debug("Beacon scanner timed out.")
                     run = False
-            self.__control_file_handle.seek(0)
-            control_flag = self.__control_file_handle.read()
-            if control_flag != "0":
-                self.__logger.debug("Beacon scanner control flag set to stop.")
+            if self.stop_requested():
                 run = False
+            if run and idle > 0:
+                with pi_profile.stage('idle'):
+                    idle_end = time.monotonic()+idle
+                    if timeout is not None:
+                        idle_end = min(idle_end, start_time+timeout)
+                    # Sleep in slices so a stop request ends the idle gap
+                    while time.monotonic() < idle_end:
+                        time.sleep(min(CONTROL_INTERVAL,
+                            max(0, idle_end-time.monotonic())))
+                        if self.stop_requested():
+                            run = False
+                            break
         self.__logger.info("Stopping beacon scanner.")
         # Cleanup
+        for sampler in samplers:
+            sampler.stop()
+        if self.raw_log:
+            raw_log.close()
         self.__control_file_handle.close()
         with self.__control_file.open('w') as f:
             f.write("0")
-        # Process, filter, and output received scans
-        advertisements = self.process_scans(scans, timestamps)
-        advertisements = self.filter_advertisements(advertisements)
-        advertisements.to_csv(scan_file, index_label='SCAN')
+        with pi_profile.stage('close_outputs'):
+            return self.close_outputs(session)
+
+    def replay(self, raw_file):
+        """Replay a raw scan log through scan processing.
+
+        Logged scans are processed, filtered, and written as fast as
+        possible, in batches, to replay and (with contact detection
+        configured) contacts files, as if they were received while scanning
+        with the current configuration. Sensor readings are not part of the
+        raw log and replayed outputs are not appended to the exposure store.
+
+        Args:
+            raw_file (str, pathlib.Path): Raw scan log, see pi_rawlog.
+
+        Returns:
+            Filtered advertisements organized in a pandas.DataFrame by address
+            first, timestamp second, and then remainder of advertisement
+            payload, e.g., UUID, major, minor, etc. Addresses are normalized
+            to upper case, as held by pi_records.AdvertisementRecords.
+        """
+        reader = pi_rawlog.RawScanReader(raw_file)
+        session = self.open_outputs([], prefix='replay')
+        self.__logger.info(f"Replaying {raw_file} to "
+                f"{session['scan_file']}.")
+        scan_count, received = 0, 0
+        scans, timestamps = [], []
+        start_time = time.perf_counter()
+        for scan, timestamp in pi_profile.iterate('read_raw_log',
+                reader.scans()):
+            scans.append(scan)
+            timestamps.append(timestamp)
+            received += len(scan)
+            if len(scans) == REPLAY_BATCH:
+                self.output_scans(session, scans, timestamps)
+                scan_count += len(scans)
+                scans, timestamps = [], []
+        if scans:
+            self.output_scans(session, scans, timestamps)
+            scan_count += len(scans)
+        with pi_profile.stage('close_outputs'):
+            advertisements = self.close_outputs(session, ingest=False)
+        elapsed = max(time.perf_counter()-start_time, 1e-9)
+        self.__logger.info(f"Replayed {scan_count} scans ({received} "
+                f"advertisements) in {elapsed:.3f} s: "
+                f"{scan_count/elapsed:.0f} scans/s, "
+                f"{received/elapsed:.0f} advertisements/s.")
         return advertisements
 
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Instantiates a non-blocking handler enqueueing to a bounded queue.
+
+    Records are enqueued as they are, formatting is left to the handlers of
+    the listener. Records that do not fit are dropped and counted, and a
+    warning with the number of dropped records is enqueued once the queue
+    has room again.
+
+    Attributes:
+        dropped (int): Number of records dropped because the queue was full.
+    """
+
+    def __init__(self, queue_, name):
+        """Instance initialization.
+
+        Args:
+            queue_ (queue.Queue): Bounded log record queue.
+            name (str): Logger name of drop warnings.
+        """
+        super().__init__(queue_)
+        self.__name = name
+        self.__unreported = 0
+        self.dropped = 0
+
+    def warning_record(self, message):
+        """Warning record with the given message."""
+        return logging.LogRecord(self.__name, logging.WARNING, __file__, 0,
+                message, None, None)
+
+    def prepare(self, record):
+        """Record as is, the queue never leaves this process."""
+        return record
+
+    def enqueue(self, record):
+        """Enqueue a record without blocking, dropping it if full."""
+        try:
+            if self.__unreported:
+                self.queue.put_nowait(self.warning_record(
+                    f"Dropped {self.__unreported} log records because the "
+                    "log queue was full."))
+                self.__unreported = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self.__unreported += 1
+
+class LogQueueListener(logging.handlers.QueueListener):
+    """Instantiates a log queue listener that waits for room to stop."""
+
+    def enqueue_sentinel(self):
+        """Enqueue the stop sentinel, waiting while the queue is full."""
+        self.queue.put(self._sentinel)
+
 def setup_logger(config):
-    """Setup and return logger based on configuration."""
+    """Setup and return logger based on configuration.
+
+    With a queue_size, the configured handlers are moved to a background
+    listener thread, and the logger only enqueues records to a queue
+    holding up to queue_size records. Otherwise records are handled
+    synchronously by the logging thread.
+    """
     logging.config.dictConfig(config['config'])
-    return logging.getLogger(config['name'])
+    logger = logging.getLogger(config['name'])
+    if config.get('queue_size'):
+        handler = LogQueueHandler(queue.Queue(config['queue_size']),
+                config['name'])
+        handler.listener = LogQueueListener(handler.queue, *logger.handlers,
+                respect_handler_level=True)
+        logger.handlers = [handler]
+        handler.listener.start()
+    return logger
 
 def close_logger(logger):
-    """Close logger."""
+    """Close logger.
+
+    Queued records are handled before the handlers of a queue listener are
+    closed.
+    """
     for handler in logger.handlers[:]:
-        handler.close()
         logger.removeHandler(handler)
+        listener = getattr(handler, 'listener', None)
+        if listener is not None:
+            listener.stop()
+            if handler.dropped:
+                listener.handle(handler.warning_record(
+                    f"Dropped {handler.dropped} log records in total because "
+                    "the log queue was full."))
+            for listener_handler in listener.handlers:
+                listener_handler.close()
+        handler.close()
+
+def run_role(role, config, log_queue, connection, profile=None):
+    """Run the advertiser or scanner role in its own process.
+
+    Log records are forwarded to the supervising process through log_queue,
+    and the role output is sent back through connection. Keyboard
+    interrupts are ignored, the supervisor stops the role through its
+    control file instead so that the scan output is still returned.
+
+    Args:
+        role (str): One of 'advertiser' or 'scanner'.
+        config (dict): Full configuration.
+        log_queue (multiprocessing.Queue): Log record queue.
+        connection (multiprocessing.connection.Connection): Sending end of
+            the pipe to the supervisor.
+        profile (tuple): Profile output prefix and whether to run cProfile,
+            or None to not profile. The role is appended to the prefix.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logger = logging.getLogger(config['logger']['name'])
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    if profile is not None:
+        pi_profile.start('pi_pact', profile[1])
+    try:
+        if role == 'advertiser':
+            Advertiser(logger, **config['advertiser']).advertise()
+            output = None
+        else:
+            output = Scanner(logger, **config['scanner']).scan()
+        connection.send(output)
+    except Exception:
+        logger.exception(f"Fatal exception encountered in beacon {role}.")
+        sys.exit(1)
+    finally:
+        connection.close()
+        if profile is not None:
+            for profile_file in pi_profile.stop(f"{profile[0]}_{role}"):
+                logger.info(f"Wrote beacon {role} profile {profile_file}.")
+
+def stop_roles(config, processes):
+    """Request every running role to stop through its control file.
+
+    A role resets its control file when it starts, so the request is sent
+    again every CONTROL_INTERVAL until the role has stopped.
+
+    Args:
+        config (dict): Full configuration.
+        processes (dict): Role processes keyed by role.
+    """
+    for role, process in processes.items():
+        if process.is_alive():
+            with open(config[role]['control_file'], 'w') as f:
+                f.write("1")
+
+def join_roles(logger, config, processes):
+    """Wait for role processes to stop, terminating those that do not.
+
+    Roles still running are asked to stop until STOP_TIMEOUT has passed.
+
+    Args:
+        logger (logging.Logger): Configured logger.
+        config (dict): Full configuration.
+        processes (dict): Role processes keyed by role.
+    """
+    deadline = time.monotonic()+STOP_TIMEOUT
+    try:
+        while any(process.is_alive() for process in processes.values()) \
+                and time.monotonic() < deadline:
+            stop_roles(config, processes)
+            multiprocessing.connection.wait(
+                    [process.sentinel for process in processes.values()
+                        if process.is_alive()], CONTROL_INTERVAL)
+    except KeyboardInterrupt:
+        # A second interrupt gives up waiting, roles are not left orphaned
+        logger.warning("Interrupted while stopping, terminating roles.")
+    for role, process in processes.items():
+        if process.is_alive():
+            logger.warning(f"Beacon {role} did not stop, terminating.")
+            process.terminate()
+        process.join()
+
+def supervise(logger, config, profile=None):
+    """Advertise and scan simultaneously in separate processes.
+
+    Each role runs in its own process with its own BeaconService, so that
+    neither role's timing is disturbed by the other. Log records of both
+    roles are written by this process's logger handlers. The control files
+    are created before the roles start and removed once they have stopped.
+    When a role fails, or on a keyboard interrupt, even while the roles are
+    still starting, the remaining roles are stopped through their control
+    files, and terminated if they do not stop in time.
+
+    Args:
+        logger (logging.Logger): Configured logger.
+        config (dict): Full configuration.
+        profile (tuple): Profile output prefix and whether to run cProfile
+            in each role's process, or None to not profile.
+
+    Returns:
+        Scanned advertisements in a pandas.DataFrame, or None if the scanner
+        failed.
+    """
+    context = multiprocessing.get_context('spawn')
+    log_queue = context.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *logger.handlers,
+            respect_handler_level=True)
+    listener.start()
+    processes, receivers, outputs = {}, {}, {}
+    control_files = [Path(config[role]['control_file'])
+            for role in ['advertiser', 'scanner']]
+    for control_file in control_files:
+        with control_file.open('w') as f:
+            f.write("0")
+    stopping = False
+    try:
+        for role in ['advertiser', 'scanner']:
+            receiver, sender = context.Pipe(duplex=False)
+            processes[role] = context.Process(target=run_role, name=role,
+                    args=(role, config, log_queue, sender, profile))
+            processes[role].start()
+            sender.close()
+            receivers[receiver] = role
+        while receivers:
+            try:
+                if stopping:
+                    stop_roles(config, processes)
+                # Outputs are received as they come so that a large scan
+                # output never blocks its sender on a full pipe
+                ready = multiprocessing.connection.wait(list(receivers),
+                        CONTROL_INTERVAL)
+                for receiver in ready:
+                    role = receivers.pop(receiver)
+                    try:
+                        outputs[role] = receiver.recv()
+                    except EOFError:
+                        logger.error(f"Beacon {role} exited without output.")
+                    receiver.close()
+                failed = [role for role, process in processes.items()
+                        if process.exitcode not in (None, 0)]
+                if failed and not stopping:
+                    logger.error(f"Beacon {', '.join(failed)} failed, "
+                            "stopping remaining roles.")
+                    stopping = True
+            except KeyboardInterrupt:
+                logger.info("Stopping beacon advertiser and scanner.")
+                stopping = True
+    except KeyboardInterrupt:
+        # Interrupted while the roles were being started
+        logger.info("Stopping beacon advertiser and scanner.")
+    finally:
+        join_roles(logger, config, processes)
+        listener.stop()
+        for control_file in control_files:
+            try:
+                control_file.unlink()
+            except FileNotFoundError:
+                pass
+    return outputs.get('scanner')
 
 def load_config(parsed_args):
     """Load configuration.
@@ -668,6 +1434,15 @@ def load_config(parsed_args):
             del config['scanner']['filters'][filter_to_remove]
     return config
 
+def seconds(value):
+    """Time (s) argument, an integer when whole.
+
+    Whole values stay integers so that scan windows are accepted as is by
+    Bluetooth services that only scan whole seconds.
+    """
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
 def parse_args(args):
     """Input argument parser.
 
@@ -689,6 +1464,8 @@ def parse_args(args):
                             help="Beacon scanner mode.")
     mode_group.add_argument('-b', '--both', action='store_true',
                             help="Beacon simultaneous scanner and advertiser mode.")
+    mode_group.add_argument('-r', '--replay', metavar='RAW_FILE',
+                            help="Replay a raw scan log through the scanner.")
     parser.add_argument('--config_yml', help="Configuration YAML.")
     parser.add_argument('--control_file', help="Control file.")
     parser.add_argument('--scan_prefix', help="Scan output file prefix.")
@@ -703,8 +1480,14 @@ def parse_args(args):
             help="Beacon advertiser TX power.")
     parser.add_argument('--interval', type=int,
             help="Beacon advertiser interval (ms).")
-    parser.add_argument('--revisit', type=int,
+    parser.add_argument('--revisit', type=seconds,
             help="Beacon scanner revisit interval (s)")
+    parser.add_argument('--profile', nargs='?', const=PROFILE_PREFIX,
+            metavar='PREFIX', help="Profile pipeline stages, writing the "
+            f"report and collapsed stacks to PREFIX (default {PROFILE_PREFIX})"
+            ".txt and .collapsed.")
+    parser.add_argument('--cprofile', action='store_true',
+            help="Also profile every function with cProfile to PREFIX.prof.")
     return vars(parser.parse_args(args))
 
 def main(args):
@@ -714,8 +1497,9 @@ def main(args):
         args (list): Arguments as provided by sys.argv.
 
     Returns:
-        If advertising then no output (None) is returned. If scanning
-        then scanned advertisements are returned in pandas.DataFrame.
+        If advertising then no output (None) is returned. If scanning or
+        replaying then scanned advertisements are returned in
+        pandas.DataFrame.
     """
     # Initial setup
     
@@ -724,6 +1508,11 @@ def main(args):
     logger = setup_logger(config['logger'])
     logger.debug(f"Beacon configuration - {config['advertiser']}")
     logger.debug(f"Scanner configuration - {config['scanner']}")
+    if parsed_args['profile'] is not None:
+        pi_profile.start('pi_pact', parsed_args['cprofile'])
+        profile = (parsed_args['profile'], parsed_args['cprofile'])
+    else:
+        profile = None
 
 
     # Create and start beacon advertiser or scanner
@@ -739,25 +1528,19 @@ def main(args):
             advertisements = scanner.scan()
             output = advertisements
         elif parsed_args['both']:
-            logger.info("Beacon simultaneous advertiser and scanner mode selected.")
-            
-            advertiser = Advertiser(logger, **config['advertiser'])
+            logger.info("Beacon simultaneous advertiser and scanner mode "
+                    "selected.")
+            output = supervise(logger, config, profile)
+        elif parsed_args['replay']:
+            logger.info("Raw scan log replay mode selected.")
             scanner = Scanner(logger, **config['scanner'])
-
-            advertiser_run = threading.Thread(target=advertiser.advertise)
-            scanner_run = threading.Thread(target=scanner.scan)
-
-            advertiser_run.start()
-            advertisements = scanner_run.start()
-
-            advertiser_run.join()
-            scanner_run.join()
-
-            output = advertisements
-            
+            output = scanner.replay(parsed_args['replay'])
     except Exception:
         logger.exception("Fatal exception encountered")
     finally:
+        if profile is not None:
+            for profile_file in pi_profile.stop(profile[0]):
+                logger.info(f"Wrote profile {profile_file}.")
         close_logger(logger)
     return output
 
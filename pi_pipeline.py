@@ -0,0 +1,543 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Declarative, cached experiment analysis pipeline.
+
+Analyses (e.g., RSSI vs. wind, pressure, humidity, temperature) are
+described in an external YAML as datasets built from source files, outlier
+rules, and fits. Every source file is read at most once into a cache shared
+by all analyses, independent analyses run in parallel, and each stage result
+is stored on disk keyed by a fingerprint of its inputs, including the
+source code of the modules computing it, so that only stages whose inputs
+or code changed are recomputed. Superseded results of a stage are removed
+from the cache.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
+import inspect
+import json
+import numpy as np
+import os
+import pandas as pd
+from pathlib import Path
+import pickle
+import pi_compress
+import pi_dataset
+import pi_regression
+import pi_resampling
+import pi_stats
+import pi_store
+import pi_timeseries
+from scipy import stats
+import sys
+import threading
+
+# Cached stage format, change whenever a stage result changes form
+CACHE_VERSION = 1
+# Modules computing each stage, besides this one, whose source is part of
+# the stage fingerprint
+STAGE_MODULES = {
+    'raw': [pi_compress, pi_dataset, pi_store, pi_timeseries],
+    'clean': [pi_dataset],
+    'fits': [pi_stats],
+    'regressions': [pi_regression, pi_resampling]
+    }
+
+@functools.lru_cache(maxsize=None)
+def code_fingerprint(stage):
+    """Hash of the source code computing a stage."""
+    digest = hashlib.sha1()
+    for module in [sys.modules[__name__]]+STAGE_MODULES[stage]:
+        with open(inspect.getsourcefile(module), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+# Default configuration
+DEFAULT_CONFIG = {
+    'cache_dir': ".pipeline_cache",
+    'workers': 4,
+    'analyses': {}
+    }
+
+class SourceCache(object):
+    """Thread-safe cache of loaded source files.
+
+    Each file is read and each dataset store catalog opened at most once no
+    matter how many analyses or columns reference it.
+    """
+
+    def __init__(self):
+        """Instance initialization."""
+        self.__frames = {}
+        self.__stores = {}
+        self.__locks = {}
+        self.__lock = threading.Lock()
+
+    def read(self, file_path):
+        """Load a source file, reading it only on first request.
+
+        Args:
+            file_path (str): Source CSV file path.
+
+        Returns:
+            pandas.DataFrame of file contents.
+        """
+        with self.__lock:
+            lock = self.__locks.setdefault(file_path, threading.Lock())
+        with lock:
+            if file_path not in self.__frames:
+                self.__frames[file_path] = pi_compress.read_scan(file_path)
+            return self.__frames[file_path]
+
+    def store(self, store_dir):
+        """Open a dataset store, reading its catalog only on first request.
+
+        Args:
+            store_dir (str): Dataset store root directory.
+
+        Returns:
+            pi_store.DatasetStore.
+        """
+        with self.__lock:
+            if store_dir not in self.__stores:
+                self.__stores[store_dir] = pi_store.DatasetStore(store_dir)
+            return self.__stores[store_dir]
+
+class Pipeline(object):
+    """Instantiates an experiment analysis pipeline.
+
+    Attributes:
+        cache_dir (pathlib.Path): Directory holding cached stage results.
+        workers (int): Number of analyses run in parallel. Must be strictly
+            positive.
+        analyses (dict): Analysis specifications keyed by analysis name.
+    """
+
+    def __init__(self, logger, **kwargs):
+        """Instance initialization.
+
+        Args:
+            logger (logging.Logger): Configured logger.
+            **kwargs: Keyword arguments corresponding to instance attributes.
+                Any unassociated keyword arguments are ignored.
+        """
+        # Logger
+        self.__logger = logger
+        # Pipeline settings
+        for key, value in DEFAULT_CONFIG.items():
+            if key in kwargs and kwargs[key]:
+                setattr(self, key, kwargs[key])
+            else:
+                self.__logger.debug("Using default pipeline configuration "
+                        f"{key}: {value}.")
+                setattr(self, key, value)
+        self.__sources = SourceCache()
+        self.__logger.info("Initialized pipeline.")
+
+    @property
+    def cache_dir(self):
+        """Stage cache directory getter."""
+        return self.__cache_dir
+
+    @cache_dir.setter
+    def cache_dir(self, value):
+        """Stage cache directory setter.
+
+        Raises:
+            TypeError: Pipeline cache directory must be a string.
+        """
+        if not isinstance(value, str):
+            raise TypeError("Pipeline cache directory must be a string.")
+        self.__cache_dir = Path(value)
+        self.__cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def workers(self):
+        """Parallel analysis count getter."""
+        return self.__workers
+
+    @workers.setter
+    def workers(self, value):
+        """Parallel analysis count setter.
+
+        Raises:
+            TypeError: Pipeline workers must be an integer.
+            ValueError: Pipeline workers must be strictly positive.
+        """
+        if not isinstance(value, int):
+            raise TypeError("Pipeline workers must be an integer.")
+        elif value <= 0:
+            raise ValueError("Pipeline workers must be strictly positive.")
+        self.__workers = value
+
+    @property
+    def analyses(self):
+        """Analysis specifications getter."""
+        return self.__analyses
+
+    @analyses.setter
+    def analyses(self, value):
+        """Analysis specifications setter.
+
+        Raises:
+            TypeError: Pipeline analyses must be a dictionary.
+            KeyError: Each analysis must specify its dataset.
+        """
+        if not isinstance(value, dict):
+            raise TypeError("Pipeline analyses must be a dictionary.")
+        for name, spec in value.items():
+            if 'dataset' not in spec:
+                raise KeyError(f"Pipeline analysis {name} must specify a "
+                        "dataset.")
+        self.__analyses = value
+
+    def run(self, names=None):
+        """Run analyses in parallel.
+
+        Args:
+            names (list): Names of analyses to run. Defaults to all.
+
+        Returns:
+            Dictionary of analysis results keyed by analysis name. Each result
+            is a dictionary with 'raw' and 'clean' datasets
+            (pi_dataset.AlignedColumns), 'fits' (dict of fit name to fit
+            result dict), and 'regressions' (dict of regression name to
+            pi_regression.fit result).
+        """
+        if names is None:
+            names = list(self.analyses.keys())
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {name: executor.submit(self.run_analysis, name)
+                    for name in names}
+            return {name: future.result() for name, future in futures.items()}
+
+    def run_analysis(self, name):
+        """Run all stages of one analysis, reusing unchanged cached stages.
+
+        Args:
+            name (str): Analysis name.
+
+        Returns:
+            Analysis result dictionary, see run.
+        """
+        spec = self.analyses[name]
+        dataset = spec['dataset']
+        # Each stage key covers its own spec and code and the key of the
+        # stage before
+        raw_key = self.fingerprint(name, 'raw', code_fingerprint('raw'),
+                dataset, [self.file_fingerprint(file_path)
+                    for file_path in self.dataset_sources(dataset)])
+        raw = self.cached(name, 'raw', raw_key,
+                lambda: self.build_dataset(dataset))
+        clean_key = self.fingerprint(name, 'clean', code_fingerprint('clean'),
+                raw_key, spec.get('outliers', []))
+        clean = self.cached(name, 'clean', clean_key,
+                lambda: self.remove_outliers(raw, spec.get('outliers', [])))
+        fits_key = self.fingerprint(name, 'fits', code_fingerprint('fits'),
+                clean_key, spec.get('fits', {}))
+        fits = self.cached(name, 'fits', fits_key,
+                lambda: self.fit(raw, clean, spec.get('fits', {})))
+        regressions_key = self.fingerprint(name, 'regressions',
+                code_fingerprint('regressions'), clean_key,
+                spec.get('regressions', {}))
+        regressions = self.cached(name, 'regressions', regressions_key,
+                lambda: self.regress(raw, clean, spec.get('regressions', {})))
+        return {'raw': raw, 'clean': clean, 'fits': fits,
+                'regressions': regressions}
+
+    def cached(self, name, stage, key, compute):
+        """Return stage result from cache or compute and cache it.
+
+        Cache files are named after the analysis stage and its fingerprint,
+        and once a stage is computed, cached results of the same stage with
+        other fingerprints are removed.
+
+        Args:
+            name (str): Analysis name.
+            stage (str): Stage name.
+            key (str): Stage fingerprint.
+            compute (callable): Computes stage result when not cached.
+
+        Returns:
+            Stage result.
+        """
+        slot = self.fingerprint(name, stage)[:8]
+        cache_file = self.cache_dir / f"{slot}_{key}.pkl"
+        if cache_file.exists():
+            self.__logger.debug(f"Reusing cached stage {stage} of {name}.")
+            with cache_file.open('rb') as f:
+                return pickle.load(f)
+        self.__logger.debug(f"Computing stage {stage} of {name}.")
+        result = compute()
+        # Write then rename so a crash never leaves a partial cache entry
+        temp_file = cache_file.with_suffix(f".{threading.get_ident()}.tmp")
+        with temp_file.open('wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+        for stale_file in self.cache_dir.glob(f"{slot}_*.pkl"):
+            if stale_file != cache_file:
+                self.__logger.debug(f"Removing superseded cached stage "
+                        f"{stale_file.name}.")
+                try:
+                    stale_file.unlink()
+                except FileNotFoundError:
+                    pass
+        return result
+
+    @staticmethod
+    def fingerprint(*parts):
+        """Stable short hash of JSON serializable stage inputs."""
+        encoded = json.dumps([CACHE_VERSION, parts], sort_keys=True,
+                default=str).encode()
+        return hashlib.sha1(encoded).hexdigest()[:16]
+
+    @staticmethod
+    def file_fingerprint(file_path):
+        """Identity of a source file's current contents.
+
+        Raises:
+            FileNotFoundError: Source file must exist.
+        """
+        status = os.stat(file_path)
+        return [str(file_path), status.st_size, status.st_mtime_ns]
+
+    @staticmethod
+    def dataset_sources(dataset):
+        """All source files of a dataset.
+
+        Sources read from a dataset store are represented by its catalog,
+        which changes whenever any partition is re-ingested.
+        """
+        if dataset.get('join') == 'asof':
+            specs = dataset['sources'].values()
+        else:
+            specs = dataset.values()
+        files = []
+        for spec in specs:
+            if 'store' in spec:
+                files.append(os.path.join(spec['store'], pi_store.CATALOG_FILE))
+            else:
+                files.extend(spec['files'])
+        return files
+
+    def build_dataset(self, dataset):
+        """Assemble dataset columns from source files.
+
+        Datasets are aligned either by position or by time. A positional
+        dataset maps each dataset column name to a specification with
+        'column' and 'files' keys; the column is the named source column of
+        each listed file concatenated in order. In place of 'files', any
+        source may give a dataset 'store' and 'partition' selectors, see
+        source_column.
+
+        A time aligned dataset has 'join' set to 'asof', a timestamp column
+        'time_column' (defaults to 'TIMESTAMP'), a 'tolerance' (s, defaults
+        to 1), and 'sources' mapping source names to specifications with
+        'files' and 'columns' (dataset column name to source column name). Each row of
+        the first source is joined to the nearest-in-time row of every other
+        source; rows without a match within tolerance are dropped. An
+        optional 'clock' specification first corrects each source's
+        timestamps for clock offset and drift, see align_clocks.
+
+        Args:
+            dataset (dict): Dataset specification.
+
+        Returns:
+            pi_dataset.AlignedColumns of dataset columns.
+
+        Raises:
+            ValueError: Positional dataset columns must have equal lengths.
+        """
+        if dataset.get('join') != 'asof':
+            return pi_dataset.AlignedColumns({name: self.source_column(
+                spec, spec['column']) for name, spec in dataset.items()})
+        on = dataset.get('time_column', 'TIMESTAMP')
+        sources = {}
+        for name, spec in dataset['sources'].items():
+            columns = {column: self.source_column(spec, source_column)
+                    for column, source_column in spec['columns'].items()}
+            columns[on] = pi_timeseries.parse_timestamps(
+                    self.source_column(spec, on))
+            sources[name] = pi_dataset.AlignedColumns(columns)
+        if 'clock' in dataset:
+            sources = self.align_clocks(dataset['sources'], sources, on,
+                    dataset['clock'])
+        joined = None
+        for name, source in sources.items():
+            if joined is None:
+                joined = source
+            else:
+                # Rows already joined are matched to the source, not the
+                # reverse, so they are the count matched against
+                rows = len(joined)
+                joined = joined.join_nearest(source, on,
+                        dataset.get('tolerance', 1.0))
+                self.__logger.debug(f"Joined source {name}, {len(joined)} of "
+                        f"{rows} rows matched.")
+        return joined
+
+    def align_clocks(self, specs, sources, on, clock):
+        """Rewrite source timestamps onto the clock of a reference source.
+
+        The offset and drift of each source's clock relative to the
+        reference are estimated from beacons observed by both, see
+        pi_timeseries.estimate_clock, and every timestamp is corrected in
+        one vectorized pass before any join.
+
+        Args:
+            specs (dict): Source specifications keyed by source name.
+            sources (dict): pi_dataset.AlignedColumns keyed by source name.
+            on (str): Timestamp column.
+            clock (dict): Clock alignment specification with 'reference'
+                (source name, defaults to the first source), 'group_by'
+                (beacon identifier columns, defaults to ['ADDRESS']), and
+                optionally 'resolution' (s), 'max_lag' (s), and 'segments'.
+
+        Returns:
+            Dictionary of pi_dataset.AlignedColumns keyed by source name with
+            corrected timestamps.
+
+        Raises:
+            KeyError: Clock reference must be one of the sources.
+        """
+        reference = clock.get('reference', next(iter(sources)))
+        if reference not in sources:
+            raise KeyError(f"Clock reference {reference} must be one of "
+                    f"sources {list(sources)}.")
+        group_by = clock.get('group_by', ['ADDRESS'])
+        names = list(sources)
+        frames = [pd.DataFrame({column: self.source_column(specs[name], column)
+            for column in group_by}) for name in names]
+        codes = dict(zip(names, pi_timeseries.beacon_codes(frames, group_by)))
+        aligned = {}
+        for name, source in sources.items():
+            if name == reference:
+                aligned[name] = source
+                continue
+            estimate = pi_timeseries.estimate_clock(sources[reference][on],
+                    codes[reference], source[on], codes[name],
+                    clock.get('resolution', 0.25), clock.get('max_lag', 60.0),
+                    clock.get('segments', 1))
+            if np.isnan(estimate['offset']):
+                self.__logger.warning(f"No beacon observed by both {name} and "
+                        f"{reference}, clock of {name} left uncorrected.")
+                aligned[name] = source
+                continue
+            self.__logger.info(f"Clock of {name} relative to {reference}: "
+                    f"offset {estimate['offset']:.3f} s, drift "
+                    f"{estimate['drift']*1e6:.1f} ppm, score "
+                    f"{estimate['score']:.2f}.")
+            columns = dict(source.columns)
+            columns[on] = pi_timeseries.correct_timestamps(source[on],
+                    estimate)
+            aligned[name] = pi_dataset.AlignedColumns(columns)
+        return aligned
+
+    def source_column(self, spec, column):
+        """Named column of a source.
+
+        Args:
+            spec (dict): Source specification, either with 'files' (CSV
+                files concatenated in order) or with 'store' (dataset store
+                directory) and 'partition' (partition selectors, see
+                pi_store.DatasetStore.partitions).
+            column (str): Source column name.
+
+        Returns:
+            numpy.ndarray of column values.
+        """
+        if 'store' in spec:
+            return self.__sources.store(spec['store']).load([column],
+                    **spec.get('partition', {}))[column]
+        return self.read_column(spec['files'], column)
+
+    def read_column(self, files, column):
+        """Named column of each file concatenated in order."""
+        return np.concatenate([self.__sources.read(file_path)[column].to_numpy()
+            for file_path in files])
+
+    def remove_outliers(self, data, outliers):
+        """Remove rows outside of inclusive range of any outlier rule.
+
+        All rules are combined into a single mask applied once to every
+        column. The number of rows each rule rejects is logged.
+
+        Args:
+            data (pi_dataset.AlignedColumns): Dataset.
+            outliers (list): Rules, each with 'column', 'min', and 'max'.
+
+        Returns:
+            pi_dataset.AlignedColumns with outlier rows removed.
+        """
+        data = pi_dataset.AlignedColumns(data.columns)
+        for rule in outliers:
+            data.add_range(rule['column'], rule['min'], rule['max'])
+        clean, report = data.apply()
+        for rule in report:
+            self.__logger.info(f"Outlier rule {rule['column']} in "
+                    f"[{rule['min']}, {rule['max']}] rejects "
+                    f"{rule['removed']} of {len(data)} rows.")
+        return clean
+
+    @staticmethod
+    def fit(raw, clean, fits):
+        """Linear least squares fits of dataset columns.
+
+        Args:
+            raw (pi_dataset.AlignedColumns): Dataset before outlier removal.
+            clean (pi_dataset.AlignedColumns): Dataset after outlier removal.
+            fits (dict): Fit specifications keyed by fit name, each with 'x',
+                'y', and optionally 'data' (one of 'raw' or 'clean', defaults
+                to 'clean') and 'average' (fit per-x means, defaults to
+                False).
+
+        Returns:
+            Dictionary of fit name to dictionary of 'slope', 'intercept',
+            'rvalue', 'pvalue', and 'stderr'.
+        """
+        results = {}
+        for name, spec in fits.items():
+            data = {'raw': raw, 'clean': clean}[spec.get('data', 'clean')]
+            x, y = data[spec['x']], data[spec['y']]
+            if spec.get('average', False):
+                grouped = pi_stats.group_stats(x, y)
+                x, y = grouped['keys'], grouped['mean']
+            fit = stats.linregress(x, y)
+            results[name] = {'slope': fit.slope, 'intercept': fit.intercept,
+                    'rvalue': fit.rvalue, 'pvalue': fit.pvalue,
+                    'stderr': fit.stderr}
+        return results
+
+    @staticmethod
+    def regress(raw, clean, regressions):
+        """Multivariate least squares fits of dataset columns.
+
+        Each regression fits all of its targets on all of its predictors in
+        one solve, see pi_regression.fit.
+
+        Args:
+            raw (pi_dataset.AlignedColumns): Dataset before outlier removal.
+            clean (pi_dataset.AlignedColumns): Dataset after outlier removal.
+            regressions (dict): Regression specifications keyed by name, each
+                with 'x' (list of predictor columns), 'y' (list of target
+                columns), and optionally 'data' (one of 'raw' or 'clean',
+                defaults to 'clean') and 'significance' (keyword arguments
+                of pi_resampling.significance, e.g., 'block' and
+                'resamples').
+
+        Returns:
+            Dictionary of regression name to pi_regression.fit result, with
+            the pi_resampling.significance result under 'significance' when
+            requested.
+        """
+        results = {}
+        for name, spec in regressions.items():
+            data = {'raw': raw, 'clean': clean}[spec.get('data', 'clean')]
+            x = np.column_stack([data[column] for column in spec['x']])
+            y = np.column_stack([data[column] for column in spec['y']])
+            results[name] = pi_regression.fit(x, y, spec['x'], spec['y'])
+            if 'significance' in spec:
+                results[name]['significance'] = pi_resampling.significance(
+                        x, y, **(spec['significance'] or {}))
+        return results
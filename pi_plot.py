@@ -2,15 +2,19 @@
 # -*- mode: python; coding: utf-8 -*-
 
 #plotting imports
-from collections import Counter
+import io
 import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation
 import pandas as pd
 import numpy as np
 import os
 import re
 import logging
 import logging.config
-import statistics
+import pi_compress
+import pi_profile
+import pi_stats
+import pi_timeseries
 #################
 
 import argparse
@@ -26,15 +30,36 @@ DEFAULT_CONFIG = {
         'x_label': "Distance Between Pi's (inches)",
         'best_fit': 1,
         'start_dist': 0.0,
-        'incr_dist': 1.0
+        'incr_dist': 1.0,
+        'group_by': ['ADDRESS'],
+        'group_layout': "overlay"
         },
     'indiv_plotter': {
         'file_location': "pact_scans/graph_scans/scan_0.csv",
-        'plot_title': "Box and Whiskers Plot of RSSI Values"
+        'plot_title': "Box and Whiskers Plot of RSSI Values",
+        'chunk_size': pi_stats.CHUNK_SIZE
+        },
+    'live_plotter': {
+        'file_location': "pact_scans/scan_0.csv",
+        'plot_title': "Live RSSI Values",
+        'window': 500,
+        'frame_rate': 2.0
+        },
+    'time_plotter': {
+        'file_location': "pact_scans/graph_scans/scan_0.csv",
+        'plot_title': "RSSI Values Over Time",
+        'group_by': ['ADDRESS'],
+        'period': 1.0,
+        'window': 30
         }
     }
 
 BEST_FIT_LIMITS = [-1, 5]
+GROUP_KEYS = ['ADDRESS', 'UUID', 'MAJOR', 'MINOR', 'TX POWER']
+GROUP_LAYOUTS = ['overlay', 'grid']
+RSSI_AXIS_LIMITS = [-100, 0] # (dBm)
+TAIL_SIZE = 64 # (bytes) Read before the offset to detect replaced files
+PROFILE_PREFIX = "pi_plot_profile" # Default profile output file prefix
 
 class All_Graph(object):
     def __init__(self, **kwargs):
@@ -77,39 +102,136 @@ class All_Graph(object):
                     f"{BEST_FIT_LIMITS}.")
         self.__best_fit = value
 
-    def parse_data(self):
-        # create dictionary of values to distances
-        scans_dict = dict()
-        curr_dist = self.start_dist
-        # make a list of the valid csv files
+    @property
+    def group_by(self):
+        """Beacon grouping columns getter."""
+        return self.__group_by
+
+    @group_by.setter
+    def group_by(self, value):
+        """Beacon grouping columns setter.
+
+        Raises:
+            TypeError: Group by columns must be a list.
+            KeyError: Group by columns must be beacon identifiers.
+         """
+        if not isinstance(value, list):
+            raise TypeError("Group by columns must be a list.")
+        elif not all([key in GROUP_KEYS for key in value]):
+            raise KeyError("Group by columns must be one of beacon "
+                    f"identifiers {GROUP_KEYS}.")
+        self.__group_by = value
+
+    @property
+    def group_layout(self):
+        """Grouped graph layout getter."""
+        return self.__group_layout
+
+    @group_layout.setter
+    def group_layout(self, value):
+        """Grouped graph layout setter.
+
+        Raises:
+            ValueError: Group layout must be one of allowable layouts.
+         """
+        if value not in GROUP_LAYOUTS:
+            raise ValueError("Group layout must be one of allowable layouts "
+                    f"{GROUP_LAYOUTS}.")
+        self.__group_layout = value
+
+    def scan_files(self):
+        # make a list of the valid csv files paired with their distances
         # must be saved as #.csv in order you want them to be graphed
-        valid_files = list()
+        # (compressed scans are saved as #.csv.gz)
+        valid_files = dict()
         for i in os.listdir(self.file_location):
             if (".csv" in i):
-                valid_files.append(int(re.findall('\d+',i)[0]))
-        #loop through valid csv files
+                valid_files[int(re.findall('\d+',i)[0])] = i[i.index(".csv"):]
+        files = list()
+        curr_dist = self.start_dist
         for file in sorted(valid_files):
-            file_name =  self.file_location + "/" + self.scan_prefix + str(file) + ".csv"
+            file_name =  self.file_location + "/" + self.scan_prefix + str(file) + valid_files[file]
+            files.append((curr_dist, file_name))
+            curr_dist = curr_dist + self.incr_dist
+        return files
 
+    @pi_profile.staged('parse_data')
+    def parse_data(self):
+        # create dictionary of values to distances
+        scans_dict = dict()
+        #loop through valid csv files
+        for curr_dist, file_name in self.scan_files():
             #read RSSI column from file
-            file_data = pd.read_csv(file_name)
+            file_data = pi_compress.read_scan(file_name, usecols=["RSSI"])
             scan_values = file_data["RSSI"].tolist()
             
-            #add list of RSSI values to dictionary and increment curr_dist
+            #add list of RSSI values to dictionary
             scans_dict.update({curr_dist: scan_values})
-            curr_dist = curr_dist + self.incr_dist
         return scans_dict
 
-    def plot_all(self):
-        scans_dict = self.parse_data()
-        x_values = list(scans_dict.keys())
-        
+    @pi_profile.staged('parse_grouped_data')
+    def parse_grouped_data(self):
+        """Per-beacon RSSI statistics at each distance.
+
+        Loads only the RSSI and grouping columns of every scan file and
+        computes all statistics from a single groupby over the combined data.
+
+        Returns:
+            pandas.DataFrame indexed by group label and distance with columns
+            'mean', 'std', and 'count'.
+        """
+        frames = list()
+        for curr_dist, file_name in self.scan_files():
+            file_data = pi_compress.read_scan(file_name,
+                    usecols=self.group_by+["RSSI"])
+            file_data["DISTANCE"] = curr_dist
+            frames.append(file_data)
+        data = pd.concat(frames, ignore_index=True)
+        grouped = data.groupby(self.group_by+["DISTANCE"], sort=True)["RSSI"]
+        beacon_stats = pd.DataFrame({
+            'mean': grouped.mean(),
+            'std': grouped.std(ddof=0),
+            'count': grouped.size()
+            })
+        # collapse multi-column beacon identity into a single label per group
+        beacon_stats.index = pd.MultiIndex.from_arrays([
+            ["/".join(map(str, key[:-1])) for key in beacon_stats.index],
+            beacon_stats.index.get_level_values("DISTANCE")],
+            names=["BEACON", "DISTANCE"])
+        return beacon_stats
+
+    @pi_profile.staged('distance_stats')
+    def distance_stats(self, scans_dict):
+        """RSSI statistics at each distance.
+
+        Args:
+            scans_dict (dict): RSSI values keyed by distance, see parse_data.
+
+        Returns:
+            Dictionary of distances 'keys' with their RSSI 'mean' and 'std',
+            see pi_stats.group_stats.
+        """
+        distances = np.repeat(list(scans_dict.keys()),
+                [len(y) for y in scans_dict.values()])
+        scan_values = np.concatenate([np.asarray(y, dtype=float) for y in scans_dict.values()])
+        return pi_stats.group_stats(distances, scan_values)
+
+    @pi_profile.staged('draw')
+    def draw_all(self, scans_dict, grouped):
+        """Draw RSSI values and their statistics against distance.
+
+        Args:
+            scans_dict (dict): RSSI values keyed by distance, see parse_data.
+            grouped (dict): RSSI statistics at each distance, see
+                distance_stats.
+        """
         fig, ax = plt.subplots()
-        for x in x_values:
+        for x in scans_dict.keys():
             ax.scatter([x] * len(scans_dict[x]), scans_dict[x], marker="o")
 
-        scans_mean = np.array([np.mean(y) for x,y in sorted(scans_dict.items())])
-        scans_std = np.array([np.std(y) for x,y in sorted(scans_dict.items())])
+        x_values = grouped['keys']
+        scans_mean = grouped['mean']
+        scans_std = grouped['std']
         ax.errorbar(x_values, scans_mean, yerr=scans_std, label="mean accuracy")
         
         ax.set_title(self.graph_title)
@@ -144,8 +266,57 @@ class All_Graph(object):
             ax.plot(x, x4*x**5 + x2*x**3 + x1*x**2 + m*x + b, '-r', label=equation)
 
         ax.legend()
-        plt.show()
-        print(scans_mean)
+
+    def plot_all(self):
+        scans_dict = self.parse_data()
+        grouped = self.distance_stats(scans_dict)
+        self.draw_all(scans_dict, grouped)
+        show()
+        print(grouped['mean'])
+
+        pass
+
+    @pi_profile.staged('draw')
+    def draw_groups(self, beacon_stats):
+        """Draw per-beacon RSSI statistics against distance.
+
+        Args:
+            beacon_stats (pandas.DataFrame): Per-beacon RSSI statistics, see
+                parse_grouped_data.
+        """
+        beacons = beacon_stats.index.unique(level="BEACON")
+
+        if self.group_layout == "grid":
+            ncols = int(np.ceil(np.sqrt(len(beacons))))
+            nrows = int(np.ceil(len(beacons)/ncols))
+            fig, axes = plt.subplots(nrows, ncols, sharex=True, sharey=True,
+                    squeeze=False)
+            axes = axes.flatten()
+            for ax in axes[len(beacons):]:
+                ax.set_visible(False)
+        else:
+            fig, ax = plt.subplots()
+            axes = [ax] * len(beacons)
+
+        for ax, beacon in zip(axes, beacons):
+            series = beacon_stats.loc[beacon]
+            ax.errorbar(series.index, series["mean"], yerr=series["std"],
+                    marker="o", capsize=3, label=beacon)
+            ax.grid(True)
+            if self.group_layout == "grid":
+                ax.set_title(beacon, fontsize="small")
+
+        fig.suptitle(self.graph_title)
+        fig.supxlabel(self.x_label)
+        fig.supylabel(self.y_label)
+        if self.group_layout == "overlay":
+            axes[0].legend(title="/".join(self.group_by))
+
+    def plot_groups(self):
+        beacon_stats = self.parse_grouped_data()
+        self.draw_groups(beacon_stats)
+        show()
+        print(beacon_stats)
 
         pass
 
@@ -170,29 +341,370 @@ class Indiv_Plot(object):
         # self.__logger.info("Initialized beacon advertiser.")
         print("Initialized Plotter")
 
-    def plot_indiv(self):
-        file_data = pd.read_csv(getattr(self, "file_location"))
-        scan_values = file_data["RSSI"].tolist()
+    @property
+    def chunk_size(self):
+        """Scan file read chunk size getter."""
+        return self.__chunk_size
+
+    @chunk_size.setter
+    def chunk_size(self, value):
+        """Scan file read chunk size setter.
+
+        Raises:
+            TypeError: Chunk size must be an integer.
+            ValueError: Chunk size must be strictly positive.
+         """
+        if not isinstance(value, int):
+            raise TypeError("Chunk size must be an integer.")
+        elif value <= 0:
+            raise ValueError("Chunk size must be strictly positive.")
+        self.__chunk_size = value
 
+    @pi_profile.staged('scan_summary')
+    def scan_summary(self):
+        """Running statistics and histogram of the scan file's RSSI values.
+
+        The file is read in a single pass over chunks, so raw values are never
+        held in memory, see pi_stats.scan_summary.
+        """
+        return pi_stats.scan_summary(self.file_location,
+                chunk_size=self.chunk_size)
+
+    @pi_profile.staged('draw')
+    def draw_indiv(self, histogram):
+        """Draw the box plot and value counts of an RSSI histogram.
+
+        Args:
+            histogram (pi_stats.RSSIHistogram): RSSI value counts.
+        """
         fig1, ax = plt.subplots()
-        ax.boxplot(scan_values, vert=False, meanline=True, showmeans=True, meanprops={'linewidth':2.5, 'color':'red'}, medianprops={'linestyle':'None'})
+        ax.bxp([histogram.box_stats()], vert=False, meanline=True, showmeans=True, meanprops={'linewidth':2.5, 'color':'red'}, medianprops={'linestyle':'None'})
 
         ax.set_title(self.plot_title)
         ax.set_xlabel('RSSI Values')        
-            
-        y = [1] * len(scan_values)
-        counts = Counter(zip(scan_values,y))
-        s = [200*counts[(xx,yy)] for xx,yy in zip(scan_values,y)]
-            
-        plt.scatter(scan_values, y, s=s, alpha=0.2)
+
+        # one marker per distinct RSSI value sized by its count
+        values, counts = histogram.nonzero()
+        plt.scatter(values, np.ones(len(values)), s=200*counts, alpha=0.2)
         plt.yticks([])
 
-        plt.show()
+    def plot_indiv(self):
+        running, histogram = self.scan_summary()
+        if not histogram.count:
+            print(f"No RSSI values in {self.file_location}")
+            return
+        self.draw_indiv(histogram)
+        show()
 
-        print("Average Value: " + str(statistics.mean(scan_values)))
+        print("Average Value: " + str(running.mean))
 
         pass
 
+class Live_Plot(object):
+    def __init__(self, **kwargs):
+        """Instance initialization.
+
+        Args:
+            **kwargs: Keyword arguments corresponding to instance attributes.
+                Any unassociated keyword arguments are ignored.
+        """
+        # Plotter settings
+        for key, value in DEFAULT_CONFIG['live_plotter'].items():
+            if key in kwargs and kwargs[key]:
+                setattr(self, key, kwargs[key])
+            else:
+                setattr(self, key, value)
+                print("Default attribute initialized")
+        # Tail state
+        self.__offset = 0
+        self.__rssi_column = None
+        self.__identity = None
+        self.__tail = b''
+        # Rolling and cumulative statistics
+        self.__values = np.empty(0)
+        self.__running = pi_stats.RunningStats()
+
+        print("Initialized Live Plotter")
+
+    @property
+    def window(self):
+        """Rolling window length getter."""
+        return self.__window
+
+    @window.setter
+    def window(self, value):
+        """Rolling window length setter.
+
+        Raises:
+            TypeError: Rolling window must be an integer.
+            ValueError: Rolling window must be strictly positive.
+         """
+        if not isinstance(value, int):
+            raise TypeError("Rolling window must be an integer.")
+        elif value <= 0:
+            raise ValueError("Rolling window must be strictly positive.")
+        self.__window = value
+
+    @property
+    def frame_rate(self):
+        """Redraw frame rate getter."""
+        return self.__frame_rate
+
+    @frame_rate.setter
+    def frame_rate(self, value):
+        """Redraw frame rate setter.
+
+        Raises:
+            TypeError: Frame rate must be a float or integer.
+            ValueError: Frame rate must be strictly positive.
+         """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Frame rate must be a float or integer.")
+        elif value <= 0:
+            raise ValueError("Frame rate must be strictly positive.")
+        self.__frame_rate = value
+
+    @pi_profile.staged('read_new')
+    def read_new(self):
+        """Read RSSI values appended to scan file since last read.
+
+        Only bytes past the previous read offset are read. A trailing partial
+        line (or compressed block) is held back until it is completed by the
+        scanner. A scan file replaced by another, detected by its inode or
+        by the bytes before the offset changing, is read from the start and
+        the rolling and cumulative statistics are reset.
+
+        Returns:
+            numpy.ndarray of newly appended RSSI values.
+        """
+        try:
+            with open(self.file_location, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                identity = (stat.st_dev, stat.st_ino)
+                f.seek(self.__offset-len(self.__tail))
+                # start over if the scan file was replaced by another one
+                if identity != self.__identity or \
+                        f.read(len(self.__tail)) != self.__tail:
+                    self.__identity = identity
+                    self.__offset = 0
+                    self.__rssi_column = None
+                    # statistics of the old file must not mix into the new
+                    self.__values = np.empty(0)
+                    self.__running = pi_stats.RunningStats()
+                data, self.__offset = pi_compress.read_complete(f,
+                        self.__offset,
+                        pi_compress.is_compressed(self.file_location))
+                f.seek(max(0, self.__offset-TAIL_SIZE))
+                self.__tail = f.read(self.__offset-f.tell())
+        except FileNotFoundError:
+            return np.empty(0)
+        if self.__rssi_column is None and data:
+            header, data = data.split(b"\n", 1)
+            self.__rssi_column = header.decode().strip().split(",").index("RSSI")
+        if not data:
+            return np.empty(0)
+        rssi = pd.read_csv(io.BytesIO(data), header=None,
+                usecols=[self.__rssi_column])
+        return rssi[self.__rssi_column].to_numpy(dtype=np.float64)
+
+    @pi_profile.staged('update_stats')
+    def update_stats(self, values):
+        """Add new RSSI values to rolling and cumulative statistics.
+
+        Args:
+            values (numpy.ndarray): Newly received RSSI values.
+
+        Returns:
+            Tuple of rolling window values, rolling mean, and rolling standard
+            deviation.
+        """
+        self.__running.update(values)
+        self.__values = np.concatenate((self.__values, values))[-self.window:]
+        if not self.__values.size:
+            return self.__values, np.nan, np.nan
+        return self.__values, self.__values.mean(), self.__values.std()
+
+    def plot_live(self):
+        fig, ax = plt.subplots()
+        ax.set_title(self.plot_title)
+        ax.set_xlabel('Sample (most recent at right)')
+        ax.set_ylabel('RSSI Values')
+        ax.set_xlim(0, self.window-1)
+        ax.set_ylim(*RSSI_AXIS_LIMITS)
+        ax.grid(True)
+
+        # artists redrawn each frame, everything else is cached for blitting
+        samples, = ax.plot([], [], '.', alpha=0.4, animated=True)
+        mean_line, = ax.plot([], [], '-r', animated=True)
+        upper_line, = ax.plot([], [], '--r', linewidth=0.8, animated=True)
+        lower_line, = ax.plot([], [], '--r', linewidth=0.8, animated=True)
+        text = ax.text(0.02, 0.97, '', transform=ax.transAxes, va='top',
+                animated=True)
+        artists = (samples, mean_line, upper_line, lower_line, text)
+
+        def update(frame):
+            values, mean, std = self.update_stats(self.read_new())
+            x = np.arange(self.window-values.size, self.window)
+            ends = [0, self.window-1]
+            samples.set_data(x, values)
+            mean_line.set_data(ends, [mean, mean])
+            upper_line.set_data(ends, [mean+std, mean+std])
+            lower_line.set_data(ends, [mean-std, mean-std])
+            text.set_text(f"window mean: {mean:.2f}  std: {std:.2f}\n"
+                    f"total: {self.__running.count}  "
+                    f"mean: {self.__running.mean:.2f}")
+            return artists
+
+        animation = FuncAnimation(fig, update, interval=1000/self.frame_rate,
+                blit=True, cache_frame_data=False)
+        show()
+
+        print("Average Value: " + str(self.__running.mean))
+
+        pass
+
+class Time_Plot(object):
+    def __init__(self, **kwargs):
+        """Instance initialization.
+
+        Args:
+            **kwargs: Keyword arguments corresponding to instance attributes.
+                Any unassociated keyword arguments are ignored.
+        """
+        # Plotter settings
+        for key, value in DEFAULT_CONFIG['time_plotter'].items():
+            if key in kwargs and kwargs[key]:
+                setattr(self, key, kwargs[key])
+            else:
+                setattr(self, key, value)
+                print("Default attribute initialized")
+
+        print("Initialized Time Plotter")
+
+    @property
+    def group_by(self):
+        """Beacon grouping columns getter."""
+        return self.__group_by
+
+    @group_by.setter
+    def group_by(self, value):
+        """Beacon grouping columns setter.
+
+        Raises:
+            TypeError: Group by columns must be a list.
+            KeyError: Group by columns must be beacon identifiers.
+         """
+        if not isinstance(value, list):
+            raise TypeError("Group by columns must be a list.")
+        elif not all([key in GROUP_KEYS for key in value]):
+            raise KeyError("Group by columns must be one of beacon "
+                    f"identifiers {GROUP_KEYS}.")
+        self.__group_by = value
+
+    @property
+    def period(self):
+        """Resampling period getter."""
+        return self.__period
+
+    @period.setter
+    def period(self, value):
+        """Resampling period setter.
+
+        Raises:
+            TypeError: Resampling period must be a float or integer.
+            ValueError: Resampling period must be strictly positive.
+         """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Resampling period must be a float or integer.")
+        elif value <= 0:
+            raise ValueError("Resampling period must be strictly positive.")
+        self.__period = value
+
+    @property
+    def window(self):
+        """Rolling window length getter."""
+        return self.__window
+
+    @window.setter
+    def window(self, value):
+        """Rolling window length setter.
+
+        Raises:
+            TypeError: Rolling window must be an integer.
+            ValueError: Rolling window must be strictly positive.
+         """
+        if not isinstance(value, int):
+            raise TypeError("Rolling window must be an integer.")
+        elif value <= 0:
+            raise ValueError("Rolling window must be strictly positive.")
+        self.__window = value
+
+    @pi_profile.staged('read_scan')
+    def read_scan(self):
+        """Timestamps, RSSI, and grouping columns of the scan file."""
+        return pi_compress.read_scan(self.file_location,
+                usecols=self.group_by+["TIMESTAMP", "RSSI"])
+
+    @pi_profile.staged('series_stats')
+    def series_stats(self, file_data):
+        """Rolling statistics and power spectrum of each beacon's RSSI.
+
+        Args:
+            file_data (pandas.DataFrame): Scan file columns, see read_scan.
+
+        Returns:
+            Dictionary of beacon 'labels', time 'grid', rolling 'mean', 'std',
+            and 'median' per beacon on the grid, and RSSI 'power' per beacon
+            at frequencies 'freq'.
+        """
+        labels, grid, rssi = pi_timeseries.beacon_series(file_data,
+                self.group_by, self.period)
+        mean, std = pi_timeseries.rolling_mean_std(rssi, self.window)
+        median = pi_timeseries.rolling_median(rssi, self.window)
+        freq, power = pi_timeseries.power_spectrum(rssi, self.period)
+        return {'labels': labels, 'grid': grid, 'mean': mean, 'std': std,
+                'median': median, 'freq': freq, 'power': power}
+
+    @pi_profile.staged('draw')
+    def draw_time(self, series):
+        """Draw rolling statistics over time and power spectra.
+
+        Args:
+            series (dict): Per-beacon statistics, see series_stats.
+        """
+        grid, mean, std = series['grid'], series['mean'], series['std']
+        median, freq, power = series['median'], series['freq'], \
+                series['power']
+        fig, (ax_time, ax_freq) = plt.subplots(2, 1)
+        for i, label in enumerate(series['labels']):
+            line, = ax_time.plot(grid, mean[i], label=label)
+            ax_time.plot(grid, median[i], ':', color=line.get_color())
+            ax_time.fill_between(grid, mean[i]-std[i], mean[i]+std[i],
+                    color=line.get_color(), alpha=0.2)
+            # skip zero frequency, it only holds the removed mean
+            ax_freq.semilogy(freq[1:], power[i, 1:], color=line.get_color(),
+                    label=label)
+
+        ax_time.set_title(self.plot_title)
+        ax_time.set_xlabel('Time')
+        ax_time.set_ylabel(f'RSSI Values (rolling {self.window} sample mean/median)')
+        ax_time.grid(True)
+        ax_time.legend(title="/".join(self.group_by))
+        ax_freq.set_xlabel('Frequency (Hz)')
+        ax_freq.set_ylabel('RSSI Power')
+        ax_freq.grid(True)
+
+    def plot_time(self):
+        self.draw_time(self.series_stats(self.read_scan()))
+        show()
+
+        pass
+
+def show():
+    """Show figures, staged apart so that window time is not drawing time."""
+    with pi_profile.stage('show'):
+        plt.show()
+
 def setup_logger(config):
     """Setup and return logger based on configuration."""
     logging.config.dictConfig(config['config'])
@@ -227,6 +739,10 @@ def load_config(parsed_args):
                 **config['all_grapher']}
         config['indiv_plotter'] = {**DEFAULT_CONFIG['indiv_plotter'],
                 **config['indiv_plotter']}
+        config['live_plotter'] = {**DEFAULT_CONFIG['live_plotter'],
+                **config.get('live_plotter', {})}
+        config['time_plotter'] = {**DEFAULT_CONFIG['time_plotter'],
+                **config.get('time_plotter', {})}
     # Merge configuration values with command line options
     for key, value in parsed_args.items():
         if value is not None:
@@ -234,6 +750,10 @@ def load_config(parsed_args):
                 config['all_grapher'][key] = value
             if key in config['indiv_plotter']:
                 config['indiv_plotter'][key] = value
+            if key in config['live_plotter']:
+                config['live_plotter'][key] = value
+            if key in config['time_plotter']:
+                config['time_plotter'][key] = value
     return config
 
 def parse_args(args):
@@ -255,6 +775,12 @@ def parse_args(args):
                             help="Create line graph of data in files in specified folder")
     mode_group.add_argument('-i', '--indiv_plotter', action='store_true',
                             help="Create scatter plot of data in specified file")       
+    mode_group.add_argument('-g', '--group_grapher', action='store_true',
+                            help="Create per-beacon line graphs of data in files in specified folder")
+    mode_group.add_argument('-l', '--live_plotter', action='store_true',
+                            help="Follow and plot data appended to specified file by a running scan")
+    mode_group.add_argument('-t', '--time_plotter', action='store_true',
+                            help="Create rolling statistics and spectrum plots of data in specified file over time")
     parser.add_argument('--config_yml', help="Configuration YAML.")
     parser.add_argument('--file_location', help="Path to file")
     parser.add_argument('--scan_prefix', help="Prefix to numbered file (file should be scan_prefix#.csv)")
@@ -268,6 +794,24 @@ def parse_args(args):
             help="Distance between pi's for first reading")
     parser.add_argument('--incr_dist', type=float,
             help="Change in Distance between pi's from reading to reading")
+    parser.add_argument('--group_by', nargs='+',
+            help="Beacon identifier columns to group by")
+    parser.add_argument('--group_layout', choices=GROUP_LAYOUTS,
+            help="Overlay groups on one graph or draw one graph per group")
+    parser.add_argument('--chunk_size', type=int,
+            help="Number of rows read from a file at a time")
+    parser.add_argument('--window', type=int,
+            help="Number of values in rolling statistics")
+    parser.add_argument('--frame_rate', type=float,
+            help="Live plot redraws per second")
+    parser.add_argument('--period', type=float,
+            help="Time series resampling period (s)")
+    parser.add_argument('--profile', nargs='?', const=PROFILE_PREFIX,
+            metavar='PREFIX', help="Profile plotting stages, writing the "
+            f"report and collapsed stacks to PREFIX (default {PROFILE_PREFIX})"
+            ".txt and .collapsed")
+    parser.add_argument('--cprofile', action='store_true',
+            help="Also profile every function with cProfile to PREFIX.prof")
 
     return vars(parser.parse_args(args))
 
@@ -287,19 +831,32 @@ def main(args):
     config = load_config(parsed_args)
     # logger = setup_logger(config['logger'])
     # logger.debug(f"Beacon configuration - {config['graph']}")
+    if parsed_args['profile'] is not None:
+        pi_profile.start('pi_plot', parsed_args['cprofile'])
 
     try:
         if parsed_args['all_grapher']:
             # logger.info("Beacon advertiser mode selected.")
             grapher = All_Graph(**config['all_grapher'])
             grapher.plot_all()
+        elif parsed_args['group_grapher']:
+            grapher = All_Graph(**config['all_grapher'])
+            grapher.plot_groups()
         elif parsed_args['indiv_plotter']:
             plotter = Indiv_Plot(**config['indiv_plotter'])
             plotter.plot_indiv()
+        elif parsed_args['live_plotter']:
+            plotter = Live_Plot(**config['live_plotter'])
+            plotter.plot_live()
+        elif parsed_args['time_plotter']:
+            plotter = Time_Plot(**config['time_plotter'])
+            plotter.plot_time()
     except Exception:
         print("Something has gone wrong...oops")
-    # finally:
-    #     close_logger(logger)
+    finally:
+        for profile_file in pi_profile.stop(parsed_args['profile']):
+            print(f"Wrote profile {profile_file}")
+        # close_logger(logger)
 
 if __name__ == "__main__":
     """Script execution."""
@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Per-stage profiling of the scanner and plotters.
+
+Pipeline stages, e.g., BeaconService.scan, process_scans, to_csv, or the
+plotters' parsing and drawing methods, are wrapped in stage context managers
+or decorated as stages. While a
+profiler is active every stage records its calls, wall and CPU time, and
+tracemalloc peak memory; otherwise stages cost one global lookup. Stages may
+be nested, a stage's path is the names of the stages enclosing it.
+
+When profiling stops three files are written:
+
+* <prefix>.txt: stage breakdown report.
+* <prefix>.collapsed: collapsed stacks, one 'program;stage;substage
+  microseconds' line per stage path with its self time, as read by
+  flamegraph.pl, speedscope, and similar flame graph tools.
+* <prefix>.prof: with cProfile enabled, function level statistics of the
+  whole run, e.g., for pstats or snakeviz.
+"""
+
+import cProfile
+import contextlib
+import functools
+import pandas as pd
+from pathlib import Path
+import time
+import tracemalloc
+
+# Universal settings
+SEPARATOR = ';' # Stage path separator of collapsed stacks
+UNSTAGED = 'unstaged' # Collapsed stack frame of time outside any stage
+RESET_PEAK = hasattr(tracemalloc, 'reset_peak') # Python 3.9+
+EXHAUSTED = object() # Sentinel of an exhausted iterator
+
+# Active profiler, if any
+PROFILER = None
+
+class StageProfiler(object):
+    """Instantiates a stage profiler.
+
+    Attributes:
+        program (str): Program name, the root of every stage path.
+        cprofile (bool): Whether cProfile also profiles every function.
+    """
+
+    def __init__(self, program, cprofile=False):
+        """Instance initialization.
+
+        Args:
+            program (str): Program name, e.g., 'pi_pact'.
+            cprofile (bool): Whether to also run cProfile.
+        """
+        self.program = program
+        self.cprofile = cprofile
+        self.__profile = cProfile.Profile() if cprofile else None
+        self.__stats = {}
+        self.__stack = []
+        self.__start = None
+        self.__wall = 0.0
+
+    def start(self):
+        """Start tracing memory and the run clock."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.__start = time.perf_counter()
+        if self.__profile is not None:
+            self.__profile.enable()
+
+    def stop(self):
+        """Stop tracing."""
+        if self.__profile is not None:
+            self.__profile.disable()
+        self.__wall = time.perf_counter()-self.__start
+        tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Record the time and peak memory of a stage.
+
+        Args:
+            name (str): Stage name.
+        """
+        # The tracemalloc peak is global, so the peak so far of an enclosing
+        # stage is kept before resetting it for this one. Without
+        # reset_peak (Python < 3.9) the net allocation is recorded instead.
+        outer_peak = tracemalloc.get_traced_memory()[1]
+        if RESET_PEAK:
+            tracemalloc.reset_peak()
+        frame = {'name': name, 'base': tracemalloc.get_traced_memory()[0],
+                'peak': 0}
+        self.__stack.append(frame)
+        path = tuple(stage['name'] for stage in self.__stack)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter()-wall
+            cpu = time.process_time()-cpu
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak if RESET_PEAK else current, frame['peak'])
+            self.__stack.pop()
+            if self.__stack:
+                self.__stack[-1]['peak'] = max(self.__stack[-1]['peak'],
+                        outer_peak, peak)
+            stats = self.__stats.setdefault(path, {'calls': 0, 'wall': 0.0,
+                'cpu': 0.0, 'peak': 0})
+            stats['calls'] += 1
+            stats['wall'] += wall
+            stats['cpu'] += cpu
+            stats['peak'] = max(stats['peak'], peak-frame['base'])
+
+    def self_times(self):
+        """Wall time (s) of each stage path outside its substages."""
+        times = {path: stats['wall'] for path, stats in self.__stats.items()}
+        for path, stats in self.__stats.items():
+            if len(path) > 1 and path[:-1] in times:
+                times[path[:-1]] -= stats['wall']
+        return times
+
+    def report(self):
+        """Stage breakdown.
+
+        Returns:
+            pandas.DataFrame with one row per stage path: STAGE, CALLS, WALL
+            (s), SELF (s), CPU (s), MEAN (ms) wall time per call, SHARE of
+            the run wall time, and PEAK (KiB) memory above the stage start.
+        """
+        self_times = self.self_times()
+        rows = [{'STAGE': '/'.join(path), 'CALLS': stats['calls'],
+            'WALL (s)': stats['wall'], 'SELF (s)': self_times[path],
+            'CPU (s)': stats['cpu'],
+            'MEAN (ms)': 1000*stats['wall']/stats['calls'],
+            'SHARE': stats['wall']/self.__wall if self.__wall else 0.0,
+            'PEAK (KiB)': stats['peak']/1024}
+            for path, stats in sorted(self.__stats.items())]
+        return pd.DataFrame(rows, columns=['STAGE', 'CALLS', 'WALL (s)',
+            'SELF (s)', 'CPU (s)', 'MEAN (ms)', 'SHARE', 'PEAK (KiB)'])
+
+    def collapsed(self):
+        """Collapsed stack lines of the stage self times (us)."""
+        lines = []
+        staged = 0.0
+        for path, seconds in sorted(self.self_times().items()):
+            if len(path) == 1:
+                staged += self.__stats[path]['wall']
+            microseconds = round(seconds*1e6)
+            if microseconds > 0:
+                lines.append(SEPARATOR.join((self.program,)+path)
+                        +f" {microseconds}")
+        unstaged = round((self.__wall-staged)*1e6)
+        if unstaged > 0:
+            lines.append(f"{self.program}{SEPARATOR}{UNSTAGED} {unstaged}")
+        return lines
+
+    def write(self, prefix):
+        """Write the report, collapsed stacks, and cProfile statistics.
+
+        Args:
+            prefix (str, pathlib.Path): Output file path prefix.
+
+        Returns:
+            List of written files.
+        """
+        prefix = Path(prefix)
+        files = [prefix.with_name(prefix.name+'.txt'),
+                prefix.with_name(prefix.name+'.collapsed')]
+        with files[0].open('w') as f:
+            f.write(f"{self.program} profile, {self.__wall:.3f} s wall "
+                    "time\n")
+            f.write(self.report().to_string(index=False)+"\n")
+        with files[1].open('w') as f:
+            f.write("\n".join(self.collapsed())+"\n")
+        if self.__profile is not None:
+            files.append(prefix.with_name(prefix.name+'.prof'))
+            self.__profile.dump_stats(str(files[-1]))
+        return files
+
+def start(program, cprofile=False):
+    """Start profiling stages.
+
+    Args:
+        program (str): Program name.
+        cprofile (bool): Whether to also run cProfile.
+    """
+    global PROFILER
+    PROFILER = StageProfiler(program, cprofile)
+    PROFILER.start()
+
+def stage(name):
+    """Context manager profiling a stage while profiling is active."""
+    if PROFILER is None:
+        return contextlib.nullcontext()
+    return PROFILER.stage(name)
+
+def staged(name):
+    """Decorator profiling every call of a function as a stage.
+
+    Args:
+        name (str): Stage name.
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def iterate(name, iterable):
+    """Iterate, profiling each step while profiling is active.
+
+    Args:
+        name (str): Stage name of producing one item, e.g., reading it.
+        iterable: Items to iterate over.
+    """
+    if PROFILER is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        with PROFILER.stage(name):
+            item = next(iterator, EXHAUSTED)
+        if item is EXHAUSTED:
+            return
+        yield item
+
+def stop(prefix):
+    """Stop profiling and write its files.
+
+    Args:
+        prefix (str, pathlib.Path): Output file path prefix.
+
+    Returns:
+        List of written files, empty if profiling was not active.
+    """
+    global PROFILER
+    if PROFILER is None:
+        return []
+    profiler, PROFILER = PROFILER, None
+    profiler.stop()
+    return profiler.write(prefix)
@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Append-only binary log of raw beacon scans.
+
+Every BeaconService.scan result is appended unfiltered with its timestamp,
+so a field session can later be replayed through different filters or
+processing, or to reproduce a performance problem. The log is a sequence of
+records after a magic header line:
+
+* Symbol definition: b'D', kind (0 address, 1 UUID) as uint8, length as
+  uint16, and the UTF-8 string. Symbols of each kind are numbered in order
+  of definition and are defined before their first use.
+* Scan: b'S', timestamp (int64 ns since the epoch), number of
+  advertisements (uint32), and per advertisement the address and UUID
+  symbol numbers (uint32), major and minor (uint16), and TX power and RSSI
+  (int8), all little-endian.
+
+Records are only ever appended. Records cut short by a crash are ignored
+when reading and dropped when appending to the log again.
+"""
+
+import argparse
+import logging
+import os
+import pandas as pd
+from pathlib import Path
+import pi_timeseries
+import struct
+import sys
+
+# Universal settings
+MAGIC = b"PIPACT RAW SCANS 1\n"
+ADDRESS, UUID = range(2)
+DEFINITION = struct.Struct('<cBH')
+SCAN = struct.Struct('<cqI')
+ADVERTISEMENT = struct.Struct('<IIHHbb')
+READ_SIZE = 1 << 20 # (bytes) Read at a time, so memory does not grow with
+                    # the log
+
+class RawScanWriter(object):
+    """Instantiates an append-only raw scan log writer.
+
+    Attributes:
+        raw_file (pathlib.Path): Raw scan log file.
+    """
+
+    def __init__(self, raw_file, logger=None):
+        """Instance initialization.
+
+        Appending to an existing log continues its symbol numbering.
+
+        Args:
+            raw_file (str, pathlib.Path): Raw scan log file, created if it
+                does not exist.
+            logger (logging.Logger): Configured logger. Defaults to the
+                module logger.
+        """
+        self.__logger = logger or logging.getLogger(__name__)
+        self.__raw_file = Path(raw_file)
+        self.__symbols = ({}, {})
+        if self.__raw_file.exists() and self.__raw_file.stat().st_size:
+            reader = RawScanReader(self.__raw_file)
+            for kind, strings in enumerate(reader.symbols()):
+                self.__symbols[kind].update(
+                        (string, i) for i, string in enumerate(strings))
+            self.__file = self.__raw_file.open('ab')
+            # Drop a record cut short by a crash so appends stay readable
+            self.__file.truncate(reader.end)
+        else:
+            self.__file = self.__raw_file.open('ab')
+            self.__file.write(MAGIC)
+        self.__scans = 0
+
+    @property
+    def raw_file(self):
+        """Raw scan log file getter."""
+        return self.__raw_file
+
+    def close(self):
+        """Close the log file."""
+        self.__file.close()
+        self.__logger.debug(f"Logged {self.__scans} raw scans to "
+                f"{self.__raw_file}.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def symbol(self, kind, string, definitions):
+        """Number of a symbol, defining it first if new."""
+        number = self.__symbols[kind].get(string)
+        if number is None:
+            number = self.__symbols[kind][string] = len(self.__symbols[kind])
+            encoded = string.encode()
+            definitions.append(DEFINITION.pack(b'D', kind, len(encoded))
+                    + encoded)
+        return number
+
+    def write(self, scan, timestamp):
+        """Append one scan.
+
+        The record is written and flushed in one piece, so the log holds
+        every scan as soon as it was received.
+
+        Args:
+            scan (dict): Received advertisements keyed by address with
+                [UUID, major, minor, TX power, RSSI] payloads, as returned by
+                BeaconService.scan.
+            timestamp (datetime.datetime): Scan timestamp.
+        """
+        definitions = []
+        advertisements = [ADVERTISEMENT.pack(
+            self.symbol(ADDRESS, address, definitions),
+            self.symbol(UUID, payload[0], definitions), *payload[1:5])
+            for address, payload in scan.items()]
+        time_ns = int(pi_timeseries.parse_timestamps([timestamp])[0])
+        self.__file.write(b''.join(definitions)
+                + SCAN.pack(b'S', time_ns, len(advertisements))
+                + b''.join(advertisements))
+        self.__file.flush()
+        self.__scans += 1
+
+class RawScanReader(object):
+    """Instantiates a raw scan log reader.
+
+    Attributes:
+        raw_file (pathlib.Path): Raw scan log file.
+        end (int): Offset after the last complete scan record read, where
+            appending resumes.
+    """
+
+    def __init__(self, raw_file):
+        """Instance initialization.
+
+        Args:
+            raw_file (str, pathlib.Path): Raw scan log file.
+
+        Raises:
+            ValueError: Raw scan log must start with the log header.
+        """
+        self.__raw_file = Path(raw_file)
+        with self.__raw_file.open('rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Raw scan log {raw_file} must start with "
+                        "the log header.")
+        self.end = len(MAGIC)
+
+    @property
+    def raw_file(self):
+        """Raw scan log file getter."""
+        return self.__raw_file
+
+    def records(self):
+        """Iterate over complete records.
+
+        The log is read in chunks of READ_SIZE bytes.
+
+        Yields:
+            Tuples of symbol tables (address and UUID lists, extended as
+            definitions are read) and the scan timestamp (int64 ns) and
+            advertisement bytes of each scan.
+        """
+        symbols = ([], [])
+        with self.__raw_file.open('rb') as f:
+            f.seek(len(MAGIC))
+            # Unparsed bytes from position on, starting at file offset base
+            data, position, base = b'', 0, len(MAGIC)
+
+            def fill(size):
+                """Whether size bytes follow position, reading as needed."""
+                nonlocal data, position, base
+                while len(data)-position < size:
+                    chunk = f.read(max(READ_SIZE, size))
+                    if not chunk:
+                        return False
+                    base += position
+                    data, position = data[position:]+chunk, 0
+                return True
+
+            while fill(1):
+                kind = data[position:position+1]
+                if kind == b'D':
+                    if not fill(DEFINITION.size):
+                        break
+                    _, symbol_kind, length = DEFINITION.unpack_from(data,
+                            position)
+                    if not fill(DEFINITION.size+length):
+                        break
+                    start = position+DEFINITION.size
+                    symbols[symbol_kind].append(
+                            data[start:start+length].decode())
+                    position = start+length
+                elif kind == b'S':
+                    if not fill(SCAN.size):
+                        break
+                    _, time_ns, count = SCAN.unpack_from(data, position)
+                    if not fill(SCAN.size+count*ADVERTISEMENT.size):
+                        break
+                    start = position+SCAN.size
+                    position = start+count*ADVERTISEMENT.size
+                    self.end = base+position
+                    yield symbols, time_ns, data[start:position]
+                else:
+                    break
+
+    def symbols(self):
+        """Address and UUID symbol tables up to the last complete scan."""
+        # Definitions after the last complete scan are dropped with it when
+        # appending, so they are left out
+        symbols, counts = ([], []), (0, 0)
+        for symbols, _, _ in self.records():
+            counts = tuple(len(strings) for strings in symbols)
+        return tuple(strings[:count]
+                for strings, count in zip(symbols, counts))
+
+    def scans(self):
+        """Iterate over the logged scans.
+
+        Yields:
+            Tuples of scan dictionary, as returned by BeaconService.scan, and
+            scan timestamp (datetime.datetime).
+        """
+        for (addresses, uuids), time_ns, advertisements in self.records():
+            timestamp = pd.Timestamp(time_ns).to_pydatetime()
+            yield {addresses[address]: [uuids[uuid], major, minor, tx_power,
+                rssi] for address, uuid, major, minor, tx_power, rssi
+                in ADVERTISEMENT.iter_unpack(advertisements)}, timestamp
+
+def parse_args(args):
+    """Input argument parser.
+
+    Args:
+        args (list): Input arguments as taken from command line execution via
+            sys.argv[1:].
+
+    Returns:
+        parsed_args (dict): Parsed input arguments keyed by argument name.
+    """
+    parser = argparse.ArgumentParser(
+            description="Summarize a raw scan log.")
+    parser.add_argument('raw_file', help="Raw scan log file.")
+    return vars(parser.parse_args(args))
+
+def main(args):
+    """Summary of a raw scan log.
+
+    Args:
+        args (list): Arguments as provided by sys.argv.
+    """
+    parsed_args = parse_args(args)
+    reader = RawScanReader(parsed_args['raw_file'])
+    scans, advertisements, first, last = 0, 0, None, None
+    for (addresses, uuids), time_ns, data in reader.records():
+        scans += 1
+        advertisements += len(data)//ADVERTISEMENT.size
+        first = time_ns if first is None else first
+        last = time_ns
+    print(f"{scans} scans, {advertisements} advertisements of "
+            f"{len(addresses) if scans else 0} addresses")
+    if scans:
+        print(f"{pd.Timestamp(first)} to {pd.Timestamp(last)}")
+    if reader.end < os.path.getsize(parsed_args['raw_file']):
+        print(f"Incomplete last record at offset {reader.end}.")
+
+if __name__ == "__main__":
+    """Script execution."""
+    main(sys.argv[1:])
@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Compact in-memory store of received beacon advertisements.
+
+Held as Python objects, every advertisement repeats its 17 character
+address and 36 character UUID strings and boxes each number, costing
+hundreds of bytes per advertisement. The record store instead keeps one
+packed numpy structured array: addresses as 48-bit integers, UUIDs as
+indices into a symbol table of the distinct UUIDs, and MAJOR, MINOR,
+TX POWER, and RSSI in the smallest integer types holding their ranges. The
+array grows geometrically so that appending stays amortized constant time.
+
+Running this module benchmarks the memory of these representations.
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pi_timeseries
+import random
+import sys
+import tracemalloc
+from uuid import UUID
+
+# Universal settings
+INITIAL_CAPACITY = 1024 # Records
+GROWTH = 2 # Capacity growth factor
+COLUMNS = ['ADDRESS', 'TIMESTAMP', 'UUID', 'MAJOR', 'MINOR', 'TX POWER',
+        'RSSI']
+# Packed record layout, 26 bytes without extra columns
+RECORD_FIELDS = [
+    ('ADDRESS', np.uint64),
+    ('TIMESTAMP', np.int64),
+    ('UUID', np.int32),
+    ('MAJOR', np.uint16),
+    ('MINOR', np.uint16),
+    ('TX POWER', np.int8),
+    ('RSSI', np.int8)
+    ]
+
+def encode_address(address):
+    """Beacon address string, e.g., 'AA:BB:CC:DD:EE:FF', as 48-bit integer.
+
+    Raises:
+        ValueError: Beacon address must be six hexadecimal octets.
+    """
+    octets = address.split(':')
+    if len(octets) != 6:
+        raise ValueError(f"Beacon address {address} must be six hexadecimal "
+                "octets.")
+    return int(''.join(octets), 16)
+
+def decode_addresses(addresses):
+    """48-bit integer addresses as 'AA:BB:CC:DD:EE:FF' strings."""
+    return [':'.join(f"{value:012X}"[i:i+2] for i in range(0, 12, 2))
+            for value in addresses.tolist()]
+
+class AdvertisementRecords(object):
+    """Instantiates a compact store of advertisements.
+
+    Attributes:
+        extra_columns (list): Names of additional float columns, e.g.,
+            sensor values attached to each advertisement.
+        uuids (list): Symbol table of distinct UUIDs, indexed by the UUID
+            field of each record.
+    """
+
+    def __init__(self, extra_columns=None, capacity=INITIAL_CAPACITY):
+        """Instance initialization.
+
+        Args:
+            extra_columns (list): Names of additional float columns.
+            capacity (int): Initially allocated records. Defaults to 1024.
+        """
+        self.__extra_columns = list(extra_columns or [])
+        self.__dtype = np.dtype(RECORD_FIELDS
+                + [(name, np.float64) for name in self.__extra_columns])
+        self.__records = np.empty(max(1, capacity), dtype=self.__dtype)
+        self.__size = 0
+        self.__uuids = []
+        self.__uuid_index = {}
+
+    @property
+    def extra_columns(self):
+        """Additional column names getter."""
+        return list(self.__extra_columns)
+
+    @property
+    def uuids(self):
+        """UUID symbol table getter."""
+        return list(self.__uuids)
+
+    @property
+    def records(self):
+        """View of the stored records."""
+        return self.__records[:self.__size]
+
+    @property
+    def nbytes(self):
+        """Bytes held by the records (including unused capacity) and the
+        UUID symbol table."""
+        return self.__records.nbytes+sum(sys.getsizeof(uuid)
+                for uuid in self.__uuids)
+
+    def __len__(self):
+        return self.__size
+
+    def intern(self, uuid):
+        """Symbol table index of a UUID, added if new."""
+        index = self.__uuid_index.get(uuid)
+        if index is None:
+            index = self.__uuid_index[uuid] = len(self.__uuids)
+            self.__uuids.append(uuid)
+        return index
+
+    def reserve(self, count):
+        """Make room for count more records, growing geometrically."""
+        required = self.__size+count
+        if required > len(self.__records):
+            capacity = len(self.__records)
+            while capacity < required:
+                capacity *= GROWTH
+            records = np.empty(capacity, dtype=self.__dtype)
+            records[:self.__size] = self.__records[:self.__size]
+            self.__records = records
+
+    def append_scan(self, scan, timestamp):
+        """Append the advertisements of one scan.
+
+        Args:
+            scan (dict): Received advertisements keyed by address with
+                [UUID, major, minor, TX power, RSSI] payloads, as returned by
+                BeaconService.scan.
+            timestamp (datetime.datetime): Scan timestamp.
+        """
+        self.reserve(len(scan))
+        time_ns = int(pi_timeseries.parse_timestamps([timestamp])[0])
+        for address, payload in scan.items():
+            self.__records[self.__size] = (encode_address(address), time_ns,
+                    self.intern(payload[0]), *payload[1:5],
+                    *[np.nan]*len(self.__extra_columns))
+            self.__size += 1
+
+    def extend(self, advertisements):
+        """Append parsed advertisements.
+
+        Args:
+            advertisements (pandas.DataFrame): Advertisements with the scan
+                file columns and any extra columns, e.g., a processed scan.
+                Missing extra columns are NaN.
+        """
+        count = len(advertisements)
+        if not count:
+            return
+        self.reserve(count)
+        block = self.__records[self.__size:self.__size+count]
+        block['ADDRESS'] = [encode_address(address)
+                for address in advertisements['ADDRESS']]
+        block['TIMESTAMP'] = pi_timeseries.parse_timestamps(
+                advertisements['TIMESTAMP'])
+        block['UUID'] = [self.intern(uuid)
+                for uuid in advertisements['UUID']]
+        for name in ['MAJOR', 'MINOR', 'TX POWER', 'RSSI']:
+            block[name] = advertisements[name].to_numpy()
+        for name in self.__extra_columns:
+            block[name] = advertisements[name].to_numpy() \
+                    if name in advertisements else np.nan
+        self.__size += count
+
+    def to_frame(self):
+        """Stored advertisements in a pandas.DataFrame with scan file columns
+        followed by the extra columns. Addresses are in upper case.
+
+        Packed types are for storage only, integer columns are returned as
+        int64 so that arithmetic on them does not overflow.
+        """
+        records = self.records
+        return pd.DataFrame({
+            'ADDRESS': decode_addresses(records['ADDRESS']),
+            'TIMESTAMP': records['TIMESTAMP'].view('datetime64[ns]'),
+            'UUID': np.asarray(self.__uuids, dtype=object)[records['UUID']],
+            **{name: records[name].astype(np.int64) for name in COLUMNS[3:]},
+            **{name: records[name] for name in self.__extra_columns}
+            }, columns=COLUMNS+self.__extra_columns)
+
+def simulate_scans(rows, beacons, seed=0):
+    """Simulated scans of the given number of beacons.
+
+    Like BeaconService.scan, every scan holds newly created strings, so a
+    representation only pays for the strings it keeps.
+
+    Yields:
+        Tuples of scan and timestamp, totaling rows advertisements.
+    """
+    rng = random.Random(seed)
+    addresses = [':'.join(f"{rng.randrange(256):02X}" for _ in range(6))
+            for _ in range(beacons)]
+    uuids = [str(UUID(int=rng.getrandbits(128)))
+            for _ in range(max(1, beacons//10))]
+    start = datetime(2020, 1, 1)
+    for i in range(-(-rows//beacons)):
+        count = min(beacons, rows-i*beacons)
+        # Copies through bytes so that no string object is shared
+        yield ({addresses[j].encode().decode(): [
+            uuids[j%len(uuids)].encode().decode(), 1, j+1, 1,
+            rng.randint(-90, -30)] for j in range(count)},
+            start+timedelta(seconds=i))
+
+def measure(build):
+    """Memory (bytes) still allocated by build once it returns."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]-before
+    tracemalloc.stop()
+    del result
+    return size
+
+def benchmark(rows=100000, beacons=50):
+    """Compare memory of advertisement representations.
+
+    Compares a list of advertisement dictionaries, the list of per scan
+    DataFrames the scanner used to keep, and AdvertisementRecords.
+
+    Args:
+        rows (int): Number of advertisements.
+        beacons (int): Number of distinct beacons.
+
+    Returns:
+        pandas.DataFrame of total bytes and bytes per advertisement of each
+        representation.
+    """
+    def dicts():
+        advertisements = []
+        for scan, timestamp in simulate_scans(rows, beacons):
+            for address, payload in scan.items():
+                advertisements.append({'ADDRESS': address,
+                    'TIMESTAMP': timestamp, 'UUID': payload[0],
+                    'MAJOR': payload[1], 'MINOR': payload[2],
+                    'TX POWER': payload[3], 'RSSI': payload[4]})
+        return advertisements
+    def frames():
+        return [pd.DataFrame([[address, timestamp, *payload]
+            for address, payload in scan.items()], columns=COLUMNS)
+            for scan, timestamp in simulate_scans(rows, beacons)]
+    def records():
+        store = AdvertisementRecords()
+        for scan, timestamp in simulate_scans(rows, beacons):
+            store.append_scan(scan, timestamp)
+        return store
+    sizes = {name: measure(build) for name, build in [
+        ('list of dicts', dicts), ('list of scan DataFrames', frames),
+        ('AdvertisementRecords', records)]}
+    frame = pd.DataFrame({'BYTES': sizes})
+    frame['BYTES PER ROW'] = frame['BYTES']/rows
+    return frame
+
+def parse_args(args):
+    """Input argument parser.
+
+    Args:
+        args (list): Input arguments as taken from command line execution via
+            sys.argv[1:].
+
+    Returns:
+        parsed_args (dict): Parsed input arguments keyed by argument name.
+    """
+    parser = argparse.ArgumentParser(
+            description="Memory benchmark of advertisement storage.")
+    parser.add_argument('--rows', type=int, default=100000,
+            help="Number of advertisements.")
+    parser.add_argument('--beacons', type=int, default=50,
+            help="Number of distinct beacons.")
+    return vars(parser.parse_args(args))
+
+def main(args):
+    """Advertisement storage memory benchmark.
+
+    Args:
+        args (list): Arguments as provided by sys.argv.
+    """
+    parsed_args = parse_args(args)
+    print(benchmark(parsed_args['rows'], parsed_args['beacons']).to_string())
+
+if __name__ == "__main__":
+    """Script execution."""
+    main(sys.argv[1:])
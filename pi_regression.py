@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Multivariate linear regression of RSSI on environmental factors.
+
+All predictors (e.g., wind, pressure, humidity, temperature) are fitted
+jointly so that each coefficient is the effect of its factor with the others
+held fixed. Several targets (e.g., the RSSI of each Pi) share the design
+matrix and are solved together in a single numpy.linalg.lstsq call.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+INTERCEPT = 'INTERCEPT'
+
+def fit(x, y, terms=None, targets=None):
+    """Ordinary least squares fit of every target on all predictors.
+
+    Rows with a missing value in any predictor or target are dropped so that
+    all targets are fitted over the same rows.
+
+    Args:
+        x (array_like): Predictors with shape (rows, predictors).
+        y (array_like): Targets with shape (rows, targets) or (rows,).
+        terms (list): Predictor names. Defaults to X0, X1, ...
+        targets (list): Target names. Defaults to Y0, Y1, ...
+
+    Returns:
+        Dictionary with 'terms' (INTERCEPT followed by predictor names),
+        'targets', 'coef', 'stderr', 'tvalue', and 'pvalue' arrays with shape
+        (terms, targets), and 'r2', 'adj_r2' arrays with one value per target,
+        and the number of rows 'n'.
+
+    Raises:
+        ValueError: Regression must have more rows than terms.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[:, np.newaxis]
+    if y.ndim == 1:
+        y = y[:, np.newaxis]
+    if terms is None:
+        terms = [f"X{i}" for i in range(x.shape[1])]
+    if targets is None:
+        targets = [f"Y{i}" for i in range(y.shape[1])]
+    rows = np.isfinite(x).all(axis=1) & np.isfinite(y).all(axis=1)
+    if not rows.all():
+        x, y = x[rows], y[rows]
+    n, p = x.shape[0], x.shape[1]+1
+    if n <= p:
+        raise ValueError(f"Regression must have more rows ({n}) than terms "
+                f"({p}).")
+    design = np.empty((n, p))
+    design[:, 0] = 1.0
+    design[:, 1:] = x
+    coef, _, rank, _ = np.linalg.lstsq(design, y, rcond=None)
+    residuals = y-design @ coef
+    ssr = np.einsum('ij,ij->j', residuals, residuals)
+    centered = y-y.mean(axis=0)
+    sst = np.einsum('ij,ij->j', centered, centered)
+    dof = n-rank
+    # Coefficient covariance is sigma^2 (X'X)^-1 with (X'X)^-1 shared by all
+    # targets. Its diagonal is taken from the pseudo-inverse of X itself
+    # rather than inverting X'X, which would square the condition number of
+    # unscaled predictors such as pressure (Pa).
+    unscaled = np.square(np.linalg.pinv(design)).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stderr = np.sqrt(np.outer(unscaled, ssr/dof))
+        tvalue = coef/stderr
+        r2 = 1-ssr/sst
+    return {
+        'terms': [INTERCEPT]+list(terms),
+        'targets': list(targets),
+        'coef': coef,
+        'stderr': stderr,
+        'tvalue': tvalue,
+        'pvalue': 2*stats.t.sf(np.abs(tvalue), dof),
+        'r2': r2,
+        'adj_r2': 1-(1-r2)*(n-1)/dof,
+        'n': n,
+        }
+
+def table(result):
+    """Regression result as a table.
+
+    Args:
+        result (dict): Regression result, see fit.
+
+    Returns:
+        pandas.DataFrame with one row per target and term (TARGET, TERM index)
+        and COEFFICIENT, STD ERROR, T, P, R2, ADJ R2, and N columns. Results
+        with resampling 'significance' (see pi_resampling.significance) add
+        BOOT STD ERROR, CI LOWER, CI UPPER, and PERM P columns.
+    """
+    n_terms, n_targets = len(result['terms']), len(result['targets'])
+    index = pd.MultiIndex.from_product([result['targets'], result['terms']],
+            names=['TARGET', 'TERM'])
+    # Result arrays are (terms, targets), table rows run target-major
+    columns = {
+        'COEFFICIENT': result['coef'].T.ravel(),
+        'STD ERROR': result['stderr'].T.ravel(),
+        'T': result['tvalue'].T.ravel(),
+        'P': result['pvalue'].T.ravel(),
+        'R2': np.repeat(result['r2'], n_terms),
+        'ADJ R2': np.repeat(result['adj_r2'], n_terms),
+        'N': np.full(n_terms*n_targets, result['n']),
+        }
+    if 'significance' in result:
+        significance = result['significance']
+        columns.update({
+            'BOOT STD ERROR': significance['boot_stderr'].T.ravel(),
+            'CI LOWER': significance['ci_lower'].T.ravel(),
+            'CI UPPER': significance['ci_upper'].T.ravel(),
+            'PERM P': significance['perm_pvalue'].T.ravel(),
+            })
+    return pd.DataFrame(columns, index=index)
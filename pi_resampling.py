@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Resampling significance tests for environmental effects on RSSI.
+
+RSSI samples are strongly autocorrelated, so standard errors and p-values
+that assume independent samples are far too optimistic. Resampling whole
+blocks of consecutive rows keeps the dependence within each block intact:
+
+* The moving block bootstrap draws rows in blocks with replacement and
+  refits to obtain confidence intervals of every coefficient.
+* The permutation test shifts the targets circularly against the
+  predictors by at least one block to obtain the null distribution of the
+  coefficients, i.e., of no environmental effect.
+
+Bootstrap resamples are fitted in batches from per-block sums rather than
+resampled rows, and batches are spread over a process pool. Coefficients of
+all circular shifts come from a single FFT cross correlation.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+import os
+
+# Universal settings
+RESAMPLES = 10000
+CONFIDENCE = 0.95
+CHUNK_ELEMENTS = 4000000 # Resampled values held per chunk
+
+def default_block(n):
+    """Default block length, the cube root rule for n rows."""
+    return max(1, int(np.ceil(n**(1/3))))
+
+def standardize(x):
+    """Design matrix of standardized predictors with intercept column.
+
+    Returns:
+        Tuple of design matrix, predictor means, and predictor scales.
+    """
+    mean = x.mean(axis=0)
+    scale = x.std(axis=0)
+    scale[scale == 0] = 1.0
+    design = np.empty((x.shape[0], x.shape[1]+1))
+    design[:, 0] = 1.0
+    design[:, 1:] = (x-mean)/scale
+    return design, mean, scale
+
+def unstandardize(coef, mean, scale):
+    """Coefficients of standardized predictors to original units.
+
+    Args:
+        coef (numpy.ndarray): Coefficients with shape (..., terms, targets).
+        mean (numpy.ndarray): Predictor means.
+        scale (numpy.ndarray): Predictor scales.
+
+    Returns:
+        numpy.ndarray of coefficients in original units.
+    """
+    slopes = coef[..., 1:, :]/scale[:, np.newaxis]
+    intercept = coef[..., :1, :]-np.einsum('...pk,p->...k', slopes,
+            mean)[..., np.newaxis, :]
+    return np.concatenate([intercept, slopes], axis=-2)
+
+def bootstrap_coefficients(design, y, block, count, rng):
+    """Least squares coefficients of moving block bootstrap resamples.
+
+    A resample is the concatenation of whole blocks starting at random rows,
+    enough to make up at least n rows. Its normal equations are sums of the
+    per-row cross products over those blocks. The sum over every possible
+    block is computed once from prefix sums, so each resample costs one
+    lookup per block rather than one per row.
+
+    Args:
+        design (numpy.ndarray): Design matrix with shape (rows, terms).
+        y (numpy.ndarray): Targets with shape (rows, targets).
+        block (int): Block length (rows).
+        count (int): Number of resamples.
+        rng (numpy.random.Generator): Random generator.
+
+    Returns:
+        numpy.ndarray of coefficients with shape (count, terms, targets).
+    """
+    n, p = design.shape
+    k = y.shape[1]
+    # Gram matrices are symmetric, only their upper triangle is summed
+    upper = np.triu_indices(p)
+    products = np.concatenate([design[:, upper[0]]*design[:, upper[1]],
+        (design[:, :, np.newaxis]*y[:, np.newaxis, :]).reshape(n, p*k)],
+        axis=1)
+    prefix = np.zeros((n+1, products.shape[1]))
+    np.cumsum(products, axis=0, out=prefix[1:])
+    block_sums = prefix[block:]-prefix[:-block]
+    del products, prefix
+    blocks = -(-n//block)
+    chunk = max(1, CHUNK_ELEMENTS//(blocks*block_sums.shape[1]))
+    coefficients = []
+    for start in range(0, count, chunk):
+        size = min(chunk, count-start)
+        starts = rng.integers(0, n-block+1, size=(size, blocks))
+        sums = block_sums[starts].sum(axis=1)
+        gram = np.empty((size, p, p))
+        gram[:, upper[0], upper[1]] = sums[:, :upper[0].size]
+        gram[:, upper[1], upper[0]] = sums[:, :upper[0].size]
+        moment = sums[:, upper[0].size:].reshape(size, p, k)
+        # Degenerate resamples (e.g., constant predictor) fall back on pinv
+        coefficients.append(np.linalg.pinv(gram) @ moment)
+    return np.concatenate(coefficients)
+
+def permutation_coefficients(design, y, block, count, rng):
+    """Least squares coefficients of circularly shifted targets.
+
+    Shifting the targets circularly against the fixed design by at least
+    one block in either direction breaks any alignment between them while
+    keeping the autocorrelation of both intact. Coefficients are linear in
+    the targets, so those of every shift at once are the circular cross
+    correlations of the design pseudo-inverse with the targets, computed
+    with FFTs.
+
+    Args:
+        design (numpy.ndarray): Design matrix with shape (rows, terms).
+        y (numpy.ndarray): Targets with shape (rows, targets).
+        block (int): Smallest shift (rows).
+        count (int): Number of shifts, all allowed shifts when there are no
+            more than count of them.
+        rng (numpy.random.Generator): Random generator.
+
+    Returns:
+        numpy.ndarray of coefficients with shape (shifts, terms, targets).
+    """
+    n = design.shape[0]
+    solver = np.linalg.pinv(design)
+    # Entry s is solver @ numpy.roll(y, s)
+    shifted = np.fft.irfft(np.fft.rfft(solver, axis=1)[:, np.newaxis, :]
+            * np.conj(np.fft.rfft(y.T, axis=1))[np.newaxis], n, axis=2)
+    shifts = np.arange(block, n-block+1)
+    if not shifts.size:
+        shifts = np.arange(1, n)
+    if count < shifts.size:
+        shifts = rng.choice(shifts, count, replace=False)
+    return shifted[:, :, shifts].transpose(2, 0, 1)
+
+def resample_coefficients(method, x, y, block, count, seed):
+    """Least squares coefficients of a batch of resamples.
+
+    Module level so that it can run in a worker process.
+
+    Args:
+        method (str): One of 'bootstrap' or 'permutation'.
+        x (numpy.ndarray): Predictors with shape (rows, predictors).
+        y (numpy.ndarray): Targets with shape (rows, targets).
+        block (int): Block length (rows).
+        count (int): Number of resamples.
+        seed (numpy.random.SeedSequence): Seed of this batch.
+
+    Returns:
+        numpy.ndarray of coefficients with shape (count, terms, targets),
+        intercept first.
+    """
+    rng = np.random.default_rng(seed)
+    design, mean, scale = standardize(x)
+    if method == 'bootstrap':
+        coefficients = bootstrap_coefficients(design, y, block, count, rng)
+    else:
+        coefficients = permutation_coefficients(design, y, block, count, rng)
+    return unstandardize(coefficients, mean, scale)
+
+def resample(method, x, y, block=None, resamples=RESAMPLES, workers=None,
+        seed=None):
+    """Coefficients of many resamples spread over a process pool.
+
+    Args:
+        method (str): One of 'bootstrap' or 'permutation'.
+        x (array_like): Predictors with shape (rows, predictors) or (rows,).
+        y (array_like): Targets with shape (rows, targets) or (rows,).
+        block (int): Block length (rows). Defaults to the cube root of the
+            number of rows.
+        resamples (int): Number of resamples. Defaults to 10000.
+        workers (int): Number of bootstrap processes, 1 runs in this
+            process. Defaults to the number of CPUs. Permutations always run
+            in this process.
+        seed (int, numpy.random.SeedSequence): Random seed. Defaults to
+            unseeded.
+
+    Returns:
+        numpy.ndarray of coefficients with shape (resamples, terms, targets),
+        intercept first. Permutations return every allowed shift instead
+        when there are fewer than resamples.
+
+    Raises:
+        ValueError: Resampling method must be bootstrap or permutation.
+    """
+    if method not in ('bootstrap', 'permutation'):
+        raise ValueError("Resampling method must be one of bootstrap or "
+                "permutation.")
+    x, y = prepare(x, y)
+    if block is None:
+        block = default_block(x.shape[0])
+    block = min(block, x.shape[0])
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    # All shifts come from one FFT, so only the bootstrap is split up
+    if method == 'permutation':
+        workers = 1
+    elif workers is None:
+        workers = os.cpu_count() or 1
+    counts = [len(part) for part in np.array_split(np.arange(resamples),
+        workers) if len(part)]
+    seeds = seed.spawn(len(counts))
+    if len(counts) == 1:
+        return resample_coefficients(method, x, y, block, counts[0], seeds[0])
+    # Spawned rather than forked workers, as callers such as the analysis
+    # pipeline run this from threads
+    with ProcessPoolExecutor(max_workers=len(counts),
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        parts = executor.map(resample_coefficients, [method]*len(counts),
+                [x]*len(counts), [y]*len(counts), [block]*len(counts),
+                counts, seeds)
+        return np.concatenate(list(parts))
+
+def prepare(x, y):
+    """Two dimensional float predictors and targets without missing rows."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[:, np.newaxis]
+    if y.ndim == 1:
+        y = y[:, np.newaxis]
+    rows = np.isfinite(x).all(axis=1) & np.isfinite(y).all(axis=1)
+    if not rows.all():
+        x, y = x[rows], y[rows]
+    return x, y
+
+def significance(x, y, block=None, resamples=RESAMPLES,
+        confidence=CONFIDENCE, workers=None, seed=None):
+    """Block bootstrap confidence intervals and permutation p-values.
+
+    Rows must be in time order for blocks to hold consecutive samples.
+
+    Args:
+        x (array_like): Predictors with shape (rows, predictors) or (rows,).
+        y (array_like): Targets with shape (rows, targets) or (rows,).
+        block (int): Block length (rows). Defaults to the cube root of the
+            number of rows; should exceed the RSSI autocorrelation length.
+        resamples (int): Number of resamples of each test. Defaults to
+            10000.
+        confidence (float): Confidence interval level. Defaults to 0.95.
+        workers (int): Number of bootstrap processes. Defaults to the number
+            of CPUs.
+        seed (int): Random seed. Defaults to unseeded.
+
+    Returns:
+        Dictionary with 'block' and, with shape (terms, targets) and
+        intercept first, 'boot_stderr' (bootstrap standard deviation),
+        'ci_lower' and 'ci_upper' (percentile interval), and 'perm_pvalue'
+        (two-sided permutation p-value; as the targets are shifted against
+        all predictors together, each slope is tested against the joint
+        null of no environmental effect, and the intercept is NaN).
+    """
+    x, y = prepare(x, y)
+    if block is None:
+        block = default_block(x.shape[0])
+    seeds = np.random.SeedSequence(seed).spawn(2)
+    bootstrap = resample('bootstrap', x, y, block, resamples, workers,
+            seeds[0])
+    permutation = resample('permutation', x, y, block, resamples, workers,
+            seeds[1])
+    design, mean, scale = standardize(x)
+    observed = unstandardize(np.linalg.lstsq(design, y, rcond=None)[0],
+            mean, scale)
+    # Deviations from the null mean are compared, the intercept has no
+    # meaningful permutation null
+    centered = permutation-permutation.mean(axis=0)
+    exceed = (np.abs(centered) >= np.abs(observed-permutation.mean(axis=0)))
+    pvalue = (1+exceed.sum(axis=0))/(1+len(permutation))
+    pvalue[0] = np.nan
+    alpha = (1-confidence)/2
+    lower, upper = np.quantile(bootstrap, [alpha, 1-alpha], axis=0)
+    return {'block': int(block), 'boot_stderr': bootstrap.std(axis=0),
+            'ci_lower': lower, 'ci_upper': upper, 'perm_pvalue': pvalue}
@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Environmental sensor sampling for the beacon scanner.
+
+A sensor source reads one set of environmental values (e.g., pressure,
+humidity, temperature) on request. Each configured source is sampled by a
+background thread at its own period, and the scanner attaches the reading
+nearest in time to every received advertisement as it is written, so that
+scan files already contain the environmental columns used by the analyses.
+
+Sources are pluggable: any class derived from SensorSource can be named in
+the scanner configuration by its import path, e.g., 'my_sensors.BME280'.
+A simulated source allows testing without hardware.
+"""
+
+import abc
+from datetime import datetime
+import importlib
+import numpy as np
+import pi_dataset
+import pi_timeseries
+import threading
+import time
+
+# Universal settings
+MAX_READINGS = 100000 # Readings retained per sampler
+
+class SensorSource(abc.ABC):
+    """Interface of an environmental sensor source.
+
+    Derived classes set columns and must implement read, a source without
+    it fails when constructed. Keyword options given in the sensor
+    configuration are passed to the constructor.
+
+    Attributes:
+        columns (list): Names of the values returned by read, used as scan
+            file columns.
+    """
+
+    columns = []
+
+    @abc.abstractmethod
+    def read(self):
+        """Read current sensor values.
+
+        Returns:
+            Sequence of values in columns order.
+        """
+
+    def close(self):
+        """Release sensor hardware."""
+        pass
+
+class SimulatedSensor(SensorSource):
+    """Simulated pressure, humidity, and temperature sensor.
+
+    Values follow independent bounded random walks about their baselines.
+    """
+
+    columns = ['PRESSURE', 'HUMIDITY', 'TEMP']
+
+    def __init__(self, pressure=101325.0, humidity=50.0, temp=25.0,
+            step=0.01, seed=None):
+        """Instance initialization.
+
+        Args:
+            pressure (float): Baseline pressure (Pa). Defaults to 101325.
+            humidity (float): Baseline relative humidity (%). Defaults to 50.
+            temp (float): Baseline temperature (C). Defaults to 25.
+            step (float): Random walk step as a fraction of the baseline.
+                Defaults to 0.01.
+            seed (int): Random seed. Defaults to unseeded.
+        """
+        self.__baseline = np.array([pressure, humidity, temp], dtype=float)
+        self.__step = step
+        self.__values = self.__baseline.copy()
+        self.__rng = np.random.default_rng(seed)
+
+    def read(self):
+        """Read current simulated values."""
+        self.__values += self.__step*self.__baseline*self.__rng.normal(
+                size=self.__values.size)
+        # Pull back toward baseline so values stay plausible
+        self.__values += 0.1*(self.__baseline-self.__values)
+        return self.__values.tolist()
+
+# Sensor sources available by short name
+SENSOR_SOURCES = {
+    'simulated': SimulatedSensor
+    }
+
+def create_source(name, options=None):
+    """Instantiate a sensor source.
+
+    Args:
+        name (str): Short name in SENSOR_SOURCES or import path of a
+            SensorSource class, e.g., 'my_sensors.BME280'.
+        options (dict): Keyword arguments of the source constructor.
+
+    Returns:
+        SensorSource instance.
+
+    Raises:
+        KeyError: Sensor source must be a known name or import path.
+        TypeError: Sensor source must derive from SensorSource.
+    """
+    if name in SENSOR_SOURCES:
+        source_class = SENSOR_SOURCES[name]
+    else:
+        module_name, _, class_name = name.rpartition('.')
+        try:
+            source_class = getattr(importlib.import_module(module_name),
+                    class_name)
+        except (ValueError, ImportError, AttributeError):
+            raise KeyError(f"Sensor source {name} must be one of "
+                    f"{list(SENSOR_SOURCES)} or an importable class path.")
+    if not (isinstance(source_class, type)
+            and issubclass(source_class, SensorSource)):
+        raise TypeError(f"Sensor source {name} must derive from "
+                "SensorSource.")
+    return source_class(**(options or {}))
+
+class SensorSampler(object):
+    """Samples a sensor source in a background thread.
+
+    Attributes:
+        source (SensorSource): Sampled sensor source.
+        period (float): Sampling period (s). Must be strictly positive.
+        columns (list): Column names of the source.
+    """
+
+    def __init__(self, logger, source, period=1.0):
+        """Instance initialization.
+
+        Args:
+            logger (logging.Logger): Configured logger.
+            source (SensorSource): Sensor source to sample.
+            period (float, int): Sampling period (s). Defaults to 1.
+
+        Raises:
+            TypeError: Sensor sampling period must be a float or integer.
+            ValueError: Sensor sampling period must be strictly positive.
+        """
+        if not isinstance(period, (float, int)):
+            raise TypeError("Sensor sampling period must be a float or "
+                    "integer.")
+        elif period <= 0:
+            raise ValueError("Sensor sampling period must be strictly "
+                    "positive.")
+        self.__logger = logger
+        self.__source = source
+        self.__period = period
+        self.__times = []
+        self.__values = []
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    @property
+    def source(self):
+        """Sensor source getter."""
+        return self.__source
+
+    @property
+    def period(self):
+        """Sampling period getter."""
+        return self.__period
+
+    @property
+    def columns(self):
+        """Sensor column names getter."""
+        return list(self.__source.columns)
+
+    def start(self):
+        """Start sampling in a background thread."""
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.run, daemon=True)
+        self.__thread.start()
+        self.__logger.info(f"Started sampling {type(self.__source).__name__} "
+                f"every {self.__period} s.")
+
+    def stop(self):
+        """Stop sampling and release the sensor."""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.__source.close()
+
+    def run(self):
+        """Sampling loop, reads the source once per period until stopped."""
+        # Wait is measured from the scheduled time so the rate does not slip
+        # by the time each read takes
+        next_time = time.monotonic()
+        while not self.__stop.is_set():
+            try:
+                values = self.__source.read()
+                timestamp = datetime.now()
+                with self.__lock:
+                    self.__times.append(timestamp)
+                    self.__values.append(values)
+                    if len(self.__times) > MAX_READINGS:
+                        del self.__times[:len(self.__times)-MAX_READINGS]
+                        del self.__values[:len(self.__values)-MAX_READINGS]
+            except Exception as e:
+                self.__logger.warning(f"Sensor read failed: {e}")
+            next_time += self.__period
+            self.__stop.wait(max(0.0, next_time-time.monotonic()))
+
+    def nearest(self, timestamps, tolerance):
+        """Sensor values nearest in time to each timestamp.
+
+        Readings older than the earliest timestamp less tolerance can no
+        longer be matched by later scans and are discarded.
+
+        Args:
+            timestamps (array_like): Advertisement timestamps.
+            tolerance (float): Largest allowable time difference (s).
+
+        Returns:
+            Dictionary of column name to numpy.ndarray of values aligned with
+            timestamps, NaN where no reading is within tolerance.
+        """
+        left = pi_timeseries.parse_timestamps(timestamps) \
+                if len(timestamps) else np.empty(0, dtype=np.int64)
+        tolerance_ns = int(round(tolerance*pi_timeseries.NS_PER_S))
+        # Stale readings are found and deleted under the same lock, so the
+        # sampler thread cannot trim the readings in between
+        with self.__lock:
+            times = pi_timeseries.parse_timestamps(self.__times) \
+                    if self.__times else np.empty(0, dtype=np.int64)
+            values = np.array(self.__values, dtype=float).reshape(
+                    len(self.__values), len(self.__source.columns))
+            if left.size:
+                stale = int(np.searchsorted(times, left.min()-tolerance_ns))
+                del self.__times[:stale]
+                del self.__values[:stale]
+        indices = pi_dataset.nearest_indices(left, times, tolerance_ns)
+        matched = np.full((left.size, values.shape[1]), np.nan)
+        found = indices >= 0
+        matched[found] = values[indices[found]]
+        return {column: matched[:, i]
+                for i, column in enumerate(self.__source.columns)}
@@ -0,0 +1,309 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Streaming and grouped statistics for piPACT scan data.
+
+Single-pass, bounded memory statistics over scan CSV files. Files are read in
+fixed size chunks so that scan files larger than available memory can still
+be summarized. RSSI values are small signed integers so they are accumulated
+into an exact fixed-bin histogram from which quantiles and box plot
+statistics are derived without retaining the raw values.
+
+Grouped statistics (e.g., RSSI per distance or per environmental
+measurement) are computed with sort-based numpy operations shared by all
+plotting and analysis tools.
+"""
+
+import numpy as np
+import pandas as pd
+import pi_compress
+
+# Universal settings
+CHUNK_SIZE = 100000 # (rows)
+RSSI_LIMITS = [-128, 127] # (dBm)
+WHISKER_SCALE = 1.5 # (IQR)
+
+class RunningStats(object):
+    """Single-pass mean and variance accumulator.
+
+    Chunks are merged using the pairwise update of Chan et al. so that the
+    result is numerically stable and independent of the chunk size.
+
+    Attributes:
+        count (int): Number of values accumulated.
+        mean (float): Mean of values accumulated.
+        variance (float): Population variance of values accumulated.
+        std (float): Population standard deviation of values accumulated.
+        min (float): Minimum of values accumulated.
+        max (float): Maximum of values accumulated.
+    """
+
+    def __init__(self):
+        """Instance initialization."""
+        self.__count = 0
+        self.__mean = 0.0
+        self.__m2 = 0.0
+        self.__min = np.inf
+        self.__max = -np.inf
+
+    @property
+    def count(self):
+        """Accumulated value count getter."""
+        return self.__count
+
+    @property
+    def mean(self):
+        """Accumulated mean getter."""
+        return self.__mean if self.__count else np.nan
+
+    @property
+    def variance(self):
+        """Accumulated population variance getter."""
+        return self.__m2/self.__count if self.__count else np.nan
+
+    @property
+    def std(self):
+        """Accumulated population standard deviation getter."""
+        return np.sqrt(self.variance)
+
+    @property
+    def min(self):
+        """Accumulated minimum getter."""
+        return self.__min if self.__count else np.nan
+
+    @property
+    def max(self):
+        """Accumulated maximum getter."""
+        return self.__max if self.__count else np.nan
+
+    def update(self, values):
+        """Accumulate a chunk of values.
+
+        Args:
+            values (array_like): Values to accumulate.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        count = values.size
+        if count == 0:
+            return
+        mean = values.mean()
+        m2 = np.square(values-mean).sum()
+        total = self.__count+count
+        delta = mean-self.__mean
+        self.__mean += delta*count/total
+        self.__m2 += m2+delta**2*self.__count*count/total
+        self.__count = total
+        self.__min = min(self.__min, values.min())
+        self.__max = max(self.__max, values.max())
+
+class RSSIHistogram(object):
+    """Exact integer RSSI histogram with fixed bins.
+
+    Attributes:
+        limits (list): Inclusive [lower, upper] RSSI bin limits (dBm).
+        count (int): Number of values accumulated.
+        mean (float): Mean of values accumulated.
+    """
+
+    def __init__(self, limits=RSSI_LIMITS):
+        """Instance initialization.
+
+        Args:
+            limits (list): Inclusive [lower, upper] RSSI bin limits (dBm).
+                Defaults to the signed 8-bit range.
+        """
+        self.__limits = list(limits)
+        self.__counts = np.zeros(limits[1]-limits[0]+1, dtype=np.int64)
+
+    @property
+    def limits(self):
+        """RSSI bin limits getter."""
+        return self.__limits
+
+    @property
+    def count(self):
+        """Accumulated value count getter."""
+        return int(self.__counts.sum())
+
+    @property
+    def mean(self):
+        """Accumulated mean getter."""
+        values, counts = self.nonzero()
+        if not counts.size:
+            return np.nan
+        return float(np.dot(values, counts)/counts.sum())
+
+    def update(self, values):
+        """Accumulate a chunk of RSSI values.
+
+        Args:
+            values (array_like): Integer RSSI values (dBm).
+
+        Raises:
+            ValueError: RSSI values must be integers.
+            ValueError: RSSI values must be within histogram limits.
+        """
+        values = np.asarray(values)
+        if values.size == 0:
+            return
+        if values.dtype.kind == 'f':
+            if not np.array_equal(values, np.rint(values)):
+                raise ValueError("RSSI values must be integers.")
+        values = values.astype(np.int64)
+        if values.min() < self.__limits[0] or values.max() > self.__limits[1]:
+            raise ValueError("RSSI values must be within histogram limits "
+                    f"{self.__limits}.")
+        self.__counts += np.bincount(values-self.__limits[0],
+                minlength=self.__counts.size)
+
+    def nonzero(self):
+        """Occupied histogram bins.
+
+        Returns:
+            Tuple of RSSI values and their counts for all non-empty bins in
+            ascending RSSI order.
+        """
+        bins = np.flatnonzero(self.__counts)
+        return bins+self.__limits[0], self.__counts[bins]
+
+    def quantile(self, q):
+        """Exact quantile of accumulated values.
+
+        Uses the same linear interpolation between order statistics as
+        numpy.quantile so results match those over the raw values.
+
+        Args:
+            q (float, array_like): Quantile(s) in [0, 1].
+
+        Returns:
+            Quantile value(s) (dBm).
+        """
+        values, counts = self.nonzero()
+        if not counts.size:
+            return np.full(np.shape(q), np.nan)[()]
+        cumulative = np.cumsum(counts)
+        position = np.asarray(q, dtype=np.float64)*(cumulative[-1]-1)
+        lower = np.floor(position)
+        # Order statistic k lies in first bin whose cumulative count exceeds k
+        lower_value = values[np.searchsorted(cumulative, lower, side='right')]
+        upper_value = values[np.searchsorted(cumulative,
+            np.minimum(lower+1, cumulative[-1]-1), side='right')]
+        return (lower_value+(position-lower)*(upper_value-lower_value))[()]
+
+    def box_stats(self, whis=WHISKER_SCALE, label=None):
+        """Box plot statistics of accumulated values.
+
+        Args:
+            whis (float): Whisker reach as a multiple of the interquartile
+                range. Defaults to 1.5.
+            label (str): Box label.
+
+        Returns:
+            Dictionary of statistics accepted by matplotlib Axes.bxp. Fliers
+            are reported once per distinct RSSI value.
+
+        Raises:
+            ValueError: Box plot statistics require accumulated values.
+        """
+        values, counts = self.nonzero()
+        if not counts.size:
+            raise ValueError("Box plot statistics require accumulated RSSI "
+                    "values.")
+        q1, med, q3 = self.quantile([0.25, 0.5, 0.75])
+        iqr = q3-q1
+        inside = (values >= q1-whis*iqr) & (values <= q3+whis*iqr)
+        return {
+            'label': label,
+            'mean': self.mean,
+            'med': med,
+            'q1': q1,
+            'q3': q3,
+            'iqr': iqr,
+            'whislo': values[inside].min(),
+            'whishi': values[inside].max(),
+            'fliers': values[~inside],
+            }
+
+def stream_column(file_path, column, chunk_size=CHUNK_SIZE):
+    """Read a single column of a CSV file in chunks.
+
+    Args:
+        file_path (str, pathlib.Path): CSV file path.
+        column (str): Column header to read.
+        chunk_size (int): Number of rows per chunk. Defaults to 100000.
+
+    Yields:
+        numpy.ndarray of column values for each chunk.
+    """
+    with pi_compress.open_scan(file_path) as f, pd.read_csv(f,
+            usecols=[column], chunksize=chunk_size) as reader:
+        for chunk in reader:
+            yield chunk[column].to_numpy()
+
+def scan_summary(file_path, column='RSSI', chunk_size=CHUNK_SIZE):
+    """Single-pass summary of an RSSI column of a scan file.
+
+    Args:
+        file_path (str, pathlib.Path): Scan CSV file path.
+        column (str): RSSI column header. Defaults to 'RSSI'.
+        chunk_size (int): Number of rows per chunk. Defaults to 100000.
+
+    Returns:
+        Tuple of RunningStats and RSSIHistogram accumulated over the column.
+    """
+    running = RunningStats()
+    histogram = RSSIHistogram()
+    for values in stream_column(file_path, column, chunk_size):
+        running.update(values)
+        histogram.update(values)
+    return running, histogram
+
+def group_stats(keys, values, quantiles=()):
+    """Grouped statistics of values by key in one sort-based pass.
+
+    Values are sorted once by key (and by value within each key when
+    quantiles are requested). Group boundaries then come from comparing
+    adjacent sorted keys and per-group sums from numpy.add.reduceat, so no
+    Python level loop runs over values or groups.
+
+    Args:
+        keys (array_like): Group key of each value, e.g., distance or an
+            environmental measurement.
+        values (array_like): Values to aggregate, e.g., RSSI.
+        quantiles (sequence): Quantiles in [0, 1] to compute per group using
+            the same interpolation as numpy.quantile. Defaults to none.
+
+    Returns:
+        Dictionary with 'keys' (sorted unique keys), 'mean', 'std'
+        (population), and 'count' arrays aligned with 'keys', and
+        'quantiles' array with one row per requested quantile.
+    """
+    keys = np.asarray(keys)
+    values = np.asarray(values, dtype=np.float64)
+    if quantiles:
+        order = np.lexsort((values, keys))
+    else:
+        order = np.argsort(keys)
+    sorted_keys = keys[order]
+    sorted_values = values[order]
+    if not sorted_keys.size:
+        empty = np.empty(0)
+        return {'keys': sorted_keys, 'mean': empty, 'std': empty,
+                'count': np.empty(0, dtype=np.int64),
+                'quantiles': np.empty((len(quantiles), 0))}
+    # Group boundaries are where adjacent sorted keys differ
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    counts = np.diff(np.r_[starts, sorted_keys.size])
+    unique_keys = sorted_keys[starts]
+    mean = np.add.reduceat(sorted_values, starts)/counts
+    deviation = sorted_values-np.repeat(mean, counts)
+    std = np.sqrt(np.add.reduceat(deviation**2, starts)/counts)
+    # Linear interpolation between order statistics within each group
+    position = starts+np.outer(np.asarray(quantiles, dtype=np.float64),
+            counts-1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower+1, starts+counts-1)
+    fraction = position-lower
+    group_quantiles = (sorted_values[lower]
+            + fraction*(sorted_values[upper]-sorted_values[lower]))
+    return {'keys': unique_keys, 'mean': mean, 'std': std, 'count': counts,
+            'quantiles': group_quantiles}
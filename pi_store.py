@@ -0,0 +1,338 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Partitioned columnar store of collected experiment files.
+
+A folder tree of scan and sensor CSV files is ingested into one store that is
+partitioned by experiment, variable, and node. Each partition directory
+holds one typed numpy file per column: numbers keep their numeric type,
+timestamps become datetime64[ns], and text (e.g., addresses and UUIDs) is
+dictionary encoded into integer codes. A JSON catalog at the store root
+records every partition's source files, row count, and column types so that
+an analysis can select and memory map exactly the partitions it needs.
+"""
+
+import argparse
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+from pathlib import Path
+import pi_compress
+import pi_dataset
+import pi_timeseries
+import re
+import shutil
+import sys
+import warnings
+
+# Universal settings
+CATALOG_FILE = "catalog.json"
+PARTITION_KEYS = ['experiment', 'variable', 'node']
+# Matches e.g. Pressure/pres_pi1_1.csv as variable Pressure, node pi1, and
+# experiment 1
+DEFAULT_PATTERN = (r"(?:.*/)?(?P<variable>[^/]+)/[^/_]+_(?P<node>[^/_]+)_"
+        r"(?P<experiment>[^/_]+)\.csv")
+
+class DatasetStore(object):
+    """Instantiates a partitioned columnar dataset store.
+
+    Attributes:
+        store_dir (pathlib.Path): Store root directory.
+        catalog (dict): Partition metadata keyed by partition path relative
+            to the store root.
+    """
+
+    def __init__(self, store_dir, logger=None):
+        """Instance initialization.
+
+        Args:
+            store_dir (str, pathlib.Path): Store root directory, created if
+                it does not exist.
+            logger (logging.Logger): Configured logger. Defaults to the
+                module logger.
+        """
+        self.__logger = logger or logging.getLogger(__name__)
+        self.__store_dir = Path(store_dir)
+        self.__store_dir.mkdir(parents=True, exist_ok=True)
+        catalog_file = self.__store_dir / CATALOG_FILE
+        if catalog_file.exists():
+            with catalog_file.open('r') as f:
+                self.__catalog = json.load(f)
+        else:
+            self.__catalog = {}
+
+    @property
+    def store_dir(self):
+        """Store root directory getter."""
+        return self.__store_dir
+
+    @property
+    def catalog(self):
+        """Partition catalog getter."""
+        return self.__catalog
+
+    def ingest(self, source_dir, pattern=DEFAULT_PATTERN):
+        """Convert a folder tree of CSV files into store partitions.
+
+        Files are assigned to partitions by matching their path relative to
+        source_dir against pattern, whose named groups experiment, variable,
+        and node give the partition. Files of the same partition are
+        concatenated in path order. Partitions whose source files are
+        unchanged since the last ingest are skipped.
+
+        Args:
+            source_dir (str, pathlib.Path): Root of the CSV folder tree,
+                plain or block compressed (.csv.gz).
+            pattern (str): Regular expression with named groups experiment,
+                variable, and node. Defaults to <variable>/<prefix>_<node>_
+                <experiment>.csv.
+
+        Returns:
+            List of partition paths written.
+
+        Raises:
+            ValueError: Partition pattern must name experiment, variable, and
+                node groups.
+        """
+        regex = re.compile(pattern)
+        if set(PARTITION_KEYS)-set(regex.groupindex):
+            raise ValueError("Partition pattern must name groups "
+                    f"{PARTITION_KEYS}.")
+        source_dir = Path(source_dir)
+        partitions = {}
+        for file_path in sorted([*source_dir.rglob("*.csv"),
+                *source_dir.rglob("*.csv"+pi_compress.SUFFIX)]):
+            relative = file_path.relative_to(source_dir).as_posix()
+            # Block compressed files match the pattern of their CSV name
+            match = regex.fullmatch(relative[:-len(pi_compress.SUFFIX)]
+                    if pi_compress.is_compressed(relative) else relative)
+            if match is None:
+                self.__logger.info(f"Skipping {relative}, does not match "
+                        "partition pattern.")
+                continue
+            key = tuple(match.group(name) for name in PARTITION_KEYS)
+            partitions.setdefault(key, []).append(file_path)
+        written = []
+        for key, files in partitions.items():
+            path = "/".join(f"{name}={value}"
+                    for name, value in zip(PARTITION_KEYS, key))
+            sources = [self.file_fingerprint(file_path, source_dir)
+                    for file_path in files]
+            if self.__catalog.get(path, {}).get('sources') == sources:
+                self.__logger.debug(f"Partition {path} is up to date.")
+                continue
+            frame = pd.concat([pi_compress.read_scan(file_path)
+                for file_path in files],
+                    ignore_index=True)
+            self.__catalog[path] = {**dict(zip(PARTITION_KEYS, key)),
+                    'sources': sources, 'rows': len(frame),
+                    'columns': self.write_columns(path, frame)}
+            self.__logger.info(f"Ingested {len(files)} files into partition "
+                    f"{path}, {len(frame)} rows.")
+            written.append(path)
+        if written:
+            self.write_catalog()
+        return written
+
+    @staticmethod
+    def file_fingerprint(file_path, source_dir):
+        """Identity of a source file's current contents."""
+        status = os.stat(file_path)
+        return [Path(file_path).relative_to(source_dir).as_posix(),
+                status.st_size, status.st_mtime_ns]
+
+    def write_columns(self, path, frame):
+        """Write each column of a partition as a typed numpy file.
+
+        Args:
+            path (str): Partition path relative to the store root.
+            frame (pandas.DataFrame): Partition rows.
+
+        Returns:
+            Dictionary of column name to column metadata with 'file', 'kind'
+            (one of 'numeric', 'timestamp', or 'category'), 'dtype', and for
+            categories their 'categories'.
+        """
+        partition_dir = self.__store_dir / path
+        # Column files of a previous ingest with more columns must not linger
+        if partition_dir.exists():
+            shutil.rmtree(partition_dir)
+        partition_dir.mkdir(parents=True)
+        columns = {}
+        for i, (name, values) in enumerate(frame.items()):
+            meta = {'file': f"column_{i}.npy"}
+            if values.dtype.kind in 'biuf':
+                meta['kind'] = 'numeric'
+                array = values.to_numpy()
+            else:
+                array = self.timestamp_array(values)
+                if array is not None:
+                    meta['kind'] = 'timestamp'
+                else:
+                    meta['kind'] = 'category'
+                    codes, categories = pd.factorize(values.astype(str))
+                    meta['categories'] = categories.tolist()
+                    array = codes.astype(np.int32)
+            meta['dtype'] = str(array.dtype)
+            np.save(partition_dir / meta['file'], array)
+            columns[name] = meta
+        return columns
+
+    @staticmethod
+    def timestamp_array(values):
+        """Column as datetime64[ns] if all values are timestamps else None."""
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                # Reject text columns on their first value before parsing all
+                pi_timeseries.parse_timestamps(values.iloc[:1])
+                parsed = pi_timeseries.parse_timestamps(values)
+        except (ValueError, TypeError, OverflowError):
+            return None
+        return parsed.view('datetime64[ns]')
+
+    @staticmethod
+    def partition_order(meta):
+        """Sort key of a partition, numeric values ordered numerically.
+
+        Args:
+            meta (dict): Partition metadata with PARTITION_KEYS values.
+
+        Returns:
+            Tuple per partition key of numbers before text, e.g.,
+            experiment=2 before experiment=10.
+        """
+        order = []
+        for key in PARTITION_KEYS:
+            try:
+                order.append((0, float(meta[key]), meta[key]))
+            except ValueError:
+                order.append((1, 0.0, meta[key]))
+        return tuple(order)
+
+    def write_catalog(self):
+        """Write the catalog, replacing the previous one atomically."""
+        catalog_file = self.__store_dir / CATALOG_FILE
+        temp_file = catalog_file.with_suffix(".tmp")
+        with temp_file.open('w') as f:
+            json.dump(self.__catalog, f, indent=2)
+        os.replace(temp_file, catalog_file)
+
+    def partitions(self, **selectors):
+        """Partition paths matching all selectors in partition order.
+
+        Partitions are ordered by experiment, variable, and node, see
+        partition_order.
+
+        Args:
+            **selectors: Partition key (experiment, variable, or node) to a
+                value or list of values to select. Unspecified keys match
+                every partition.
+
+        Returns:
+            List of partition paths.
+
+        Raises:
+            KeyError: Selectors must be partition keys.
+        """
+        unknown = set(selectors)-set(PARTITION_KEYS)
+        if unknown:
+            raise KeyError(f"Selectors {sorted(unknown)} must be one of "
+                    f"partition keys {PARTITION_KEYS}.")
+        selected = {key: {str(value)} if not isinstance(value, (list, tuple))
+                else {str(v) for v in value}
+                for key, value in selectors.items()}
+        return [path for path, meta in sorted(self.__catalog.items(),
+                key=lambda item: self.partition_order(item[1]))
+                if all(meta[key] in values for key, values in selected.items())]
+
+    def load(self, columns=None, **selectors):
+        """Load columns of all matching partitions in one call.
+
+        Column files are memory mapped, so only the pages actually used are
+        read. A single matching partition is returned without copying;
+        several are concatenated in partition order. Category columns are
+        decoded back to strings.
+
+        Args:
+            columns (list): Column names to load. Defaults to all columns of
+                the first matching partition.
+            **selectors: Partition selectors, see partitions.
+
+        Returns:
+            pi_dataset.AlignedColumns of the requested columns.
+
+        Raises:
+            KeyError: At least one partition must match the selectors.
+            KeyError: Requested columns must exist in every partition.
+        """
+        paths = self.partitions(**selectors)
+        if not paths:
+            raise KeyError(f"No partition matches selectors {selectors}.")
+        if columns is None:
+            columns = list(self.__catalog[paths[0]]['columns'])
+        loaded = {}
+        for name in columns:
+            parts = []
+            for path in paths:
+                meta = self.__catalog[path]['columns'].get(name)
+                if meta is None:
+                    raise KeyError(f"Column {name} must exist in partition "
+                            f"{path}.")
+                array = np.load(self.__store_dir / path / meta['file'],
+                        mmap_mode='r')
+                if meta['kind'] == 'category':
+                    array = np.asarray(meta['categories']).take(array)
+                parts.append(array)
+            loaded[name] = parts[0] if len(parts) == 1 else np.concatenate(
+                    parts)
+        return pi_dataset.AlignedColumns(loaded)
+
+def parse_args(args):
+    """Input argument parser.
+
+    Args:
+        args (list): Input arguments as taken from command line execution via
+            sys.argv[1:].
+
+    Returns:
+        parsed_args (dict): Parsed input arguments keyed by argument name.
+    """
+    parser = argparse.ArgumentParser(
+            description="Partitioned columnar store of experiment CSV files.")
+    mode_group = parser.add_mutually_exclusive_group(required=True)
+    mode_group.add_argument('-i', '--ingest', metavar='SOURCE_DIR',
+            help="Ingest the CSV folder tree under SOURCE_DIR.")
+    mode_group.add_argument('-c', '--catalog', action='store_true',
+            help="List store partitions.")
+    parser.add_argument('--store_dir', required=True,
+            help="Store root directory.")
+    parser.add_argument('--pattern', default=DEFAULT_PATTERN,
+            help="Regular expression matched against each CSV path relative "
+                 "to SOURCE_DIR with named groups experiment, variable, and "
+                 "node.")
+    return vars(parser.parse_args(args))
+
+def main(args):
+    """Creation or inspection of a dataset store.
+
+    Args:
+        args (list): Arguments as provided by sys.argv.
+    """
+    parsed_args = parse_args(args)
+    logging.basicConfig(level=logging.INFO,
+            format='%(asctime)s   %(levelname)-8s   %(message)s')
+    store = DatasetStore(parsed_args['store_dir'])
+    if parsed_args['ingest']:
+        written = store.ingest(parsed_args['ingest'], parsed_args['pattern'])
+        print(f"Wrote {len(written)} of {len(store.catalog)} partitions.")
+    else:
+        for path in store.partitions():
+            meta = store.catalog[path]
+            print(f"{path}: {meta['rows']} rows, columns "
+                    f"{list(meta['columns'])}")
+
+if __name__ == "__main__":
+    """Script execution."""
+    main(sys.argv[1:])
@@ -0,0 +1,491 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Parameter sweep experiments of the beacon advertiser and scanner.
+
+A sweep runs one cell per combination of the advertiser and scanner
+parameter values listed in its grid, e.g., every tx_power and interval.
+Each cell runs in its own process, either with the hardware (pi_pact
+advertising and scanning simultaneously with the cell configuration) or
+with a simulated radio link, and writes a scan file tagged with the cell
+parameters. Cells share the Bluetooth radio on hardware and so run one after
+the other, while simulated cells, and the analysis of every cell, run in
+parallel. The sweep ends with a summary table of the detection rate and
+RSSI statistics of the advertised beacon per cell.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import itertools
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
+import pi_compress
+import pi_pact
+from pathlib import Path
+import sys
+from uuid import uuid1
+import yaml
+
+# Default configuration
+DEFAULT_CONFIG = {
+    'backend': 'simulated',
+    'duration': 60.0,
+    'output_dir': 'sweep',
+    'workers': os.cpu_count(),
+    'base_config': None,
+    'grid': {},
+    'simulation': {}
+    }
+DEFAULT_SIMULATION = {
+    'distance': 2.0,
+    'path_loss_exponent': 2.0,
+    'reference_loss': 41.0,
+    'rssi_noise': 2.0,
+    'packet_loss': 0.2,
+    'sensitivity': -95.0,
+    'seed': 0
+    }
+
+# Universal settings
+BACKENDS = ['hardware', 'simulated']
+ROLES = ['advertiser', 'scanner']
+SIMULATED_ADDRESS = "00:00:00:00:00:01"
+SIMULATED_UUID = "00000000-0000-0000-0000-000000000001"
+SCAN_COLUMNS = ['ADDRESS', 'TIMESTAMP', 'UUID', 'MAJOR', 'MINOR',
+        'TX POWER', 'RSSI']
+RSSI_STATISTICS = ['RSSI MEAN', 'RSSI STD', 'RSSI MEDIAN', 'RSSI MIN',
+        'RSSI MAX']
+
+def expand_grid(grid):
+    """Every combination of the grid parameter values.
+
+    Args:
+        grid (dict): Lists of parameter values keyed by parameter name, keyed
+            by role ('advertiser' or 'scanner').
+
+    Returns:
+        List of cells, each a dictionary of parameter values keyed by
+        parameter name, keyed by role.
+    """
+    parameters = [(role, key) for role in ROLES
+            for key in grid.get(role) or {}]
+    cells = []
+    for values in itertools.product(*[grid[role][key]
+        for role, key in parameters]):
+        cell = {role: {} for role in ROLES}
+        for (role, key), value in zip(parameters, values):
+            cell[role][key] = value
+        cells.append(cell)
+    return cells
+
+def cell_tag(cell):
+    """File name tag of a cell, e.g., 'tx_power=-10_interval=200'."""
+    return '_'.join(f"{key}={value}" for role in ROLES
+            for key, value in cell[role].items()) or 'base'
+
+def column_name(key):
+    """Summary column name of a parameter, e.g., 'TX POWER'."""
+    return key.upper().replace('_', ' ')
+
+def simulate_cell(config, duration, simulation):
+    """Scans of the advertised beacon over a simulated radio link.
+
+    The advertiser transmits every interval at tx_power (dBm), received at
+    the given distance with log-distance path loss, Gaussian RSSI noise, and
+    independent packet loss, and only above the receiver sensitivity. Like
+    BeaconService.scan, each back-to-back scan window of revisit seconds
+    reports the last advertisement received in it.
+    Every cell draws the same random numbers for the same seed, so that
+    cells differ by their parameters rather than by chance.
+
+    Args:
+        config (dict): Cell configuration with 'advertiser' and 'scanner'
+            settings.
+        duration (float): Cell duration (s).
+        simulation (dict): Radio link settings, see DEFAULT_SIMULATION.
+
+    Returns:
+        Advertisements in a pandas.DataFrame with scan file columns.
+    """
+    advertiser, scanner = config['advertiser'], config['scanner']
+    rng = np.random.default_rng(simulation['seed'])
+    windows = int(duration//scanner['revisit'])
+    transmissions = scanner['revisit']*1000/advertiser['interval']
+    # Whole transmissions per window, plus one more with the remainder's
+    # probability
+    count = int(transmissions)+(rng.random(windows)
+            < transmissions-int(transmissions))
+    slots = np.arange(int(np.ceil(transmissions)))
+    rssi = advertiser['tx_power']-simulation['reference_loss'] \
+            -10*simulation['path_loss_exponent'] \
+            *np.log10(simulation['distance']) \
+            +rng.normal(0, simulation['rssi_noise'], (windows, len(slots)))
+    lost = rng.random((windows, len(slots))) < simulation['packet_loss']
+    received = (slots < count[:, None]) & ~lost \
+            & (rssi >= simulation['sensitivity'])
+    detected = received.any(axis=1)
+    last = len(slots)-1-np.argmax(received[:, ::-1], axis=1)
+    window = np.flatnonzero(detected)
+    timestamps = pd.Timestamp('2020-01-01') \
+            +pd.to_timedelta(window*scanner['revisit'], unit='s')
+    return pd.DataFrame({'ADDRESS': SIMULATED_ADDRESS,
+        'TIMESTAMP': timestamps, 'UUID': advertiser['uuid'],
+        'MAJOR': advertiser['major'], 'MINOR': advertiser['minor'],
+        'TX POWER': advertiser['tx_power'],
+        'RSSI': np.round(rssi[window, last[window]]).astype(np.int64)},
+        columns=SCAN_COLUMNS)
+
+def run_hardware_cell(config_file, scan_file):
+    """Advertise and scan with a cell configuration, in its own process.
+
+    Args:
+        config_file (pathlib.Path): Cell pi_pact configuration YAML.
+        scan_file (pathlib.Path): Tagged scan output file.
+    """
+    advertisements = pi_pact.main(['-b', '--config_yml', str(config_file)])
+    if advertisements is None:
+        sys.exit(1)
+    advertisements.to_csv(scan_file, index_label='SCAN')
+
+def run_simulated_cell(config, duration, simulation, scan_file):
+    """Simulate a cell and write its tagged scan file."""
+    simulate_cell(config, duration, simulation).to_csv(scan_file,
+            index_label='SCAN')
+
+def summarize_cell(scan_file, config, duration):
+    """Detection rate and RSSI statistics of the advertised beacon.
+
+    Args:
+        scan_file (pathlib.Path): Cell scan file.
+        config (dict): Cell configuration with 'advertiser' and 'scanner'
+            settings.
+        duration (float): Cell duration (s).
+
+    Returns:
+        Dictionary of DETECTIONS, DETECTION RATE (fraction of the
+        back-to-back scan windows of revisit seconds in the duration in
+        which the beacon was heard), and RSSI statistics.
+    """
+    advertiser = config['advertiser']
+    advertisements = pi_compress.read_scan(scan_file)
+    target = (advertisements['MAJOR'] == advertiser['major']) \
+            & (advertisements['MINOR'] == advertiser['minor']) \
+            & (advertisements['UUID'].astype(str).str.lower()
+                    == advertiser['uuid'].lower())
+    rssi = advertisements.loc[target, 'RSSI'].to_numpy(dtype=np.float64)
+    windows = max(1, int(duration//config['scanner']['revisit']))
+    summary = {'DETECTIONS': len(rssi),
+            'DETECTION RATE': min(1.0, len(rssi)/windows)}
+    if len(rssi):
+        statistics = [rssi.mean(), rssi.std(), np.median(rssi), rssi.min(),
+                rssi.max()]
+    else:
+        statistics = [np.nan]*len(RSSI_STATISTICS)
+    summary.update(zip(RSSI_STATISTICS, statistics))
+    return summary
+
+class Sweep(object):
+    """Instantiates a parameter sweep.
+
+    Attributes:
+        backend (str): 'hardware' or 'simulated'.
+        duration (float, int): Advertising and scanning time (s) per cell.
+        output_dir (pathlib.Path): Directory of the tagged cell files and
+            the summary.
+        workers (int): Number of cells simulated or analyzed in parallel.
+        base_config (str, pathlib.Path): pi_pact configuration YAML onto
+            which the parameters of each cell are set. Required for the
+            hardware backend, simulated cells default to the pi_pact
+            advertiser defaults and a revisit of 1 s.
+        grid (dict): Lists of values of each swept parameter, keyed by role
+            ('advertiser' or 'scanner') and parameter name.
+        simulation (dict): Simulated radio link settings, see
+            DEFAULT_SIMULATION.
+    """
+
+    def __init__(self, **kwargs):
+        """Instance initialization.
+
+        Args:
+            **kwargs: Keyword arguments corresponding to instance attributes.
+                Any unassociated keyword arguments are ignored.
+        """
+        for key, value in DEFAULT_CONFIG.items():
+            if key in kwargs and kwargs[key] is not None:
+                setattr(self, key, kwargs[key])
+            else:
+                setattr(self, key, value)
+
+    @property
+    def backend(self):
+        """Sweep backend getter."""
+        return self.__backend
+
+    @backend.setter
+    def backend(self, value):
+        """Sweep backend setter.
+
+        Raises:
+            ValueError: Sweep backend must be one of BACKENDS.
+        """
+        if value not in BACKENDS:
+            raise ValueError(f"Sweep backend must be one of {BACKENDS}.")
+        self.__backend = value
+
+    @property
+    def duration(self):
+        """Cell duration getter."""
+        return self.__duration
+
+    @duration.setter
+    def duration(self, value):
+        """Cell duration setter.
+
+        Raises:
+            TypeError: Sweep duration must be a float or integer.
+            ValueError: Sweep duration must be strictly positive.
+        """
+        if not isinstance(value, (float, int)):
+            raise TypeError("Sweep duration must be a float or integer.")
+        elif value <= 0:
+            raise ValueError("Sweep duration must be strictly positive.")
+        self.__duration = value
+
+    @property
+    def output_dir(self):
+        """Output directory getter."""
+        return self.__output_dir
+
+    @output_dir.setter
+    def output_dir(self, value):
+        """Output directory setter.
+
+        Raises:
+            TypeError: Sweep output directory must be a string or Path.
+        """
+        if not isinstance(value, (str, Path)):
+            raise TypeError("Sweep output directory must be a string or "
+                    "Path.")
+        self.__output_dir = Path(value)
+
+    @property
+    def workers(self):
+        """Parallel workers getter."""
+        return self.__workers
+
+    @workers.setter
+    def workers(self, value):
+        """Parallel workers setter.
+
+        Raises:
+            TypeError: Sweep workers must be an integer.
+            ValueError: Sweep workers must be strictly positive.
+        """
+        if not isinstance(value, int):
+            raise TypeError("Sweep workers must be an integer.")
+        elif value <= 0:
+            raise ValueError("Sweep workers must be strictly positive.")
+        self.__workers = value
+
+    @property
+    def base_config(self):
+        """Base pi_pact configuration getter."""
+        return self.__base_config
+
+    @base_config.setter
+    def base_config(self, value):
+        """Base pi_pact configuration setter.
+
+        Raises:
+            TypeError: Sweep base config must be a string, Path, or
+                NoneType.
+        """
+        if value is not None and not isinstance(value, (str, Path)):
+            raise TypeError("Sweep base config must be a string, Path, or "
+                    "NoneType.")
+        self.__base_config = value
+
+    @property
+    def grid(self):
+        """Parameter grid getter."""
+        return self.__grid
+
+    @grid.setter
+    def grid(self, value):
+        """Parameter grid setter.
+
+        Raises:
+            TypeError: Sweep grid must be a dictionary of roles.
+            TypeError: Sweep grid values must be lists.
+        """
+        if not isinstance(value, dict) or set(value)-set(ROLES):
+            raise TypeError(f"Sweep grid must be a dictionary of roles "
+                    f"{ROLES}.")
+        for parameters in value.values():
+            if any(not isinstance(values, list)
+                    for values in (parameters or {}).values()):
+                raise TypeError("Sweep grid values must be lists.")
+        self.__grid = value
+
+    @property
+    def simulation(self):
+        """Simulated radio link settings getter."""
+        return self.__simulation
+
+    @simulation.setter
+    def simulation(self, value):
+        """Simulated radio link settings setter.
+
+        Raises:
+            TypeError: Sweep simulation must be a dictionary.
+        """
+        if not isinstance(value, dict):
+            raise TypeError("Sweep simulation must be a dictionary.")
+        self.__simulation = {**DEFAULT_SIMULATION, **value}
+
+    def load_base_config(self):
+        """Base pi_pact configuration with the defaults of missing keys.
+
+        Advertiser and scanner keys missing from the base config take their
+        pi_pact.DEFAULT_CONFIG values, as in pi_pact.load_config. The
+        advertiser UUID is fixed for the whole sweep, so that the advertised
+        beacon can be told apart in every cell.
+
+        Raises:
+            ValueError: Sweep base config must be given for the hardware
+                backend.
+        """
+        if self.base_config is None:
+            if self.backend == 'hardware':
+                raise ValueError("Sweep base config must be given for the "
+                        "hardware backend.")
+            config = {}
+        else:
+            with open(self.base_config, 'r') as f:
+                config = yaml.load(f, Loader=yaml.SafeLoader) or {}
+        for role in ROLES:
+            config[role] = {**copy.deepcopy(pi_pact.DEFAULT_CONFIG[role]),
+                    **(config.get(role) or {})}
+        if not config['advertiser'].get('uuid'):
+            config['advertiser']['uuid'] = SIMULATED_UUID \
+                    if self.backend == 'simulated' else str(uuid1())
+        return config
+
+    def cell_config(self, base, cell):
+        """Base configuration with the parameters of a cell set."""
+        config = copy.deepcopy(base)
+        for role in ROLES:
+            config[role] = {**config.get(role, {}), **cell[role]}
+            config[role]['timeout'] = self.duration
+        # Tag the log file of each cell too
+        handlers = config.get('logger', {}).get('config', {}) \
+                .get('handlers', {})
+        if 'filename' in handlers.get('file', {}):
+            handlers['file']['filename'] = str(
+                    self.output_dir/f"pi_pact_{cell_tag(cell)}.log")
+        return config
+
+    def run(self):
+        """Run every cell of the sweep and summarize them.
+
+        Returns:
+            Summary in a pandas.DataFrame with one row per cell: TAG, the
+            swept parameters, DETECTIONS, DETECTION RATE, and RSSI
+            statistics. Also written to summary.csv in the output directory.
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        base = self.load_base_config()
+        cells = expand_grid(self.grid)
+        configs = [self.cell_config(base, cell) for cell in cells]
+        scan_files = [self.output_dir/f"scan_{cell_tag(cell)}.csv"
+                for cell in cells]
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers,
+                mp_context=context) as executor:
+            if self.backend == 'simulated':
+                runs = [executor.submit(run_simulated_cell, config,
+                    self.duration, self.simulation, scan_file)
+                    for config, scan_file in zip(configs, scan_files)]
+                for run in runs:
+                    run.result()
+                analyses = [executor.submit(summarize_cell, scan_file,
+                    config, self.duration)
+                    for config, scan_file in zip(configs, scan_files)]
+                completed = list(range(len(cells)))
+            else:
+                # The radio is shared, so cells run one at a time, each in a
+                # fresh process, while finished cells are analyzed
+                completed, analyses = [], []
+                for i, (cell, config, scan_file) in enumerate(zip(cells,
+                    configs, scan_files)):
+                    config_file = self.output_dir \
+                            /f"config_{cell_tag(cell)}.yml"
+                    with open(config_file, 'w') as f:
+                        yaml.safe_dump(config, f)
+                    process = context.Process(target=run_hardware_cell,
+                            args=(config_file, scan_file))
+                    process.start()
+                    process.join()
+                    if process.exitcode == 0:
+                        completed.append(i)
+                        analyses.append(executor.submit(summarize_cell,
+                            scan_file, config, self.duration))
+                    else:
+                        print(f"Cell {cell_tag(cell)} failed.",
+                                file=sys.stderr)
+            rows = []
+            for i, analysis in zip(completed, analyses):
+                rows.append({'TAG': cell_tag(cells[i]),
+                    **{column_name(key): value for role in ROLES
+                        for key, value in cells[i][role].items()},
+                    **analysis.result()})
+        summary = pd.DataFrame(rows)
+        summary.to_csv(self.output_dir/'summary.csv', index=False)
+        return summary
+
+def parse_args(args):
+    """Input argument parser.
+
+    Args:
+        args (list): Input arguments as taken from command line execution via
+            sys.argv[1:].
+
+    Returns:
+        parsed_args (dict): Parsed input arguments keyed by argument name.
+    """
+    parser = argparse.ArgumentParser(
+            description="Run a parameter sweep of the beacon advertiser and "
+                        "scanner.")
+    parser.add_argument('config_yml', help="Sweep configuration YAML.")
+    parser.add_argument('--backend', choices=BACKENDS,
+            help="Hardware or simulated backend.")
+    parser.add_argument('--duration', type=float,
+            help="Advertising and scanning time (s) per cell.")
+    parser.add_argument('--output_dir', help="Output directory.")
+    parser.add_argument('--workers', type=int,
+            help="Cells simulated or analyzed in parallel.")
+    return vars(parser.parse_args(args))
+
+def main(args):
+    """Parameter sweep.
+
+    Args:
+        args (list): Arguments as provided by sys.argv.
+
+    Returns:
+        Sweep summary in a pandas.DataFrame.
+    """
+    parsed_args = parse_args(args)
+    with open(parsed_args['config_yml'], 'r') as f:
+        config = yaml.load(f, Loader=yaml.SafeLoader)
+    config.update({key: value for key, value in parsed_args.items()
+        if key in DEFAULT_CONFIG and value is not None})
+    summary = Sweep(**config).run()
+    print(summary.to_string(index=False))
+    return summary
+
+if __name__ == "__main__":
+    """Script execution."""
+    main(sys.argv[1:])
@@ -0,0 +1,337 @@
+#!/usr/bin/python3
+# -*- mode: python; coding: utf-8 -*-
+"""Time-series analysis of RSSI over scan timestamps.
+
+Timestamps are parsed once into int64 nanoseconds and each beacon's RSSI is
+resampled onto a common regular time grid. Rolling statistics and spectral
+power are then computed over the whole (beacon, time bin) array at once so
+that multi-hour scans never fall back to per-row Python loops.
+
+Scans recorded by different Pis are put on a common clock by estimating each
+node's clock offset and drift from beacons observed by all of them and
+rewriting its timestamps in bulk.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pandas as pd
+import warnings
+
+# Universal settings
+NS_PER_S = 1000000000
+
+def parse_timestamps(timestamps):
+    """Parse timestamps into int64 nanoseconds since the epoch.
+
+    Args:
+        timestamps (array_like): Timestamp strings or datetimes, e.g., a scan
+            file TIMESTAMP column.
+
+    Returns:
+        numpy.ndarray of int64 nanoseconds.
+    """
+    timestamps = pd.Series(timestamps)
+    try:
+        parsed = pd.to_datetime(timestamps)
+    except ValueError:
+        # Newer pandas infers one format from the first value, so timestamps
+        # with and without fractional seconds need the general ISO parser
+        parsed = pd.to_datetime(timestamps, format='ISO8601')
+    return parsed.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+def resample(times, values, groups, period):
+    """Resample grouped values onto a common regular time grid.
+
+    Values falling in the same group and time bin are averaged. Bins without
+    any values are NaN.
+
+    Args:
+        times (numpy.ndarray): int64 nanosecond timestamps.
+        values (numpy.ndarray): Values to resample, e.g., RSSI.
+        groups (numpy.ndarray): Integer group code of each value in
+            [0, number of groups).
+        period (float): Grid period (s).
+
+    Returns:
+        Tuple of grid start times as int64 nanoseconds with shape (bins,) and
+        resampled values with shape (groups, bins).
+    """
+    times = np.asarray(times, dtype=np.int64)
+    groups = np.asarray(groups, dtype=np.int64)
+    period_ns = int(round(period*NS_PER_S))
+    start = times.min()
+    bins = (times-start)//period_ns
+    n_bins = int(bins.max())+1
+    n_groups = int(groups.max())+1
+    # flat (group, bin) index so both sums are a single bincount each
+    cells = groups*n_bins+bins
+    sums = np.bincount(cells, weights=values, minlength=n_groups*n_bins)
+    counts = np.bincount(cells, minlength=n_groups*n_bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums/counts
+    grid = start+np.arange(n_bins, dtype=np.int64)*period_ns
+    return grid, means.reshape(n_groups, n_bins)
+
+def rolling_mean_std(values, window):
+    """Trailing rolling mean and standard deviation ignoring NaN.
+
+    Computed from cumulative sums along the last axis so cost does not
+    depend on window length.
+
+    Args:
+        values (numpy.ndarray): Regularly sampled values, time along last
+            axis.
+        window (int): Window length (samples).
+
+    Returns:
+        Tuple of rolling mean and rolling population standard deviation with
+        the same shape as values. Windows without any values are NaN.
+    """
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    def trailing_sum(x):
+        cumulative = np.cumsum(x, axis=-1, dtype=np.float64)
+        cumulative[..., window:] -= cumulative[..., :-window].copy()
+        return cumulative
+    counts = trailing_sum(valid)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = trailing_sum(filled)/counts
+        variance = trailing_sum(filled**2)/counts-mean**2
+    return mean, np.sqrt(np.maximum(variance, 0.0))
+
+def rolling_median(values, window):
+    """Trailing rolling median ignoring NaN.
+
+    Args:
+        values (numpy.ndarray): Regularly sampled values, time along last
+            axis.
+        window (int): Window length (samples).
+
+    Returns:
+        Rolling median with the same shape as values. Windows without any
+        values are NaN.
+    """
+    pad = np.full(values.shape[:-1]+(window-1,), np.nan)
+    windows = sliding_window_view(np.concatenate((pad, values), axis=-1),
+            window, axis=-1)
+    # all-NaN windows are expected before a beacon is first seen
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(windows, axis=-1)
+
+def power_spectrum(values, period):
+    """One-sided power spectrum of regularly sampled values.
+
+    Gaps are filled by linear interpolation and each series has its mean
+    removed before transforming so drift appears at low frequency and
+    periodic interference as distinct peaks.
+
+    Args:
+        values (numpy.ndarray): Regularly sampled values, time along last
+            axis.
+        period (float): Sample period (s).
+
+    Returns:
+        Tuple of frequencies (Hz) and power with time axis replaced by
+        frequency.
+    """
+    values = np.atleast_2d(values)
+    filled = np.empty_like(values)
+    samples = np.arange(values.shape[-1])
+    for i, series in enumerate(values):
+        valid = ~np.isnan(series)
+        if valid.any():
+            filled[i] = np.interp(samples, samples[valid], series[valid])
+        else:
+            filled[i] = 0.0
+    filled -= filled.mean(axis=-1, keepdims=True)
+    power = np.abs(np.fft.rfft(filled, axis=-1))**2/values.shape[-1]
+    return np.fft.rfftfreq(values.shape[-1], d=period), power
+
+def beacon_series(data, group_by, period):
+    """Resample RSSI of each beacon in a scan onto a regular time grid.
+
+    Args:
+        data (pandas.DataFrame): Scan data with TIMESTAMP, RSSI, and
+            group_by columns.
+        group_by (list): Beacon identifier columns.
+        period (float): Grid period (s).
+
+    Returns:
+        Tuple of beacon labels, grid start times as numpy.datetime64, and
+        resampled RSSI with shape (beacons, bins).
+    """
+    grouped = data.groupby(group_by, sort=True)
+    labels = ["/".join(map(str, key if isinstance(key, tuple) else (key,)))
+            for key in grouped.size().index]
+    grid, rssi = resample(parse_timestamps(data['TIMESTAMP']),
+            data['RSSI'].to_numpy(dtype=np.float64), grouped.ngroup(),
+            period)
+    return labels, grid.view('datetime64[ns]'), rssi
+
+def beacon_codes(frames, group_by):
+    """Integer beacon codes shared across several scan datasets.
+
+    Args:
+        frames (list): pandas.DataFrame of each dataset with group_by
+            columns.
+        group_by (list): Beacon identifier columns.
+
+    Returns:
+        List of numpy.ndarray codes, one per frame, where equal codes denote
+        the same beacon in every frame.
+    """
+    combined = pd.concat([frame[group_by] for frame in frames],
+            ignore_index=True)
+    codes = combined.groupby(group_by, sort=False).ngroup().to_numpy()
+    return np.split(codes, np.cumsum([len(frame) for frame in frames])[:-1])
+
+def detection_series(times, codes, n_groups, start, n_bins, resolution):
+    """Per-beacon advertisement counts on a regular time grid.
+
+    Args:
+        times (numpy.ndarray): int64 nanosecond timestamps.
+        codes (numpy.ndarray): Beacon code of each advertisement.
+        n_groups (int): Number of beacon codes.
+        start (int): Grid start time (ns).
+        n_bins (int): Number of grid bins.
+        resolution (float): Grid period (s).
+
+    Returns:
+        numpy.ndarray of counts with shape (n_groups, n_bins).
+    """
+    bins = (np.asarray(times, dtype=np.int64)-start)//int(round(
+        resolution*NS_PER_S))
+    codes = np.asarray(codes, dtype=np.int64)
+    valid = (bins >= 0) & (bins < n_bins)
+    counts = np.bincount(codes[valid]*n_bins+bins[valid],
+            minlength=n_groups*n_bins)
+    return counts.reshape(n_groups, n_bins).astype(np.float64)
+
+def estimate_offset(ref_times, ref_codes, node_times, node_codes,
+        resolution=0.25, max_lag=60.0):
+    """Estimate constant clock offset of a node relative to a reference.
+
+    Beacons seen by both scanners produce matching patterns of
+    advertisement bursts, e.g., when a beacon starts, stops, or moves in and
+    out of range. The per-beacon detection series of both nodes are cross
+    correlated with FFTs, summed over all co-observed beacons, and the peak
+    lag is refined by parabolic interpolation. Memory grows with the number
+    of beacons times the recording length over resolution.
+
+    Args:
+        ref_times (numpy.ndarray): Reference int64 nanosecond timestamps.
+        ref_codes (numpy.ndarray): Reference beacon codes.
+        node_times (numpy.ndarray): Node int64 nanosecond timestamps.
+        node_codes (numpy.ndarray): Node beacon codes, see beacon_codes.
+        resolution (float): Correlation grid period (s). Defaults to 0.25,
+            finer than a scan window so the phase between the nodes' scans
+            is resolved.
+        max_lag (float): Largest offset searched (s). Defaults to 60.
+
+    Returns:
+        Tuple of offset (s) to subtract from node timestamps and peak
+        normalized correlation score in [-1, 1]. Offset is NaN if no beacon
+        was seen by both nodes.
+    """
+    # Anchor grid on reference scan times so every call bins them alike
+    step = int(round(resolution*NS_PER_S))
+    start = int(ref_times.min())
+    if node_times.min() < start:
+        start -= -(-(start-int(node_times.min()))//step)*step
+    stop = max(ref_times.max(), node_times.max())
+    n_bins = int((stop-start)//step)+1
+    n_groups = int(max(ref_codes.max(), node_codes.max()))+1
+    ref = detection_series(ref_times, ref_codes, n_groups, start, n_bins,
+            resolution)
+    node = detection_series(node_times, node_codes, n_groups, start, n_bins,
+            resolution)
+    # Standardize each co-observed beacon so busy beacons do not dominate
+    shared = (ref.std(axis=1) > 0) & (node.std(axis=1) > 0)
+    if not shared.any():
+        return np.nan, 0.0
+    ref, node = [(x[shared]-x[shared].mean(axis=1, keepdims=True))
+            / x[shared].std(axis=1, keepdims=True) for x in (ref, node)]
+    n_fft = 1 << int(2*n_bins-1).bit_length()
+    correlation = np.fft.irfft(np.conj(np.fft.rfft(ref, n_fft))
+            * np.fft.rfft(node, n_fft), n_fft).sum(axis=0)
+    correlation /= shared.sum()*n_bins
+    # Negative lags wrap to the end of the circular correlation
+    max_bins = min(int(max_lag/resolution), n_bins-1)
+    lags = np.arange(-max_bins, max_bins+1)
+    values = correlation[lags]
+    peak = int(np.argmax(values))
+    shift = 0.0
+    if 0 < peak < values.size-1:
+        below, at, above = values[peak-1:peak+2]
+        curvature = below-2*at+above
+        if curvature < 0:
+            shift = 0.5*(below-above)/curvature
+    return (lags[peak]+shift)*resolution, float(values[peak])
+
+def estimate_clock(ref_times, ref_codes, node_times, node_codes,
+        resolution=0.25, max_lag=60.0, segments=1):
+    """Estimate clock offset and drift of a node relative to a reference.
+
+    A global offset is estimated first. With more than one segment, the
+    residual offset is then estimated in consecutive time segments and a
+    weighted line through the segment offsets gives offset and drift.
+
+    Args:
+        ref_times (numpy.ndarray): Reference int64 nanosecond timestamps.
+        ref_codes (numpy.ndarray): Reference beacon codes.
+        node_times (numpy.ndarray): Node int64 nanosecond timestamps.
+        node_codes (numpy.ndarray): Node beacon codes, see beacon_codes.
+        resolution (float): Correlation grid period (s). Defaults to 0.25.
+        max_lag (float): Largest offset searched (s). Defaults to 60.
+        segments (int): Number of time segments for drift. Defaults to 1,
+            i.e., offset only.
+
+    Returns:
+        Dictionary with 'offset' (s) at node time 't0' (int64 ns), 'drift'
+        (s/s), and 'score' (mean correlation score) to use with
+        correct_timestamps.
+    """
+    offset, score = estimate_offset(ref_times, ref_codes, node_times,
+            node_codes, resolution, max_lag)
+    t0 = int(node_times.min())
+    clock = {'offset': float(offset), 'drift': 0.0, 't0': t0, 'score': score}
+    if segments <= 1 or np.isnan(offset):
+        return clock
+    shifted = node_times-int(round(offset*NS_PER_S))
+    edges = np.linspace(shifted.min(), shifted.max(), segments+1)
+    midpoints, offsets, scores = [], [], []
+    for lower, upper in zip(edges[:-1], edges[1:]):
+        in_ref = (ref_times >= lower) & (ref_times < upper)
+        in_node = (shifted >= lower) & (shifted < upper)
+        if not in_ref.any() or not in_node.any():
+            continue
+        residual, segment_score = estimate_offset(ref_times[in_ref],
+                ref_codes[in_ref], shifted[in_node], node_codes[in_node],
+                resolution, max_lag/segments)
+        if np.isnan(residual) or segment_score <= 0:
+            continue
+        midpoints.append((lower+upper)/2+offset*NS_PER_S-t0)
+        offsets.append(offset+residual)
+        scores.append(segment_score)
+    if len(offsets) < 2:
+        return clock
+    drift, intercept = np.polyfit(np.array(midpoints)/NS_PER_S, offsets, 1,
+            w=scores)
+    return {'offset': float(intercept), 'drift': float(drift), 't0': t0,
+            'score': float(np.mean(scores))}
+
+def correct_timestamps(times, clock):
+    """Rewrite node timestamps onto the reference clock.
+
+    Args:
+        times (numpy.ndarray): Node int64 nanosecond timestamps.
+        clock (dict): Node clock estimate, see estimate_clock.
+
+    Returns:
+        numpy.ndarray of corrected int64 nanosecond timestamps.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    correction = (clock['offset']*NS_PER_S
+            + clock['drift']*(times-clock['t0']).astype(np.float64))
+    return times-np.rint(correction).astype(np.int64)